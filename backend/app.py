@@ -1,12 +1,28 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
+import click
 from datetime import date, timedelta
 from services.library_service import LibraryService
+from services.catalog_snapshot import CatalogSnapshotHolder
+from services.popularity import PopularityBoard
+from services.related import RelatedIndex
+from services.report_jobs import ReportJobManager, DONE
+from services.export import csv_chunks, parquet_chunks, RENTAL_EXPORT_COLUMNS, LEDGER_EXPORT_COLUMNS
+from services.fieldsets import FieldSet, attribute, computed
 from models.book import Book, Genre
 from models.reader import Reader, ReaderCategory
-from models.rental import RentalStatus
+from models.rental import Rental, RentalStatus
+from models.branch import Branch
+from models.hold import Hold
 from patterns.factory import StandardBookFactory, ReaderFactory
-from database.db import init_db
+from patterns.strategy import PRICING_STRATEGIES
+from database.db import db, init_db, check_readiness
+from monitoring.profiler import RequestProfiler
+from monitoring.tracing import RequestTracer
+from middleware.admission import AdmissionController
+from middleware.compression import ResponseCompressor
+from cache.invalidation import configure_bus
+import gzip
 import os
 
 app = Flask(__name__)
@@ -15,21 +31,43 @@ CORS(app)
 # Initialize database
 init_db(app)
 
+# Sampled request profiling (see PROFILE_* environment variables)
+RequestProfiler(app)
+
+# Sampled tracing spans (see TRACE_* environment variables)
+RequestTracer(app)
+
+# Priority admission control and load shedding (see ADMISSION_* environment variables)
+admission = AdmissionController(app)
+
+# gzip/brotli response compression (see COMPRESS_* environment variables)
+ResponseCompressor(app)
+
 library = LibraryService()
 book_factory = StandardBookFactory()
 
+# In-memory storage (LIBRARY_STORAGE=memory) keeps the other tables in the database,
+# whose foreign keys to books and readers only SQLite leaves unenforced
+if library.memory_store:
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            raise RuntimeError('LIBRARY_STORAGE=memory needs a SQLite DATABASE_URL')
+    library.memory_store.start(float(os.getenv('LIBRARY_SNAPSHOT_SECONDS', '60')))
 
-@app.route('/api/books', methods=['GET'])
-def get_books():
-    """Get all books or available books only"""
-    available_only = request.args.get('available_only', 'false').lower() == 'true'
-    
-    if available_only:
-        books = library.get_available_books()
-    else:
-        books = library.get_all_books()
-    
-    return jsonify([{
+
+MAX_IDS_PER_REQUEST = 1000
+
+
+def parse_ids(value: str) -> list:
+    """Parse a comma-separated ids query parameter"""
+    ids = [int(id) for id in value.split(',') if id.strip()]
+    if len(ids) > MAX_IDS_PER_REQUEST:
+        raise ValueError(f'At most {MAX_IDS_PER_REQUEST} ids per request')
+    return ids
+
+
+def serialize_book(b: Book) -> dict:
+    return {
         'id': b.id,
         'title': b.title,
         'author': b.author,
@@ -40,7 +78,250 @@ def get_books():
         'available_copies': b.available_copies,
         'value': b.value,
         'is_available': b.is_available()
-    } for b in books])
+    }
+
+
+def serialize_reader(r: Reader) -> dict:
+    return {
+        'id': r.id,
+        'full_name': r.full_name,
+        'address': r.address,
+        'telephone': r.telephone,
+        'category': r.category.value
+    }
+
+
+def serialize_rental(r: Rental) -> dict:
+    return {
+        'id': r.id,
+        'book_id': r.book_id,
+        'reader_id': r.reader_id,
+        'issue_date': r.issue_date.isoformat(),
+        'expected_return_date': r.expected_return_date.isoformat(),
+        'actual_return_date': r.actual_return_date.isoformat() if r.actual_return_date else None,
+        'status': r.status.value,
+        'deposit_paid': r.deposit_paid,
+        'rental_cost': r.rental_cost,
+        'fine_amount': r.fine_amount,
+        'damage_fine': r.damage_fine,
+        'branch_id': r.branch_id,
+        'is_overdue': r.is_overdue()
+    }
+
+
+def serialize_catalog_entry(b: Book) -> dict:
+    return {
+        'id': b.id,
+        'title': b.title,
+        'author': b.author,
+        'genre': b.genre.value,
+        'available_copies': b.available_copies,
+        'total_copies': b.total_copies
+    }
+
+
+def isoformat(value: date) -> str:
+    return value.isoformat()
+
+
+# Fields selectable with `fields=`, matching the serializers above
+BOOK_FIELDS = FieldSet({
+    'id': attribute('id'),
+    'title': attribute('title'),
+    'author': attribute('author'),
+    'genre': attribute('genre', lambda genre: genre.value),
+    'deposit_cost': attribute('deposit_cost'),
+    'base_rental_cost': attribute('base_rental_cost'),
+    'total_copies': attribute('total_copies'),
+    'available_copies': attribute('available_copies'),
+    'value': attribute('value'),
+    'is_available': computed(Book.is_available, 'available_copies')
+})
+
+CATALOG_ENTRY_FIELDS = BOOK_FIELDS.subset(['id', 'title', 'author', 'genre', 'available_copies', 'total_copies'])
+
+READER_FIELDS = FieldSet({
+    'id': attribute('id'),
+    'full_name': attribute('full_name'),
+    'address': attribute('address'),
+    'telephone': attribute('telephone'),
+    'category': attribute('category', lambda category: category.value)
+})
+
+RENTAL_FIELDS = FieldSet({
+    'id': attribute('id'),
+    'book_id': attribute('book_id'),
+    'reader_id': attribute('reader_id'),
+    'issue_date': attribute('issue_date', isoformat),
+    'expected_return_date': attribute('expected_return_date', isoformat),
+    'actual_return_date': attribute('actual_return_date', isoformat),
+    'status': attribute('status', lambda status: status.value),
+    'deposit_paid': attribute('deposit_paid'),
+    'rental_cost': attribute('rental_cost'),
+    'fine_amount': attribute('fine_amount'),
+    'damage_fine': attribute('damage_fine'),
+    'branch_id': attribute('branch_id'),
+    'is_overdue': computed(Rental.is_overdue, 'status', 'expected_return_date')
+})
+
+# Report rows are built (and cached) whole; `fields=` trims them
+ISSUED_BOOK_FIELDS = FieldSet.keys([
+    'rental_id', 'book_title', 'book_author', 'reader_name', 'issue_date', 'expected_return_date',
+    'is_overdue', 'days_overdue'
+])
+LEDGER_FIELDS = FieldSet.keys(name for name, _ in LEDGER_EXPORT_COLUMNS)
+TIMESERIES_FIELDS = FieldSet.keys([
+    'granularity', 'bucket_start', 'genre', 'category', 'rentals_issued', 'returns', 'deposits',
+    'rental_income', 'fines'
+])
+
+
+# In-memory snapshot serving the available-catalog browse endpoints
+catalog = CatalogSnapshotHolder(
+    app,
+    library.book_repo,
+    render_book=lambda b: app.json.dumps(serialize_book(b)),
+    render_entry=lambda b: app.json.dumps(serialize_catalog_entry(b)),
+    refresh_interval=float(os.getenv('CATALOG_REFRESH_SECONDS', '60'))
+)
+catalog.start()
+
+# In-memory most-rented leaderboards, refreshed from the popularity counters
+popularity = PopularityBoard(
+    app,
+    library.popularity_repo,
+    top_n=int(os.getenv('POPULAR_TOP_N', '10')),
+    refresh_interval=float(os.getenv('POPULAR_REFRESH_SECONDS', '60'))
+)
+
+# "Readers also rented" lists, loaded from the neighbours stored by `flask build-related`
+related_books = RelatedIndex(
+    app,
+    library.related_repo,
+    refresh_interval=float(os.getenv('RELATED_REFRESH_SECONDS', '300'))
+)
+
+# Both read book details through SQL joins, which have no books under in-memory storage
+if not library.memory_store:
+    popularity.start()
+    related_books.start()
+
+# Committed writes from any worker invalidate this worker's caches
+invalidation_bus = configure_bus(app.config['SQLALCHEMY_DATABASE_URI'])
+invalidation_bus.subscribe(
+    lambda events: catalog.invalidate([e['id'] for e in events]),
+    on_flush=catalog.invalidate,
+    entities={'book'}
+)
+invalidation_bus.subscribe(
+    lambda events: library.report_flight.invalidate(),
+    on_flush=library.report_flight.invalidate,
+    entities={'book', 'reader', 'rental'}
+)
+invalidation_bus.subscribe(
+    lambda events: popularity.invalidate(),
+    on_flush=popularity.invalidate,
+    entities={'rental'}
+)
+invalidation_bus.subscribe(
+    lambda events: related_books.invalidate(
+        None if any(e['id'] is None for e in events) else [e['id'] for e in events]
+    ),
+    on_flush=related_books.invalidate,
+    entities={'related'}
+)
+invalidation_bus.subscribe(
+    lambda events: library.reader_search.invalidate([e['id'] for e in events]),
+    on_flush=library.reader_search.invalidate,
+    entities={'reader'}
+)
+invalidation_bus.start()
+
+if not library.reader_search_in_database():
+    library.reader_search.preload(app)
+
+
+def json_response(body: str):
+    return app.response_class(body, mimetype='application/json')
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: schema created, database answering and pool not exhausted"""
+    readiness = check_readiness()
+    return jsonify(readiness), 200 if readiness['ready'] else 503
+
+
+@app.route('/api/admission', methods=['GET'])
+def admission_status():
+    """Concurrency slots, queueing and shedding counters per priority class"""
+    return jsonify(admission.status())
+
+
+@app.route('/api/cache/invalidation', methods=['GET'])
+def invalidation_status():
+    """Invalidation bus transport and delivery lag from other workers"""
+    return jsonify({
+        'bus': type(invalidation_bus).__name__,
+        'origin': invalidation_bus.origin,
+        **invalidation_bus.stats.to_dict()
+    })
+
+
+@app.route('/api/cache/reports', methods=['GET'])
+def report_cache_status():
+    """Single-flight and memo counters of the expensive reports"""
+    return jsonify(library.report_flight.stats())
+
+
+@app.route('/api/books', methods=['GET'])
+def get_books():
+    """Get all books, available books only, or the books listed in ids
+    
+    `fields` (comma-separated) limits each book to those fields; only the
+    columns they need are read.
+    """
+    available_only = request.args.get('available_only', 'false').lower() == 'true'
+    
+    try:
+        fields = BOOK_FIELDS.parse(request.args.get('fields'))
+        ids = parse_ids(request.args['ids']) if 'ids' in request.args else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if ids is None and available_only:
+        snapshot = catalog.current()
+        genre = None
+        if 'genre' in request.args:
+            try:
+                genre = Genre[request.args['genre'].upper().replace('-', '_')]
+            except KeyError:
+                return jsonify({'error': f"Unknown genre: {request.args['genre']}"}), 400
+        if fields is not None:
+            ids = snapshot.ids_by_genre[genre] if genre else snapshot.books.keys()
+            return jsonify(BOOK_FIELDS.render_all((snapshot.books[id] for id in ids), fields))
+        if genre:
+            return json_response(snapshot.books_json_for_genre(genre))
+        return json_response(snapshot.books_json)
+    
+    if fields is not None:
+        rows = library.get_book_columns(BOOK_FIELDS.columns(fields), ids, available_only)
+        return jsonify(BOOK_FIELDS.render_all(rows, fields))
+    
+    if ids is not None:
+        books = library.get_books_by_ids(ids)
+        if available_only:
+            books = [b for b in books if b.is_available()]
+    else:
+        books = library.get_all_books()
+    
+    return jsonify([serialize_book(b) for b in books])
 
 
 @app.route('/api/books', methods=['POST'])
@@ -70,18 +351,7 @@ def get_book(book_id):
     if not book:
         return jsonify({'error': 'Book not found'}), 404
     
-    return jsonify({
-        'id': book.id,
-        'title': book.title,
-        'author': book.author,
-        'genre': book.genre.value,
-        'deposit_cost': book.deposit_cost,
-        'base_rental_cost': book.base_rental_cost,
-        'total_copies': book.total_copies,
-        'available_copies': book.available_copies,
-        'value': book.value,
-        'is_available': book.is_available()
-    })
+    return jsonify(serialize_book(book))
 
 
 @app.route('/api/books/<int:book_id>', methods=['DELETE'])
@@ -99,7 +369,7 @@ def delete_book(book_id):
         if has_active_rentals:
             return jsonify({'error': 'Cannot delete book with active rentals'}), 400
         
-        library.book_repo.delete(book_id)
+        library.delete_book(book_id)
         return jsonify({'message': 'Book deleted successfully'}), 200
     except Exception as e:
         return jsonify({'error': f'Failed to delete book: {str(e)}'}), 500
@@ -107,15 +377,43 @@ def delete_book(book_id):
 
 @app.route('/api/readers', methods=['GET'])
 def get_readers():
-    """Get all readers"""
-    readers = library.get_all_readers()
-    return jsonify([{
-        'id': r.id,
-        'full_name': r.full_name,
-        'address': r.address,
-        'telephone': r.telephone,
-        'category': r.category.value
-    } for r in readers])
+    """Get all readers, or only the ones listed in ids (`fields` limits the fields returned)"""
+    try:
+        fields = READER_FIELDS.parse(request.args.get('fields'))
+        ids = parse_ids(request.args['ids']) if 'ids' in request.args else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if fields is not None:
+        return jsonify(READER_FIELDS.render_all(library.get_reader_columns(READER_FIELDS.columns(fields), ids), fields))
+    if ids is not None:
+        readers = library.get_readers_by_ids(ids)
+    else:
+        readers = library.get_all_readers()
+    return jsonify([serialize_reader(r) for r in readers])
+
+
+MAX_READER_SEARCH_RESULTS = 50
+
+
+@app.route('/api/readers/search', methods=['GET'])
+def search_readers():
+    """Find readers by name (prefix, substring or fuzzy) or by telephone prefix"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if not 1 <= limit <= MAX_READER_SEARCH_RESULTS:
+        return jsonify({'error': f'limit must be between 1 and {MAX_READER_SEARCH_RESULTS}'}), 400
+    
+    try:
+        readers = library.search_readers(query, limit)
+    except TimeoutError as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify([serialize_reader(r) for r in readers])
 
 
 @app.route('/api/readers', methods=['POST'])
@@ -144,13 +442,7 @@ def get_reader(reader_id):
     if not reader:
         return jsonify({'error': 'Reader not found'}), 404
     
-    return jsonify({
-        'id': reader.id,
-        'full_name': reader.full_name,
-        'address': reader.address,
-        'telephone': reader.telephone,
-        'category': reader.category.value
-    })
+    return jsonify(serialize_reader(reader))
 
 
 @app.route('/api/readers/<int:reader_id>', methods=['DELETE'])
@@ -174,6 +466,203 @@ def delete_reader(reader_id):
         return jsonify({'error': f'Failed to delete reader: {str(e)}'}), 500
 
 
+def serialize_branch(b: Branch) -> dict:
+    return {
+        'id': b.id,
+        'name': b.name,
+        'address': b.address
+    }
+
+
+@app.route('/api/branches', methods=['GET'])
+def get_branches():
+    """Get all branches"""
+    return jsonify([serialize_branch(b) for b in library.get_branches()])
+
+
+@app.route('/api/branches', methods=['POST'])
+def create_branch():
+    """Create a new branch"""
+    data = request.json
+    
+    try:
+        branch = Branch(id=None, name=data['name'], address=data.get('address', ''))
+        branch.id = library.add_branch(branch)
+        return jsonify(serialize_branch(branch)), 201
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/api/branches/<int:branch_id>/books', methods=['GET'])
+def get_branch_books(branch_id):
+    """Get the books a branch holds, with the branch's own copy counts"""
+    if library.memory_store:
+        return jsonify({'error': 'Branch book listings need LIBRARY_STORAGE=sql'}), 501
+    if not library.branch_repo.get_by_id(branch_id):
+        return jsonify({'error': 'Branch not found'}), 404
+    
+    available_only = request.args.get('available_only', 'false').lower() == 'true'
+    return jsonify([{
+        **serialize_book(book),
+        'branch_total_copies': stock.total_copies,
+        'branch_available_copies': stock.available_copies
+    } for book, stock in library.get_branch_books(branch_id, available_only)])
+
+
+@app.route('/api/branches/<int:branch_id>/rentals', methods=['GET'])
+def get_branch_rentals(branch_id):
+    """Get rentals lent from a branch; status=open returns only those not yet returned"""
+    if not library.branch_repo.get_by_id(branch_id):
+        return jsonify({'error': 'Branch not found'}), 404
+    
+    open_only = request.args.get('status', 'all') == 'open'
+    return jsonify([serialize_rental(r) for r in library.get_branch_rentals(branch_id, open_only)])
+
+
+@app.route('/api/branches/<int:branch_id>/stock/<int:book_id>', methods=['PUT'])
+def set_branch_stock(branch_id, book_id):
+    """Set how many copies of a book a branch holds"""
+    if not library.branch_repo.get_by_id(branch_id):
+        return jsonify({'error': 'Branch not found'}), 404
+    
+    try:
+        total_copies = int(request.json['total_copies'])
+        if total_copies < 0:
+            raise ValueError('total_copies cannot be negative')
+        stock = library.set_branch_stock(branch_id, book_id, total_copies)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if not stock:
+        return jsonify({'error': 'Book not found'}), 404
+    return jsonify({
+        'branch_id': stock.branch_id,
+        'book_id': stock.book_id,
+        'total_copies': stock.total_copies,
+        'available_copies': stock.available_copies
+    })
+
+
+@app.route('/api/books/<int:book_id>/availability', methods=['GET'])
+def get_book_availability(book_id):
+    """Get the branches with a copy of a book on the shelf right now"""
+    availability = library.get_book_availability(book_id)
+    if not availability:
+        return jsonify({'error': 'Book not found'}), 404
+    return jsonify(availability)
+
+
+@app.route('/api/books/popular', methods=['GET'])
+def get_popular_books():
+    """Most rented books this week, this month or of all time, optionally within one genre"""
+    if library.memory_store:
+        return jsonify({'error': 'Popular books need LIBRARY_STORAGE=sql'}), 501
+    window = request.args.get('window', 'week')
+    if window not in ('week', 'month', 'all'):
+        return jsonify({'error': 'window must be week, month or all'}), 400
+    
+    try:
+        genre = Genre[request.args['genre'].upper().replace('-', '_')] if 'genre' in request.args else None
+        limit = int(request.args.get('limit', popularity.top_n))
+    except (ValueError, KeyError) as e:
+        return jsonify({'error': f'Invalid popularity parameters: {str(e)}'}), 400
+    if not 1 <= limit <= popularity.top_n:
+        return jsonify({'error': f'limit must be between 1 and {popularity.top_n}'}), 400
+    
+    return jsonify(list(popularity.current().top(window, genre, limit)))
+
+
+@app.route('/api/books/<int:book_id>/related', methods=['GET'])
+def get_related_books(book_id):
+    """Books most often rented by the readers who rented this one"""
+    if library.memory_store:
+        return jsonify({'error': 'Related books need LIBRARY_STORAGE=sql'}), 501
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    related = related_books.get(book_id)
+    if related is None:
+        if not library.book_repo.get_by_id(book_id):
+            return jsonify({'error': 'Book not found'}), 404
+        related = ()
+    return jsonify(list(related[:max(limit, 0)]))
+
+
+def serialize_hold(h: Hold) -> dict:
+    return {
+        'id': h.id,
+        'book_id': h.book_id,
+        'reader_id': h.reader_id,
+        'placed_at': h.placed_at.isoformat(),
+        'status': h.status.value,
+        'branch_id': h.branch_id,
+        'ready_until': h.ready_until.isoformat() if h.ready_until else None
+    }
+
+
+@app.route('/api/books/<int:book_id>/holds', methods=['POST'])
+def place_hold(book_id):
+    """Join the holds queue of a book with no copy available"""
+    try:
+        reader_id = int(request.json['reader_id'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'reader_id is required'}), 400
+    
+    try:
+        hold = library.place_hold(book_id, reader_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    
+    if not hold:
+        return jsonify({'error': 'Book or reader not found'}), 404
+    return jsonify(serialize_hold(hold)), 201
+
+
+@app.route('/api/books/<int:book_id>/holds', methods=['GET'])
+def get_book_holds(book_id):
+    """Get the open holds on a book in queue order, with estimated availability dates"""
+    if not library.book_repo.get_by_id(book_id):
+        return jsonify({'error': 'Book not found'}), 404
+    return jsonify([{
+        **serialize_hold(entry['hold']),
+        'position': entry['position'],
+        'estimated_available_date': entry['estimated_available_date'].isoformat()
+        if entry['estimated_available_date'] else None
+    } for entry in library.get_book_holds(book_id)])
+
+
+@app.route('/api/books/<int:book_id>/next-available', methods=['GET'])
+def get_next_available(book_id):
+    """Estimate when a copy of a book will be free for a reader joining the queue now"""
+    estimate = library.get_next_available(book_id)
+    if not estimate:
+        return jsonify({'error': 'Book not found'}), 404
+    return jsonify(estimate)
+
+
+@app.route('/api/readers/<int:reader_id>/holds', methods=['GET'])
+def get_reader_holds(reader_id):
+    """Get all holds placed by a reader"""
+    if not library.reader_repo.get_by_id(reader_id):
+        return jsonify({'error': 'Reader not found'}), 404
+    return jsonify([serialize_hold(h) for h in library.get_reader_holds(reader_id)])
+
+
+@app.route('/api/holds/<int:hold_id>', methods=['DELETE'])
+def cancel_hold(hold_id):
+    """Cancel a hold"""
+    try:
+        hold = library.cancel_hold(hold_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    
+    if not hold:
+        return jsonify({'error': 'Hold not found'}), 404
+    return jsonify(serialize_hold(hold))
+
+
 @app.route('/api/rentals', methods=['POST'])
 def create_rental():
     """Rent a book to a reader"""
@@ -184,7 +673,8 @@ def create_rental():
         rental = library.rent_book(
             book_id=int(data['book_id']),
             reader_id=int(data['reader_id']),
-            rental_days=rental_days
+            rental_days=rental_days,
+            branch_id=int(data['branch_id']) if data.get('branch_id') is not None else None
         )
         
         if not rental:
@@ -198,7 +688,8 @@ def create_rental():
             'expected_return_date': rental.expected_return_date.isoformat(),
             'deposit_paid': rental.deposit_paid,
             'rental_cost': rental.rental_cost,
-            'status': rental.status.value
+            'status': rental.status.value,
+            'branch_id': rental.branch_id
         }), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -206,9 +697,18 @@ def create_rental():
 
 @app.route('/api/rentals', methods=['GET'])
 def get_rentals():
-    """Get all rentals or active/overdue rentals"""
+    """Get all rentals or active/overdue rentals (`fields` limits the fields returned)"""
     status = request.args.get('status', 'all')
     
+    try:
+        fields = RENTAL_FIELDS.parse(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if fields is not None:
+        status = status if status in ('active', 'overdue') else 'all'
+        rows = library.get_rental_columns(RENTAL_FIELDS.columns(fields), status)
+        return jsonify(RENTAL_FIELDS.render_all(rows, fields))
+    
     if status == 'active':
         rentals = library.get_active_rentals()
     elif status == 'overdue':
@@ -216,20 +716,7 @@ def get_rentals():
     else:
         rentals = library.rental_repo.get_all()
     
-    return jsonify([{
-        'id': r.id,
-        'book_id': r.book_id,
-        'reader_id': r.reader_id,
-        'issue_date': r.issue_date.isoformat(),
-        'expected_return_date': r.expected_return_date.isoformat(),
-        'actual_return_date': r.actual_return_date.isoformat() if r.actual_return_date else None,
-        'status': r.status.value,
-        'deposit_paid': r.deposit_paid,
-        'rental_cost': r.rental_cost,
-        'fine_amount': r.fine_amount,
-        'damage_fine': r.damage_fine,
-        'is_overdue': r.is_overdue()
-    } for r in rentals])
+    return jsonify([serialize_rental(r) for r in rentals])
 
 
 @app.route('/api/rentals/<int:rental_id>/return', methods=['POST'])
@@ -237,8 +724,16 @@ def return_book(rental_id):
     """Return a book"""
     data = request.json or {}
     damage_level = data.get('damage_level')
+    branch_id = data.get('branch_id')
+    if branch_id is not None:
+        try:
+            branch_id = int(branch_id)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'branch_id must be an integer'}), 400
+    if branch_id is not None and not library.branch_repo.get_by_id(branch_id):
+        return jsonify({'error': 'Branch not found'}), 404
     
-    rental = library.return_book(rental_id, damage_level)
+    rental = library.return_book(rental_id, damage_level, branch_id)
     
     if not rental:
         return jsonify({'error': 'Rental not found or already returned'}), 400
@@ -252,52 +747,50 @@ def return_book(rental_id):
     })
 
 
+@app.route('/api/quotes', methods=['GET'])
+def get_quotes():
+    """Get rental prices for every book by reader category and rental duration"""
+    try:
+        durations = [int(d) for d in request.args.get('days', '7,14,30').split(',')]
+        category_names = request.args.get('categories')
+        if category_names:
+            categories = [ReaderCategory[c.strip().upper()] for c in category_names.split(',')]
+        else:
+            categories = list(ReaderCategory)
+    except (ValueError, KeyError) as e:
+        return jsonify({'error': f'Invalid quote parameters: {str(e)}'}), 400
+    
+    available_only = request.args.get('available_only', 'false').lower() == 'true'
+    return jsonify(library.get_price_quotes(durations, categories, available_only))
+
+
 @app.route('/api/reports/available-books', methods=['GET'])
 def report_available_books():
     """Report on available book collection"""
-    books = library.get_available_books()
-    
-    return jsonify({
-        'total_available': len(books),
-        'books': [{
-            'id': b.id,
-            'title': b.title,
-            'author': b.author,
-            'genre': b.genre.value,
-            'available_copies': b.available_copies,
-            'total_copies': b.total_copies
-        } for b in books]
-    })
+    try:
+        fields = CATALOG_ENTRY_FIELDS.parse(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    snapshot = catalog.current()
+    if fields is not None:
+        return jsonify({
+            'books': CATALOG_ENTRY_FIELDS.render_all(snapshot.books.values(), fields),
+            'total_available': len(snapshot.books)
+        })
+    return json_response(snapshot.report_json)
 
 
 @app.route('/api/reports/issued-books', methods=['GET'])
 def report_issued_books():
     """Report on issued books with overdue indication"""
-    active_rentals = library.get_active_rentals()
-    overdue_rentals = library.get_overdue_rentals()
-    
-    # Get book and reader details
-    result = []
-    for rental in active_rentals:
-        book = library.book_repo.get_by_id(rental.book_id)
-        reader = library.reader_repo.get_by_id(rental.reader_id)
-        
-        result.append({
-            'rental_id': rental.id,
-            'book_title': book.title if book else 'Unknown',
-            'book_author': book.author if book else 'Unknown',
-            'reader_name': reader.full_name if reader else 'Unknown',
-            'issue_date': rental.issue_date.isoformat(),
-            'expected_return_date': rental.expected_return_date.isoformat(),
-            'is_overdue': rental.is_overdue(),
-            'days_overdue': (date.today() - rental.expected_return_date).days if rental.is_overdue() else 0
-        })
-    
-    return jsonify({
-        'total_issued': len(active_rentals),
-        'total_overdue': len(overdue_rentals),
-        'rentals': result
-    })
+    try:
+        fields = ISSUED_BOOK_FIELDS.parse(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    report = library.get_issued_books_report()
+    if fields is not None:
+        report = dict(report, rentals=ISSUED_BOOK_FIELDS.render_all(report['rentals'], fields))
+    return jsonify(report)
 
 
 @app.route('/api/reports/financial-status', methods=['GET'])
@@ -310,10 +803,222 @@ def report_financial_status():
 @app.route('/api/reports/financial-history', methods=['GET'])
 def report_financial_history():
     """Report on financial operations history"""
+    try:
+        fields = LEDGER_FIELDS.parse(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     history = library.get_financial_history()
+    if fields is not None:
+        history = LEDGER_FIELDS.render_all(history, fields)
     return jsonify(history)
 
 
+@app.route('/api/reports/projected-fines', methods=['GET'])
+def report_projected_fines():
+    """Report on overdue fines if all open rentals were returned on a given date"""
+    try:
+        as_of = date.fromisoformat(request.args['as_of']) if 'as_of' in request.args else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(library.get_projected_fines(as_of))
+
+
+@app.route('/api/reports/revenue-projection', methods=['GET'])
+def report_revenue_projection():
+    """Report on rental income under a different pricing strategy"""
+    strategy = request.args.get('strategy', 'tiered').lower()
+    try:
+        return jsonify(library.get_revenue_projection(strategy))
+    except KeyError:
+        return jsonify({'error': f'Unknown pricing strategy: {strategy}'}), 400
+
+
+@app.route('/api/reports/timeseries', methods=['GET'])
+def report_timeseries():
+    """Report on rentals, returns, fines and income per day, week or month"""
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('day', 'week', 'month'):
+        return jsonify({'error': 'granularity must be day, week or month'}), 400
+    
+    try:
+        start = date.fromisoformat(request.args['from']) if 'from' in request.args else None
+        end = date.fromisoformat(request.args['to']) if 'to' in request.args else None
+        genre = Genre[request.args['genre'].upper().replace('-', '_')] if 'genre' in request.args else None
+        category = ReaderCategory[request.args['category'].upper()] if 'category' in request.args else None
+        fields = TIMESERIES_FIELDS.parse(request.args.get('fields'))
+    except (ValueError, KeyError) as e:
+        return jsonify({'error': f'Invalid timeseries parameters: {str(e)}'}), 400
+    
+    series = library.get_timeseries(granularity, start, end, genre, category)
+    if fields is not None:
+        series = TIMESERIES_FIELDS.render_all(series, fields)
+    return jsonify(series)
+
+
+def no_params(body: dict) -> dict:
+    return {}
+
+
+def projected_fines_params(body: dict) -> dict:
+    as_of = date.fromisoformat(body['as_of']) if body.get('as_of') else None
+    return {'as_of': as_of.isoformat() if as_of else None}
+
+
+def revenue_projection_params(body: dict) -> dict:
+    strategy = body.get('strategy', 'tiered').lower()
+    if strategy not in PRICING_STRATEGIES:
+        raise ValueError(f'Unknown pricing strategy: {strategy}')
+    return {'strategy': strategy}
+
+
+# Reports that can be computed in the background: name -> (validate parameters, compute)
+REPORT_JOBS = {
+    'financial-history': (no_params, lambda params: library.get_financial_history()),
+    'financial-status': (no_params, lambda params: library.get_financial_status()),
+    'issued-books': (no_params, lambda params: library.get_issued_books_report()),
+    'projected-fines': (
+        projected_fines_params,
+        lambda params: library.get_projected_fines(date.fromisoformat(params['as_of']) if params['as_of'] else None)
+    ),
+    'revenue-projection': (
+        revenue_projection_params,
+        lambda params: library.get_revenue_projection(params['strategy'])
+    ),
+}
+
+report_jobs = ReportJobManager(
+    app,
+    {name: run for name, (_, run) in REPORT_JOBS.items()},
+    directory=os.getenv('REPORT_JOBS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'report_jobs')),
+    max_workers=int(os.getenv('REPORT_JOBS_WORKERS', '2')),
+    retention_seconds=float(os.getenv('REPORT_JOBS_RETENTION_HOURS', '24')) * 3600,
+    max_jobs=int(os.getenv('REPORT_JOBS_MAX', '200'))
+)
+
+
+@app.route('/api/reports/<name>/jobs', methods=['POST'])
+def create_report_job(name):
+    """Start computing a report in the background, or return the identical job still in progress"""
+    if name not in REPORT_JOBS:
+        return jsonify({'error': f'Unknown report: {name}'}), 404
+    
+    try:
+        params = REPORT_JOBS[name][0](request.get_json(silent=True) or {})
+    except (ValueError, KeyError) as e:
+        return jsonify({'error': f'Invalid report parameters: {str(e)}'}), 400
+    
+    job = report_jobs.submit(name, params)
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/api/reports/jobs', methods=['GET'])
+def list_report_jobs():
+    """List retained report jobs, newest first"""
+    return jsonify([job.to_dict() for job in report_jobs.list()])
+
+
+@app.route('/api/reports/jobs/<job_id>', methods=['GET'])
+def get_report_job(job_id):
+    """Get the status of a report job"""
+    job = report_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/reports/jobs/<job_id>/result', methods=['GET'])
+def get_report_job_result(job_id):
+    """Download a finished report; sent gzip-encoded to clients that accept it"""
+    job = report_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status != DONE:
+        return jsonify({'error': f'Job is {job.status}'}), 409
+    
+    path = report_jobs.result_path(job_id)
+    if request.accept_encodings['gzip']:
+        response = send_file(path, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+    
+    def decompressed():
+        with gzip.open(path, 'rb') as f:
+            while chunk := f.read(64 * 1024):
+                yield chunk
+    response = app.response_class(decompressed(), mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@app.route('/api/reports/jobs/<job_id>', methods=['DELETE'])
+def cancel_report_job(job_id):
+    """Cancel a queued or running report job, or delete a finished one"""
+    job = report_jobs.cancel(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+
+def export_response(name: str, columns, export_rows):
+    """Stream an export as CSV (optionally gzip-compressed) or Parquet
+    
+    Query parameters: from, to (ISO dates), format (csv or parquet) and
+    compression (gzip). Rows are encoded as they are fetched, so memory use
+    does not grow with the number of rows.
+    """
+    try:
+        start = date.fromisoformat(request.args['from']) if 'from' in request.args else None
+        end = date.fromisoformat(request.args['to']) if 'to' in request.args else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    export_format = request.args.get('format', 'csv').lower()
+    compression = request.args.get('compression', '').lower()
+    if export_format not in ('csv', 'parquet') or compression not in ('', 'gzip'):
+        return jsonify({'error': 'format must be csv or parquet, compression gzip or empty'}), 400
+    
+    rows = export_rows(start, end)
+    if export_format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401 (optional dependency, only needed for Parquet)
+        except ImportError:
+            return jsonify({'error': 'Parquet export requires pyarrow'}), 501
+        chunks = parquet_chunks(columns, rows, compression=compression or 'snappy')
+        filename, mimetype = f'{name}.parquet', 'application/vnd.apache.parquet'
+    elif compression:
+        chunks = csv_chunks(columns, rows, compress=True)
+        filename, mimetype = f'{name}.csv.gz', 'application/gzip'
+    else:
+        chunks = csv_chunks(columns, rows)
+        filename, mimetype = f'{name}.csv', 'text/csv'
+    
+    response = app.response_class(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@app.route('/api/export/rentals', methods=['GET'])
+def export_rentals():
+    """Export rentals issued within a date range"""
+    return export_response('rentals', RENTAL_EXPORT_COLUMNS, library.export_rentals)
+
+
+@app.route('/api/export/financial-history', methods=['GET'])
+def export_financial_history():
+    """Export financial transactions dated within a date range"""
+    return export_response('financial-history', LEDGER_EXPORT_COLUMNS, library.export_financial_history)
+
+
+@app.route('/api/readers/<int:reader_id>/summary', methods=['GET'])
+def get_reader_summary(reader_id):
+    """Get a reader's open and overdue loans, lifetime spend, outstanding fines and last activity"""
+    summary = library.get_reader_summary(reader_id)
+    if not summary:
+        return jsonify({'error': 'Reader not found'}), 404
+    return jsonify(summary)
+
+
 @app.route('/api/readers/<int:reader_id>/rentals', methods=['GET'])
 def get_reader_rentals(reader_id):
     """Get all rentals for a specific reader"""
@@ -332,6 +1037,133 @@ def get_reader_rentals(reader_id):
     } for r in rentals])
 
 
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    """Get entities changed since a change log sequence number
+    
+    Without `since` only the current sequence number is returned, for clients
+    that have just loaded the full lists. `wait` (seconds) long-polls until
+    something changes.
+    """
+    if 'since' not in request.args:
+        return jsonify({'last_seq': library.get_last_change_seq(), 'has_more': False, 'changes': []})
+    
+    try:
+        since = int(request.args['since'])
+        wait = float(request.args.get('wait', 0))
+        limit = int(request.args.get('limit', 1000))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # NaN fails both comparisons
+    if not 0 <= wait <= 30:
+        return jsonify({'error': 'wait must be between 0 and 30 seconds'}), 400
+    if not 1 <= limit <= 5000:
+        return jsonify({'error': 'limit must be between 1 and 5000'}), 400
+    
+    if library.is_change_log_truncated(since):
+        return jsonify({'error': 'Change log no longer covers this sequence number, reload all data'}), 410
+    
+    if wait > 0:
+        result = library.wait_for_changes(since, wait, limit)
+    else:
+        result = library.get_changes(since, limit)
+    
+    serializers = {'book': serialize_book, 'reader': serialize_reader, 'rental': serialize_rental}
+    return jsonify({
+        'last_seq': result['last_seq'],
+        'has_more': result['has_more'],
+        'changes': [{
+            'seq': change['seq'],
+            'entity': change['entity'],
+            'id': change['entity_id'],
+            'operation': change['operation'],
+            'data': serializers[change['entity']](change['data']) if change['data'] else None
+        } for change in result['changes']]
+    })
+
+
+@app.cli.command('prune-changes')
+@click.option('--keep-days', default=7, show_default=True, help='Days of change log to keep')
+def prune_changes_command(keep_days):
+    """Delete old change log entries"""
+    count = library.prune_change_log(keep_days)
+    print(f"Deleted {count} change log entries")
+
+
+@app.cli.command('archive-rentals')
+@click.option('--older-than-days', default=int(os.getenv('RENTAL_ARCHIVE_AFTER_DAYS', '365')), show_default=True,
+              help='Archive rentals returned more than this many days ago')
+@click.option('--batch-size', default=1000, show_default=True, help='Rentals moved per transaction')
+def archive_rentals_command(older_than_days, batch_size):
+    """Move old returned and damaged rentals to the archive table"""
+    count = library.archive_rentals(older_than_days, batch_size)
+    print(f"Archived {count} rentals")
+
+
+@app.cli.command('expire-holds')
+def expire_holds_command():
+    """Expire holds whose copy was not collected in time and pass the copies on"""
+    count = library.expire_holds()
+    print(f"Expired {count} holds")
+
+
+@app.cli.command('rebuild-popularity')
+def rebuild_popularity_command():
+    """Recompute the popularity counters from live and archived rentals"""
+    if library.memory_store:
+        print("Rebuilding popularity counters needs LIBRARY_STORAGE=sql")
+        return
+    count = library.rebuild_popularity()
+    print(f"Rebuilt {count} popularity counters")
+
+
+@app.cli.command('expire-popularity')
+def expire_popularity_command():
+    """Delete popularity counters of weeks and months that have ended"""
+    count = library.expire_popularity()
+    print(f"Deleted {count} expired popularity counters")
+
+
+@app.cli.command('build-related')
+@click.option('--top-k', default=int(os.getenv('RELATED_TOP_K', '10')), show_default=True,
+              help='Related books stored per book')
+@click.option('--full', is_flag=True, help='Recompute every book instead of those with new rentals')
+def build_related_command(top_k, full):
+    """Recompute the "readers also rented" neighbours from rental history"""
+    if library.memory_store:
+        print("Building related books needs LIBRARY_STORAGE=sql")
+        return
+    count = library.build_related_books(top_k, full)
+    print(f"Refreshed related books of {count} books")
+
+
+@app.cli.command('sweep-overdue')
+def sweep_overdue_command():
+    """Recompute overdue loans and accrued fines in reader summaries; run daily"""
+    count = library.sweep_overdue()
+    print(f"Updated {count} reader summaries")
+
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the time-bucketed rollups from live and archived rentals"""
+    if library.memory_store:
+        print("Rebuilding rollups needs LIBRARY_STORAGE=sql")
+        return
+    count = library.rebuild_rollups()
+    print(f"Rebuilt {count} rollup rows")
+
+
+@app.cli.command('save-snapshot')
+def save_snapshot_command():
+    """Write in-memory storage to LIBRARY_SNAPSHOT_PATH now"""
+    if not library.memory_store or not library.memory_store.snapshot_path:
+        print("Snapshots need LIBRARY_STORAGE=memory and LIBRARY_SNAPSHOT_PATH")
+        return
+    library.memory_store.save()
+    print(f"Saved snapshot to {library.memory_store.snapshot_path}")
+
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=8000)
 
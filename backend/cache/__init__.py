@@ -0,0 +1,9 @@
+from .invalidation import (
+    InvalidationBus, LocalInvalidationBus, FileInvalidationBus, PostgresInvalidationBus,
+    configure_bus, get_bus
+)
+
+__all__ = [
+    'InvalidationBus', 'LocalInvalidationBus', 'FileInvalidationBus', 'PostgresInvalidationBus',
+    'configure_bus', 'get_bus'
+]
@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import select
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Iterable, List, Optional
+
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+
+class LagStats:
+    """Delivery lag of events received from other workers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.received = 0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self._total_ms = 0.0
+        self.reconnects = 0
+        self.flushes = 0
+
+    def record(self, lag_seconds: float) -> None:
+        lag_ms = max(lag_seconds, 0.0) * 1000
+        with self._lock:
+            self.received += 1
+            self.last_ms = lag_ms
+            self.max_ms = max(self.max_ms, lag_ms)
+            self._total_ms += lag_ms
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'received': self.received,
+                'last_lag_ms': round(self.last_ms, 3),
+                'max_lag_ms': round(self.max_ms, 3),
+                'avg_lag_ms': round(self._total_ms / self.received, 3) if self.received else 0.0,
+                'reconnects': self.reconnects,
+                'flushes': self.flushes
+            }
+
+
+class _Subscription:
+    def __init__(self, on_events, on_flush, entities):
+        self.on_events = on_events
+        self.on_flush = on_flush
+        self.entities = set(entities) if entities else None
+
+
+class InvalidationBus(ABC):
+    """Broadcasts committed entity changes to the caches of every worker
+
+    Events are dicts with `entity`, `id` and `operation`. The publishing
+    worker's own subscribers are called immediately; other workers receive
+    the events through the transport. When a transport may have dropped
+    events (for example after a reconnect) every subscriber's on_flush is
+    called so caches can be dropped entirely.
+    """
+
+    def __init__(self):
+        self.origin = f"{socket.gethostname()}:{os.getpid()}"
+        self.stats = LagStats()
+        self._subscriptions: List[_Subscription] = []
+
+    def subscribe(self, on_events: Callable[[List[dict]], None], on_flush: Optional[Callable[[], None]] = None,
+                  entities: Optional[Iterable[str]] = None) -> None:
+        self._subscriptions.append(_Subscription(on_events, on_flush, entities))
+
+    def start(self) -> None:
+        """Start receiving events from other workers"""
+
+    def publish(self, events: List[dict]) -> None:
+        if not events:
+            return
+        self._deliver(events)
+        self._send({'origin': self.origin, 'published_at': time.time(), 'events': events})
+
+    @abstractmethod
+    def _send(self, message: dict) -> None:
+        pass
+
+    def _receive(self, payload: str) -> None:
+        message = json.loads(payload)
+        if message.get('origin') == self.origin:
+            return
+        self.stats.record(time.time() - message['published_at'])
+        self._deliver(message['events'])
+
+    def _receive_safely(self, payload: str) -> None:
+        """Receive one message; a malformed one is logged and skipped so the listener keeps running"""
+        try:
+            self._receive(payload)
+        except Exception:
+            logger.exception("Invalidation message dropped: %.200s", payload)
+
+    def _deliver(self, events: List[dict]) -> None:
+        for subscription in self._subscriptions:
+            if subscription.entities is not None:
+                matching = [e for e in events if e['entity'] in subscription.entities]
+            else:
+                matching = events
+            if matching:
+                try:
+                    subscription.on_events(matching)
+                except Exception:
+                    logger.exception("Invalidation subscriber failed")
+
+    def _flush_all(self) -> None:
+        self.stats.flushes += 1
+        for subscription in self._subscriptions:
+            if subscription.on_flush:
+                try:
+                    subscription.on_flush()
+                except Exception:
+                    logger.exception("Invalidation flush failed")
+
+
+class LocalInvalidationBus(InvalidationBus):
+    """Single-process bus: only this worker's subscribers are notified"""
+
+    def _send(self, message: dict) -> None:
+        pass
+
+
+class FileInvalidationBus(InvalidationBus):
+    """Bus for workers on one host (and tests) backed by an append-only file
+
+    Every worker appends one JSON line per commit and tails the file from a
+    background thread. A truncated or replaced file counts as a reconnect.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.05):
+        super().__init__()
+        self._path = path
+        self._poll_interval = poll_interval
+
+    def start(self) -> None:
+        open(self._path, 'a').close()
+        threading.Thread(target=self._run, name='invalidation-file-bus', daemon=True).start()
+
+    def _send(self, message: dict) -> None:
+        line = (json.dumps(message) + '\n').encode()
+        fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def _run(self) -> None:
+        f = open(self._path, 'rb')
+        f.seek(0, os.SEEK_END)
+        inode = os.fstat(f.fileno()).st_ino
+        buffer = b''
+        while True:
+            chunk = f.read()
+            if chunk:
+                buffer += chunk
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    if line:
+                        self._receive_safely(line.decode())
+                continue
+
+            time.sleep(self._poll_interval)
+            try:
+                current = os.stat(self._path)
+            except FileNotFoundError:
+                continue
+            if current.st_ino != inode or current.st_size < f.tell():
+                f.close()
+                f = open(self._path, 'rb')
+                inode = os.fstat(f.fileno()).st_ino
+                buffer = b''
+                self.stats.reconnects += 1
+                self._flush_all()
+
+
+class PostgresInvalidationBus(InvalidationBus):
+    """Bus for workers sharing the PostgreSQL database, using LISTEN/NOTIFY"""
+
+    MAX_PAYLOAD = 7900  # NOTIFY payloads must stay below 8000 bytes
+
+    def __init__(self, database_url: str, channel: str = 'library_invalidation'):
+        super().__init__()
+        self._dsn = make_url(database_url).set(drivername='postgresql').render_as_string(hide_password=False)
+        self._channel = channel
+        self._publisher = None
+        self._publisher_lock = threading.Lock()
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name='invalidation-pg-bus', daemon=True).start()
+
+    def _send(self, message: dict) -> None:
+        payload = json.dumps(message)
+        if len(payload) > self.MAX_PAYLOAD and len(message['events']) > 1:
+            half = len(message['events']) // 2
+            self._send(dict(message, events=message['events'][:half]))
+            self._send(dict(message, events=message['events'][half:]))
+            return
+
+        import psycopg2
+        with self._publisher_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None or self._publisher.closed:
+                        self._publisher = psycopg2.connect(self._dsn)
+                        self._publisher.autocommit = True
+                    with self._publisher.cursor() as cursor:
+                        cursor.execute('SELECT pg_notify(%s, %s)', (self._channel, payload))
+                    return
+                except psycopg2.Error as e:
+                    self._publisher = None
+                    if attempt:
+                        logger.error("Invalidation publish failed: %s", e)
+
+    def _run(self) -> None:
+        import psycopg2
+        delay = 0.5
+        connected_before = False
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self._dsn)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self._channel}"')
+                if connected_before:
+                    # Notifications sent while disconnected are lost
+                    self.stats.reconnects += 1
+                    self._flush_all()
+                connected_before = True
+                delay = 0.5
+                while True:
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._receive_safely(conn.notifies.pop(0).payload)
+            except psycopg2.Error as e:
+                if conn is not None:
+                    conn.close()
+                logger.warning("Invalidation listener disconnected: %s. Reconnecting in %.1fs", e, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+
+_bus: InvalidationBus = LocalInvalidationBus()
+
+
+def get_bus() -> InvalidationBus:
+    return _bus
+
+
+def configure_bus(database_url: str) -> InvalidationBus:
+    """Select the bus from INVALIDATION_BUS (local, file or postgres)
+
+    Defaults to postgres when the database is PostgreSQL, local otherwise.
+    """
+    global _bus
+    default = 'postgres' if make_url(database_url).get_backend_name() == 'postgresql' else 'local'
+    kind = os.getenv('INVALIDATION_BUS', default)
+    if kind == 'postgres':
+        _bus = PostgresInvalidationBus(database_url)
+    elif kind == 'file':
+        _bus = FileInvalidationBus(os.getenv('INVALIDATION_BUS_FILE', '/tmp/library-invalidation.log'))
+    elif kind == 'local':
+        _bus = LocalInvalidationBus()
+    else:
+        raise ValueError(f"Unknown INVALIDATION_BUS: {kind}")
+    return _bus
@@ -1,5 +1,5 @@
-from .db import db, init_db
-from .models import BookModel, ReaderModel, RentalModel
+from .db import db, init_db, check_readiness, pool_status, trigram_search_enabled
+from .models import BookModel, ReaderModel, RentalModel, RentalArchiveModel, BranchModel, BranchStockModel, HoldModel, BookPopularityModel, RelatedBookModel, ReaderSummaryModel, RentalRollupModel, ChangeLogModel
 
-__all__ = ['db', 'init_db', 'BookModel', 'ReaderModel', 'RentalModel']
+__all__ = ['db', 'init_db', 'check_readiness', 'pool_status', 'trigram_search_enabled', 'BookModel', 'ReaderModel', 'RentalModel', 'RentalArchiveModel', 'BranchModel', 'BranchStockModel', 'HoldModel', 'BookPopularityModel', 'RelatedBookModel', 'ReaderSummaryModel', 'RentalRollupModel', 'ChangeLogModel']
 
@@ -1,10 +1,11 @@
-from sqlalchemy import Column, Integer, String, Float, Date, Enum as SQLEnum, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Enum as SQLEnum, ForeignKey, Index, UniqueConstraint, func, text
 from sqlalchemy.orm import relationship
-from datetime import date
+from datetime import date, datetime
 from database.db import db
 from models.book import Genre
 from models.reader import ReaderCategory
 from models.rental import RentalStatus
+from models.hold import HoldStatus
 import enum
 
 
@@ -37,6 +38,7 @@ class BookModel(db.Model):
             available_copies=self.available_copies,
             value=self.value
         )
+        book.mark_clean()
         return book
     
     @staticmethod
@@ -79,6 +81,7 @@ class ReaderModel(db.Model):
             telephone=self.telephone,
             category=self.category
         )
+        reader.mark_clean()
         return reader
     
     @staticmethod
@@ -98,6 +101,14 @@ class ReaderModel(db.Model):
 
 class RentalModel(db.Model):
     __tablename__ = 'rentals'
+    __table_args__ = (
+        # Next-available-date estimates read open rentals of a book by expected return
+        Index('ix_rentals_open_by_book', 'book_id', 'expected_return_date',
+              postgresql_where=text("status IN ('ACTIVE', 'OVERDUE')"),
+              sqlite_where=text("status IN ('ACTIVE', 'OVERDUE')")),
+        # Never reuse the ids of rentals moved to the archive (SQLite otherwise takes max(rowid) + 1)
+        {'sqlite_autoincrement': True},
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     book_id = Column(Integer, ForeignKey('books.id'), nullable=False)
@@ -110,6 +121,7 @@ class RentalModel(db.Model):
     rental_cost = Column(Float, nullable=False)
     fine_amount = Column(Float, default=0.0)
     damage_fine = Column(Float, default=0.0)
+    branch_id = Column(Integer, ForeignKey('branches.id'), nullable=True, index=True)
     
     book = relationship('BookModel', back_populates='rentals')
     reader = relationship('ReaderModel', back_populates='rentals')
@@ -128,8 +140,10 @@ class RentalModel(db.Model):
             deposit_paid=self.deposit_paid,
             rental_cost=self.rental_cost,
             fine_amount=self.fine_amount,
-            damage_fine=self.damage_fine
+            damage_fine=self.damage_fine,
+            branch_id=self.branch_id
         )
+        rental.mark_clean()
         return rental
     
     @staticmethod
@@ -146,9 +160,209 @@ class RentalModel(db.Model):
             deposit_paid=rental.deposit_paid,
             rental_cost=rental.rental_cost,
             fine_amount=rental.fine_amount,
-            damage_fine=rental.damage_fine
+            damage_fine=rental.damage_fine,
+            branch_id=rental.branch_id
         )
         if rental.id is not None:
             model.id = rental.id
         return model
 
+
+class BranchModel(db.Model):
+    __tablename__ = 'branches'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False, unique=True)
+    address = Column(String(500), nullable=False)
+    
+    def to_branch(self):
+        """Convert database model to domain model"""
+        from models.branch import Branch
+        return Branch(id=self.id, name=self.name, address=self.address)
+
+
+class BranchStockModel(db.Model):
+    """Copies of a book held at a branch; books.total_copies/available_copies stay the library-wide totals"""
+    __tablename__ = 'branch_stock'
+    __table_args__ = (
+        UniqueConstraint('book_id', 'branch_id', name='uq_branch_stock_book_branch'),
+        # "Which branches have it now" reads only rows with a copy on the shelf
+        Index('ix_branch_stock_in_stock', 'book_id', 'branch_id',
+              postgresql_where=text('available_copies > 0'), sqlite_where=text('available_copies > 0')),
+        Index('ix_branch_stock_branch', 'branch_id', 'book_id'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    book_id = Column(Integer, ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
+    branch_id = Column(Integer, ForeignKey('branches.id'), nullable=False)
+    total_copies = Column(Integer, nullable=False, default=0)
+    available_copies = Column(Integer, nullable=False, default=0)
+    
+    def to_stock(self):
+        """Convert database model to domain model"""
+        from models.branch import BranchStock
+        return BranchStock(
+            branch_id=self.branch_id,
+            book_id=self.book_id,
+            total_copies=self.total_copies,
+            available_copies=self.available_copies
+        )
+
+
+class HoldModel(db.Model):
+    """Reservation queue entry for a book with no copy on the shelf"""
+    __tablename__ = 'holds'
+    __table_args__ = (
+        Index('ix_holds_queue', 'book_id', 'status', 'id'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    book_id = Column(Integer, ForeignKey('books.id'), nullable=False)
+    reader_id = Column(Integer, ForeignKey('readers.id'), nullable=False, index=True)
+    placed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    status = Column(SQLEnum(HoldStatus, name='hold_status_enum'), nullable=False)
+    branch_id = Column(Integer, ForeignKey('branches.id'), nullable=True)
+    ready_until = Column(Date, nullable=True)
+    
+    def to_hold(self):
+        """Convert database model to domain model"""
+        from models.hold import Hold
+        return Hold(
+            id=self.id,
+            book_id=self.book_id,
+            reader_id=self.reader_id,
+            placed_at=self.placed_at,
+            status=self.status,
+            branch_id=self.branch_id,
+            ready_until=self.ready_until
+        )
+
+
+class RentalArchiveModel(db.Model):
+    """Closed rentals moved out of the live rentals table, keeping their original ids"""
+    __tablename__ = 'rentals_archive'
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    book_id = Column(Integer, ForeignKey('books.id'), nullable=False)
+    reader_id = Column(Integer, ForeignKey('readers.id'), nullable=False, index=True)
+    issue_date = Column(Date, nullable=False, index=True)
+    expected_return_date = Column(Date, nullable=False)
+    actual_return_date = Column(Date, nullable=True, index=True)
+    status = Column(SQLEnum(RentalStatus, name='rental_status_enum'), nullable=False)
+    deposit_paid = Column(Float, nullable=False)
+    rental_cost = Column(Float, nullable=False)
+    fine_amount = Column(Float, default=0.0)
+    damage_fine = Column(Float, default=0.0)
+    branch_id = Column(Integer, ForeignKey('branches.id'), nullable=True)
+    archived_at = Column(DateTime, nullable=False, server_default=func.now())
+    
+    # Archived rows convert to the same domain model as live ones
+    to_rental = RentalModel.to_rental
+
+
+class BookPopularityModel(db.Model):
+    """Checkouts of a book per time bucket (week, month or all time)"""
+    __tablename__ = 'book_popularity'
+    __table_args__ = (
+        UniqueConstraint('granularity', 'bucket_start', 'book_id', name='uq_book_popularity_bucket'),
+        Index('ix_book_popularity_rank', 'granularity', 'bucket_start', 'genre', 'rentals'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    granularity = Column(String(10), nullable=False)  # week, month or all
+    bucket_start = Column(Date, nullable=False)  # date.min for all time
+    book_id = Column(Integer, ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
+    genre = Column(SQLEnum(Genre, name='genre_enum'), nullable=False)
+    rentals = Column(Integer, nullable=False, default=0)
+
+
+class RelatedBookModel(db.Model):
+    """Precomputed "readers also rented" neighbours of a book, best first"""
+    __tablename__ = 'related_books'
+    __table_args__ = (
+        Index('ix_related_books_book', 'book_id', 'rank'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    book_id = Column(Integer, ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
+    related_book_id = Column(Integer, ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
+    rank = Column(Integer, nullable=False)
+    shared_readers = Column(Integer, nullable=False)  # Readers who rented both books
+    through_rental_id = Column(Integer, nullable=False)  # Newest rental the row was computed from
+
+
+class ReaderSummaryModel(db.Model):
+    """Account totals of a reader, kept current by checkouts, returns and the overdue sweep"""
+    __tablename__ = 'reader_summaries'
+    
+    reader_id = Column(Integer, ForeignKey('readers.id', ondelete='CASCADE'), primary_key=True)
+    open_loans = Column(Integer, nullable=False, default=0)
+    overdue_loans = Column(Integer, nullable=False, default=0)
+    lifetime_spend = Column(Float, nullable=False, default=0.0)  # Rental costs and fines of returned loans
+    outstanding_fines = Column(Float, nullable=False, default=0.0)  # Overdue fines accrued on open loans
+    fines_as_of = Column(Date, nullable=True)
+    last_activity = Column(Date, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'reader_id': self.reader_id,
+            'open_loans': self.open_loans,
+            'overdue_loans': self.overdue_loans,
+            'lifetime_spend': round(self.lifetime_spend, 2),
+            'outstanding_fines': round(self.outstanding_fines, 2),
+            'fines_as_of': self.fines_as_of.isoformat() if self.fines_as_of else None,
+            'last_activity': self.last_activity.isoformat() if self.last_activity else None
+        }
+
+
+class RentalRollupModel(db.Model):
+    """Circulation and revenue totals per time bucket, genre and reader category"""
+    __tablename__ = 'rental_rollups'
+    __table_args__ = (
+        UniqueConstraint('granularity', 'bucket_start', 'genre', 'category', name='uq_rental_rollup_bucket'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    granularity = Column(String(10), nullable=False)  # day, week or month
+    bucket_start = Column(Date, nullable=False)
+    genre = Column(SQLEnum(Genre, name='genre_enum'), nullable=False)
+    category = Column(SQLEnum(ReaderCategory, name='reader_category_enum'), nullable=False)
+    rentals_issued = Column(Integer, nullable=False, default=0)
+    returns = Column(Integer, nullable=False, default=0)
+    deposits = Column(Float, nullable=False, default=0.0)
+    rental_income = Column(Float, nullable=False, default=0.0)
+    fines = Column(Float, nullable=False, default=0.0)
+    
+    def to_dict(self):
+        return {
+            'granularity': self.granularity,
+            'bucket_start': self.bucket_start.isoformat(),
+            'genre': self.genre.value,
+            'category': self.category.value,
+            'rentals_issued': self.rentals_issued,
+            'returns': self.returns,
+            'deposits': self.deposits,
+            'rental_income': self.rental_income,
+            'fines': self.fines
+        }
+
+
+class ChangeLogModel(db.Model):
+    """Append-only log of entity writes, read by delta-sync clients"""
+    __tablename__ = 'change_log'
+    # Never reuse seq values, even once pruning has emptied the table
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    entity = Column(String(20), nullable=False)  # book, reader or rental
+    entity_id = Column(Integer, nullable=False)
+    operation = Column(String(10), nullable=False)  # add, update, delete or archive
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class ChangeLogPruneModel(db.Model):
+    """Highest change log seq deleted by pruning, in a single row"""
+    __tablename__ = 'change_log_pruned'
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    pruned_through = Column(Integer, nullable=False)
@@ -0,0 +1,4 @@
+from .admission import AdmissionController, AdmissionGate, TokenBucket
+from .compression import ResponseCompressor
+
+__all__ = ['AdmissionController', 'AdmissionGate', 'TokenBucket', 'ResponseCompressor']
@@ -0,0 +1,284 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from flask import g, jsonify, request
+
+
+CRITICAL = 'critical'
+NORMAL = 'normal'
+BULK = 'bulk'
+PRIORITIES = (CRITICAL, NORMAL, BULK)
+
+
+def _parse_limits(value) -> Dict[str, int]:
+    """Parse 'endpoint=limit,...' into a dict; dicts are passed through"""
+    if isinstance(value, dict):
+        return dict(value)
+    limits = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            name, limit = item.split('=', 1)
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`"""
+
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float) -> float:
+        """Take a token; returns 0 on success, else the seconds until one is available"""
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class AdmissionStats:
+    """Per priority class counters, guarded by the gate's lock"""
+
+    def __init__(self):
+        self.admitted = 0
+        self.queued = 0
+        self.rate_limited = 0
+        self.shed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'rate_limited': self.rate_limited,
+            'shed': self.shed,
+            'avg_wait_ms': round(self.wait_total / self.admitted * 1000, 3) if self.admitted else 0.0,
+            'max_wait_ms': round(self.wait_max * 1000, 3)
+        }
+
+
+class AdmissionGate:
+    """Concurrency slots shared by priority classes, with per-route caps
+
+    A class may only hold up to its share of the slots, so the rest stays free
+    for the classes above it. A request that cannot be admitted waits for a
+    slot; while a higher class is waiting, lower ones are not admitted.
+    Waiting longer than the class's max wait gives up.
+    """
+
+    def __init__(self, capacity: int, shares: Dict[str, float], route_limits: Dict[str, int]):
+        self.capacity = capacity
+        self.class_limits = {p: max(1, int(capacity * shares[p])) for p in PRIORITIES}
+        self.route_limits = route_limits
+        self._condition = threading.Condition()
+        self.in_flight = {p: 0 for p in PRIORITIES}
+        self.route_in_flight: Dict[str, int] = {}
+        self.waiting = {p: 0 for p in PRIORITIES}
+        self.stats = {p: AdmissionStats() for p in PRIORITIES}
+
+    def _can_admit(self, priority: str, route: str) -> bool:
+        total = sum(self.in_flight.values())
+        if total >= self.capacity or total >= self.class_limits[priority]:
+            return False
+        if self.route_in_flight.get(route, 0) >= self.route_limits.get(route, self.capacity):
+            return False
+        higher = PRIORITIES[:PRIORITIES.index(priority)]
+        return not any(self.waiting[p] for p in higher)
+
+    def acquire(self, priority: str, route: str, max_wait: float) -> bool:
+        start = time.monotonic()
+        with self._condition:
+            stats = self.stats[priority]
+            if not self._can_admit(priority, route):
+                if max_wait <= 0:
+                    stats.shed += 1
+                    return False
+                stats.queued += 1
+                self.waiting[priority] += 1
+                try:
+                    admitted = self._condition.wait_for(lambda: self._can_admit_waiting(priority, route), max_wait)
+                finally:
+                    self.waiting[priority] -= 1
+                if not admitted:
+                    stats.shed += 1
+                    # Lower classes held back for this waiter may go now
+                    self._condition.notify_all()
+                    return False
+            waited = time.monotonic() - start
+            stats.admitted += 1
+            stats.wait_total += waited
+            stats.wait_max = max(stats.wait_max, waited)
+            self.in_flight[priority] += 1
+            self.route_in_flight[route] = self.route_in_flight.get(route, 0) + 1
+            return True
+
+    def _can_admit_waiting(self, priority: str, route: str) -> bool:
+        # A waiter does not hold back its own class
+        self.waiting[priority] -= 1
+        try:
+            return self._can_admit(priority, route)
+        finally:
+            self.waiting[priority] += 1
+
+    def release(self, priority: str, route: str) -> None:
+        with self._condition:
+            self.in_flight[priority] -= 1
+            self.route_in_flight[route] -= 1
+            self._condition.notify_all()
+
+    def record_rate_limited(self, priority: str) -> None:
+        with self._condition:
+            self.stats[priority].rate_limited += 1
+
+    def snapshot(self) -> dict:
+        with self._condition:
+            return {
+                'capacity': self.capacity,
+                'in_flight': sum(self.in_flight.values()),
+                'classes': {
+                    p: {
+                        'limit': self.class_limits[p],
+                        'in_flight': self.in_flight[p],
+                        'waiting': self.waiting[p],
+                        **self.stats[p].to_dict()
+                    } for p in PRIORITIES
+                },
+                'routes': {
+                    route: {'in_flight': count, 'limit': self.route_limits.get(route)}
+                    for route, count in self.route_in_flight.items() if count or route in self.route_limits
+                }
+            }
+
+
+class AdmissionController:
+    """Flask extension that sheds load before it reaches the database pool
+
+    Each request is classed by endpoint: checkouts and returns are critical,
+    reports and exports are bulk and everything else is normal. Clients are
+    rate limited by a token bucket (429), then the request waits for a
+    concurrency slot for at most its class's ADMISSION_*_MAX_WAIT seconds and
+    is answered 503 when none frees up. Both carry a Retry-After header.
+    Long-polls are rate limited but take no slot, as they mostly sit idle.
+    Setting ADMISSION_MAX_CONCURRENT to 0 disables the controller.
+    """
+
+    CRITICAL_ENDPOINTS = {'create_rental', 'return_book'}
+    BULK_PREFIXES = ('/api/reports', '/api/export')
+    LONG_POLL_ENDPOINTS = {'get_changes'}
+    EXEMPT_ENDPOINTS = {'healthz', 'readyz', 'admission_status', 'static'}
+    MAX_TRACKED_CLIENTS = 10000
+
+    def __init__(self, app=None):
+        self.gate: Optional[AdmissionGate] = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault('ADMISSION_MAX_CONCURRENT', int(os.getenv('ADMISSION_MAX_CONCURRENT', '32')))
+        app.config.setdefault('ADMISSION_NORMAL_SHARE', float(os.getenv('ADMISSION_NORMAL_SHARE', '0.75')))
+        app.config.setdefault('ADMISSION_BULK_SHARE', float(os.getenv('ADMISSION_BULK_SHARE', '0.25')))
+        app.config.setdefault('ADMISSION_CRITICAL_MAX_WAIT', float(os.getenv('ADMISSION_CRITICAL_MAX_WAIT', '5')))
+        app.config.setdefault('ADMISSION_NORMAL_MAX_WAIT', float(os.getenv('ADMISSION_NORMAL_MAX_WAIT', '1')))
+        app.config.setdefault('ADMISSION_BULK_MAX_WAIT', float(os.getenv('ADMISSION_BULK_MAX_WAIT', '0.25')))
+        app.config.setdefault('ADMISSION_ROUTE_LIMITS', os.getenv(
+            'ADMISSION_ROUTE_LIMITS', 'report_timeseries=4,export_rentals=2,export_financial_history=2'
+        ))
+        app.config.setdefault('ADMISSION_CLIENT_RATE', float(os.getenv('ADMISSION_CLIENT_RATE', '50')))
+        app.config.setdefault('ADMISSION_CLIENT_BURST', float(os.getenv('ADMISSION_CLIENT_BURST', '100')))
+        app.config.setdefault('ADMISSION_TRUST_PROXY', os.getenv('ADMISSION_TRUST_PROXY', 'false').lower() == 'true')
+
+        capacity = app.config['ADMISSION_MAX_CONCURRENT']
+        if capacity <= 0:
+            return
+        shares = {
+            CRITICAL: 1.0,
+            NORMAL: app.config['ADMISSION_NORMAL_SHARE'],
+            BULK: app.config['ADMISSION_BULK_SHARE']
+        }
+        self.gate = AdmissionGate(capacity, shares, _parse_limits(app.config['ADMISSION_ROUTE_LIMITS']))
+        self._max_wait = {p: app.config[f'ADMISSION_{p.upper()}_MAX_WAIT'] for p in PRIORITIES}
+        self._rate = app.config['ADMISSION_CLIENT_RATE']
+        self._burst = app.config['ADMISSION_CLIENT_BURST']
+        self._trust_proxy = app.config['ADMISSION_TRUST_PROXY']
+        self._buckets: 'OrderedDict[str, TokenBucket]' = OrderedDict()
+        self._buckets_lock = threading.Lock()
+
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def classify(self) -> str:
+        if request.endpoint in self.CRITICAL_ENDPOINTS:
+            return CRITICAL
+        if request.path.startswith(self.BULK_PREFIXES):
+            return BULK
+        return NORMAL
+
+    def _client_key(self) -> str:
+        if self._trust_proxy:
+            forwarded = request.headers.get('X-Forwarded-For')
+            if forwarded:
+                return forwarded.split(',')[0].strip()
+        return request.remote_addr or 'unknown'
+
+    def _take_token(self, client: str) -> float:
+        if self._rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._buckets_lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self._burst, now)
+                if len(self._buckets) > self.MAX_TRACKED_CLIENTS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            return bucket.take(self._rate, self._burst, now)
+
+    @staticmethod
+    def _reject(status: int, message: str, retry_after: float):
+        response = jsonify({'error': message})
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def _before_request(self):
+        if request.endpoint is None or request.endpoint in self.EXEMPT_ENDPOINTS or request.method == 'OPTIONS':
+            return
+        priority = self.classify()
+        retry_after = self._take_token(self._client_key())
+        if retry_after:
+            self.gate.record_rate_limited(priority)
+            return self._reject(429, 'Too many requests', retry_after)
+        if request.endpoint in self.LONG_POLL_ENDPOINTS:
+            return
+        if not self.gate.acquire(priority, request.endpoint, self._max_wait[priority]):
+            return self._reject(503, 'Server is busy, try again later', max(1.0, self._max_wait[priority]))
+        g.admission = (priority, request.endpoint)
+
+    def _teardown_request(self, exc):
+        admission = g.pop('admission', None)
+        if admission is not None:
+            self.gate.release(*admission)
+
+    def status(self) -> dict:
+        if self.gate is None:
+            return {'enabled': False}
+        with self._buckets_lock:
+            clients = len(self._buckets)
+        return {
+            'enabled': True,
+            'client_rate': self._rate,
+            'client_burst': self._burst,
+            'tracked_clients': clients,
+            **self.gate.snapshot()
+        }
@@ -0,0 +1,100 @@
+import gzip
+import os
+import zlib
+from typing import Iterable, Iterator
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is offered
+    brotli = None
+
+
+def _gzip_stream(chunks: Iterable[bytes], level: int) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _brotli_stream(chunks: Iterable[bytes], quality: int) -> Iterator[bytes]:
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in chunks:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class ResponseCompressor:
+    """Flask extension that compresses responses with the client's preferred encoding
+
+    Brotli (when the brotli package is installed) or gzip is negotiated from
+    Accept-Encoding for the COMPRESS_MIMETYPES. Buffered responses smaller than
+    COMPRESS_MIN_SIZE bytes are sent as they are; streamed ones (exports) are
+    compressed chunk by chunk. Responses that already set Content-Encoding are
+    left alone.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault('COMPRESS_MIN_SIZE', int(os.getenv('COMPRESS_MIN_SIZE', '1024')))
+        app.config.setdefault('COMPRESS_GZIP_LEVEL', int(os.getenv('COMPRESS_GZIP_LEVEL', '6')))
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', int(os.getenv('COMPRESS_BROTLI_QUALITY', '4')))
+        app.config.setdefault('COMPRESS_MIMETYPES', os.getenv('COMPRESS_MIMETYPES', 'application/json,text/csv,text/plain'))
+
+        self._min_size = app.config['COMPRESS_MIN_SIZE']
+        self._gzip_level = app.config['COMPRESS_GZIP_LEVEL']
+        self._brotli_quality = app.config['COMPRESS_BROTLI_QUALITY']
+        mimetypes = app.config['COMPRESS_MIMETYPES']
+        self._mimetypes = set(mimetypes.split(',') if isinstance(mimetypes, str) else mimetypes)
+        self._encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+        app.after_request(self._after_request)
+
+    def _compress(self, data: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(data, quality=self._brotli_quality)
+        return gzip.compress(data, compresslevel=self._gzip_level, mtime=0)
+
+    def _compress_stream(self, chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+        stream = _brotli_stream(chunks, self._brotli_quality) if encoding == 'br' else _gzip_stream(chunks, self._gzip_level)
+        try:
+            yield from stream
+        finally:
+            # Closing the original body ends stream_with_context and its request context
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def _after_request(self, response):
+        if response.mimetype not in self._mimetypes or response.status_code < 200 or response.status_code in (204, 206, 304):
+            return response
+        if 'Content-Encoding' in response.headers or 'Range' in request.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(self._encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.direct_passthrough = False
+            response.response = self._compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+            response.headers['Content-Encoding'] = encoding
+            return response
+
+        data = response.get_data()
+        if len(data) < self._min_size:
+            return response
+        compressed = self._compress(data, encoding)
+        if len(compressed) >= len(data):
+            return response
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -1,6 +1,9 @@
 from .book import Book, Genre
+from .branch import Branch, BranchStock
+from .hold import Hold, HoldStatus
 from .reader import Reader, ReaderCategory
 from .rental import Rental, RentalStatus
+from .tracking import ChangeTracking
 
-__all__ = ['Book', 'Genre', 'Reader', 'ReaderCategory', 'Rental', 'RentalStatus']
+__all__ = ['Book', 'Genre', 'Branch', 'BranchStock', 'Hold', 'HoldStatus', 'Reader', 'ReaderCategory', 'Rental', 'RentalStatus', 'ChangeTracking']
 
@@ -2,6 +2,7 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 from enum import Enum
+from models.tracking import ChangeTracking
 
 
 class Genre(Enum):
@@ -16,7 +17,7 @@ class Genre(Enum):
 
 
 @dataclass
-class Book:
+class Book(ChangeTracking):
     id: Optional[int]
     title: str
     author: str
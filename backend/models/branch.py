@@ -0,0 +1,22 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class Branch:
+    id: Optional[int]
+    name: str
+    address: str
+
+
+@dataclass
+class BranchStock:
+    """Copies of one book held by one branch"""
+    branch_id: int
+    book_id: int
+    total_copies: int
+    available_copies: int
+    
+    def __post_init__(self):
+        if not 0 <= self.available_copies <= self.total_copies:
+            raise ValueError("Available copies must be between 0 and total copies")
@@ -0,0 +1,26 @@
+from dataclasses import dataclass
+from datetime import date, datetime
+from enum import Enum
+from typing import Optional
+
+
+class HoldStatus(Enum):
+    WAITING = "Waiting"      # In the queue for the next returned copy
+    READY = "Ready"          # A returned copy is set aside for the reader
+    FULFILLED = "Fulfilled"
+    CANCELLED = "Cancelled"
+    EXPIRED = "Expired"      # Not picked up by ready_until
+
+
+@dataclass
+class Hold:
+    id: Optional[int]
+    book_id: int
+    reader_id: int
+    placed_at: datetime
+    status: HoldStatus = HoldStatus.WAITING
+    branch_id: Optional[int] = None  # Where the set-aside copy waits
+    ready_until: Optional[date] = None
+    
+    def is_open(self) -> bool:
+        return self.status in (HoldStatus.WAITING, HoldStatus.READY)
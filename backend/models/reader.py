@@ -1,6 +1,8 @@
+import re
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Set
 from enum import Enum
+from models.tracking import ChangeTracking
 
 
 class ReaderCategory(Enum):
@@ -11,7 +13,7 @@ class ReaderCategory(Enum):
 
 
 @dataclass
-class Reader:
+class Reader(ChangeTracking):
     id: Optional[int]
     full_name: str
     address: str
@@ -22,3 +24,16 @@ class Reader:
         # ID will be set by the database when saving
         pass
 
+
+def telephone_digits(telephone: str) -> str:
+    """Telephone number reduced to its digits, the form reader search matches prefixes on"""
+    return re.sub(r'[^0-9]', '', telephone)
+
+
+def trigrams(text: str) -> Set[str]:
+    """Trigrams of each word padded as pg_trgm does, so scores match the database search"""
+    grams = set()
+    for word in re.findall(r'[^\W_]+', text.lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
@@ -2,6 +2,7 @@ from dataclasses import dataclass
 from datetime import datetime, date
 from typing import Optional
 from enum import Enum
+from models.tracking import ChangeTracking
 
 
 class RentalStatus(Enum):
@@ -12,7 +13,7 @@ class RentalStatus(Enum):
 
 
 @dataclass
-class Rental:
+class Rental(ChangeTracking):
     id: Optional[int]
     book_id: int
     reader_id: int
@@ -24,6 +25,7 @@ class Rental:
     rental_cost: float
     fine_amount: float = 0.0
     damage_fine: float = 0.0
+    branch_id: Optional[int] = None  # Branch the copy was lent from
     
     def __post_init__(self):
         # ID will be set by the database when saving
@@ -0,0 +1,26 @@
+from dataclasses import fields
+from typing import Set
+
+
+class ChangeTracking:
+    """Mixin for dataclasses that remembers which fields were reassigned
+    
+    Tracking starts at mark_clean(), which repositories call on entities they
+    load. Until then every field counts as changed, so entities built by hand
+    are written in full.
+    """
+    
+    def __setattr__(self, name, value):
+        changed = self.__dict__.get('_changed_fields')
+        if changed is not None and name in self.__dataclass_fields__ and self.__dict__.get(name) != value:
+            changed.add(name)
+        object.__setattr__(self, name, value)
+    
+    def mark_clean(self) -> None:
+        object.__setattr__(self, '_changed_fields', set())
+    
+    def changed_fields(self) -> Set[str]:
+        changed = self.__dict__.get('_changed_fields')
+        if changed is None:
+            changed = {f.name for f in fields(self)}
+        return changed - {'id'}
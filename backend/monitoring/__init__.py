@@ -0,0 +1,4 @@
+from .profiler import RequestProfiler, StackProfiler
+from .tracing import RequestTracer, Tracer, tracer, traced
+
+__all__ = ['RequestProfiler', 'StackProfiler', 'RequestTracer', 'Tracer', 'tracer', 'traced']
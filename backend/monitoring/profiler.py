@@ -0,0 +1,119 @@
+import hmac
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from flask import g, request
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _builtin_name(func) -> str:
+    module = getattr(func, '__module__', None) or 'builtins'
+    return f"{module}:{getattr(func, '__qualname__', repr(func))}"
+
+
+class StackProfiler:
+    """Deterministic profiler that aggregates self time per call stack"""
+
+    def __init__(self, clock=time.thread_time_ns):
+        self._clock = clock
+        self._names = []
+        self._frames = []  # [start, time spent in children]
+        self.stacks = defaultdict(int)
+
+    def start(self) -> None:
+        sys.setprofile(self._callback)
+
+    def stop(self) -> None:
+        sys.setprofile(None)
+        self._names.clear()
+        self._frames.clear()
+
+    def _callback(self, frame, event, arg):
+        if event == 'call':
+            self._names.append(_frame_name(frame))
+            self._frames.append([self._clock(), 0])
+        elif event == 'c_call':
+            self._names.append(_builtin_name(arg))
+            self._frames.append([self._clock(), 0])
+        elif self._frames:
+            # Frames entered before start() return with an empty stack and are ignored
+            start, children = self._frames.pop()
+            elapsed = self._clock() - start
+            self.stacks[tuple(self._names)] += elapsed - children
+            self._names.pop()
+            if self._frames:
+                self._frames[-1][1] += elapsed
+
+    def write_folded(self, path: str) -> None:
+        """Write stacks in the folded format read by flamegraph.pl and speedscope"""
+        with open(path, 'w') as f:
+            for stack, nanoseconds in self.stacks.items():
+                microseconds = nanoseconds // 1000
+                if microseconds > 0:
+                    f.write(f"{';'.join(stack)} {microseconds}\n")
+
+
+class RequestProfiler:
+    """Flask extension that profiles a sample of requests
+
+    A request is profiled when it wins the PROFILE_SAMPLE_RATE draw or carries
+    an X-Profile-Token header matching PROFILE_TOKEN. Unsampled requests only
+    pay for that check.
+    """
+
+    HEADER = 'X-Profile-Token'
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault('PROFILE_SAMPLE_RATE', float(os.getenv('PROFILE_SAMPLE_RATE', '0')))
+        app.config.setdefault('PROFILE_TOKEN', os.getenv('PROFILE_TOKEN'))
+        app.config.setdefault('PROFILE_DIR', os.getenv('PROFILE_DIR', 'profiles'))
+        app.config.setdefault('PROFILE_CLOCK', os.getenv('PROFILE_CLOCK', 'cpu'))
+
+        self._sample_rate = app.config['PROFILE_SAMPLE_RATE']
+        self._token = app.config['PROFILE_TOKEN']
+        self._output_dir = app.config['PROFILE_DIR']
+        self._clock = time.perf_counter_ns if app.config['PROFILE_CLOCK'] == 'wall' else time.thread_time_ns
+
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def _should_profile(self) -> bool:
+        if self._sample_rate > 0 and random.random() < self._sample_rate:
+            return True
+        if self._token:
+            supplied = request.headers.get(self.HEADER)
+            # Header values are decoded as latin-1; encoding back recovers the bytes as sent
+            return supplied is not None and hmac.compare_digest(supplied.encode('latin-1'), self._token.encode())
+        return False
+
+    def _before_request(self):
+        if self._should_profile():
+            g.profiler = StackProfiler(self._clock)
+            g.profiler_started = time.perf_counter()
+            g.profiler.start()
+
+    def _teardown_request(self, exc):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+        profiler.stop()
+        duration_ms = (time.perf_counter() - g.pop('profiler_started')) * 1000
+
+        os.makedirs(self._output_dir, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        endpoint = (request.endpoint or 'unknown').replace('.', '_')
+        filename = f"{timestamp}-{request.method}-{endpoint}-{duration_ms:.0f}ms.folded"
+        profiler.write_folded(os.path.join(self._output_dir, filename))
@@ -0,0 +1,240 @@
+import functools
+import inspect
+import ipaddress
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from flask import g, request
+
+
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+
+class Span:
+    """A timed operation within a trace"""
+
+    def __init__(self, name: str, trace: 'Trace', parent: Optional['Span'] = None):
+        self.name = name
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else trace.parent_span_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.error = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def end(self) -> None:
+        self.end_ns = time.time_ns()
+        self.trace.spans.append(self)
+
+    def to_dict(self) -> dict:
+        """Serialize using the OpenTelemetry (OTLP/JSON) span layout"""
+        return {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': k, 'value': {'stringValue': str(v)}} for k, v in self.attributes.items()],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1}
+        }
+
+
+class Trace:
+    """Collects the spans of one sampled request"""
+
+    def __init__(self, trace_id: Optional[str] = None, parent_span_id: Optional[str] = None):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.parent_span_id = parent_span_id
+        self.spans = []
+
+
+class JsonLinesExporter:
+    """Appends finished traces to a local file, one span per line"""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace) -> None:
+        lines = ''.join(json.dumps(span.to_dict()) + '\n' for span in trace.spans)
+        with self._lock:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self._path, 'a') as f:
+                f.write(lines)
+
+
+class Tracer:
+    """Creates spans for the trace active in the current context"""
+
+    def __init__(self, sample_rate: float = 0.0, exporter: Optional[JsonLinesExporter] = None):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+    def configure(self, sample_rate: float, exporter: JsonLinesExporter) -> None:
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+    def should_sample(self) -> bool:
+        return self.exporter is not None and self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start_trace(self, name: str, trace_id: Optional[str] = None, parent_span_id: Optional[str] = None):
+        """Start a root span and make it current; returns (span, reset token)"""
+        span = Span(name, Trace(trace_id, parent_span_id))
+        return span, _current_span.set(span)
+
+    def finish_trace(self, span: Span, token) -> None:
+        span.end()
+        _current_span.reset(token)
+        if self.exporter is not None:
+            self.exporter.export(span.trace)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Child span of the current span; does nothing outside a sampled trace"""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(name, parent.trace, parent)
+        span.attributes.update(attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+
+tracer = Tracer()
+
+
+def traced(cls):
+    """Class decorator wrapping every public method in a child span"""
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith('_') or not inspect.isfunction(value):
+            continue
+        setattr(cls, attr, _wrap(f"{cls.__name__}.{attr}", value))
+    return cls
+
+
+def _wrap(name, method):
+    if inspect.isgeneratorfunction(method):
+        return _wrap_generator(name, method)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if _current_span.get() is None:
+            return method(*args, **kwargs)
+        with tracer.span(name):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+def _wrap_generator(name, method):
+    """Span from the call until the generator is exhausted or closed, so it covers producing the rows"""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        parent = _current_span.get()
+        if parent is None:
+            return method(*args, **kwargs)
+        return _spanned(Span(name, parent.trace, parent), method(*args, **kwargs))
+    return wrapper
+
+
+def _spanned(span: Span, generator):
+    # The span is not made current: the generator is resumed from its consumer's context
+    try:
+        yield from generator
+    except Exception as e:
+        span.error = repr(e)
+        raise
+    finally:
+        span.end()
+
+
+class RequestTracer:
+    """Flask extension that opens a root span for each sampled request
+
+    Requests are sampled at TRACE_SAMPLE_RATE, or when an incoming W3C
+    traceparent header has its sampled flag set and comes from an address in
+    TRACE_TRUSTED_NETWORKS (other clients only get their trace id continued).
+    Spans are exported to the JSON-lines file at TRACE_EXPORT_PATH.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault('TRACE_SAMPLE_RATE', float(os.getenv('TRACE_SAMPLE_RATE', '0')))
+        app.config.setdefault('TRACE_EXPORT_PATH', os.getenv('TRACE_EXPORT_PATH', 'traces/spans.jsonl'))
+        app.config.setdefault('TRACE_TRUSTED_NETWORKS', os.getenv('TRACE_TRUSTED_NETWORKS', '127.0.0.1/32,::1/128'))
+        tracer.configure(app.config['TRACE_SAMPLE_RATE'], JsonLinesExporter(app.config['TRACE_EXPORT_PATH']))
+        self._trusted_networks = [
+            ipaddress.ip_network(network.strip()) for network in app.config['TRACE_TRUSTED_NETWORKS'].split(',')
+            if network.strip()
+        ]
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    @staticmethod
+    def _parse_traceparent(header: Optional[str]):
+        # version-traceid-parentid-flags
+        parts = header.split('-') if header else []
+        if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16 and len(parts[3]) == 2:
+            try:
+                return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+            except ValueError:
+                pass
+        return None, None, False
+
+    def _is_trusted(self, address: Optional[str]) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self._trusted_networks)
+
+    def _before_request(self):
+        trace_id, parent_id, sampled = self._parse_traceparent(request.headers.get('traceparent'))
+        # An inbound sampled flag forces a trace to disk, so only trusted callers may set it
+        sampled = sampled and self._is_trusted(request.remote_addr)
+        if not sampled and not tracer.should_sample():
+            return
+        span, token = tracer.start_trace(f"{request.method} {request.url_rule or request.path}", trace_id, parent_id)
+        span.set_attribute('http.method', request.method)
+        span.set_attribute('http.target', request.full_path)
+        g.trace_span = span
+        g.trace_token = token
+
+    def _after_request(self, response):
+        span = g.get('trace_span')
+        if span is not None:
+            span.set_attribute('http.status_code', response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        span = g.pop('trace_span', None)
+        if span is None:
+            return
+        if exc is not None:
+            span.error = repr(exc)
+        tracer.finish_trace(span, g.pop('trace_token'))
@@ -1,14 +1,14 @@
-from .strategy import PricingContext, DailyPricingStrategy, WeeklyPricingStrategy, TieredPricingStrategy
+from .strategy import PricingContext, DailyPricingStrategy, WeeklyPricingStrategy, TieredPricingStrategy, PRICING_STRATEGIES
 from .factory import BookFactory, StandardBookFactory, PremiumBookFactory, ReaderFactory
 from .discount import DiscountContext, CategoryDiscountStrategy
 from .fine import FineContext, StandardFineCalculator
-from .observer import Observer, Subject, OverdueNotifier
+from .observer import Observer, Subject, OverdueNotifier, HoldReadyNotifier
 
 __all__ = [
-    'PricingContext', 'DailyPricingStrategy', 'WeeklyPricingStrategy', 'TieredPricingStrategy',
+    'PricingContext', 'DailyPricingStrategy', 'WeeklyPricingStrategy', 'TieredPricingStrategy', 'PRICING_STRATEGIES',
     'BookFactory', 'StandardBookFactory', 'PremiumBookFactory', 'ReaderFactory',
     'DiscountContext', 'CategoryDiscountStrategy',
     'FineContext', 'StandardFineCalculator',
-    'Observer', 'Subject', 'OverdueNotifier'
+    'Observer', 'Subject', 'OverdueNotifier', 'HoldReadyNotifier'
 ]
 
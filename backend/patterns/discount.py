@@ -1,5 +1,8 @@
 from abc import ABC, abstractmethod
+import numpy as np
+from sqlalchemy import case, literal
 from models.reader import ReaderCategory
+from monitoring.tracing import traced
 
 
 class DiscountStrategy(ABC):
@@ -8,6 +11,15 @@ class DiscountStrategy(ABC):
     @abstractmethod
     def calculate_discount(self, amount: float, category: ReaderCategory) -> float:
         pass
+    
+    def calculate_discounts(self, amounts: np.ndarray, categories: np.ndarray) -> np.ndarray:
+        """Batch version of calculate_discount; categories is an array of ReaderCategory"""
+        return np.vectorize(self.calculate_discount, otypes=[float])(amounts, categories)
+    
+    @abstractmethod
+    def discount_sql(self, amount, category):
+        """SQL expression equivalent to calculate_discount for column expressions"""
+        pass
 
 
 class NoDiscountStrategy(DiscountStrategy):
@@ -15,6 +27,12 @@ class NoDiscountStrategy(DiscountStrategy):
     
     def calculate_discount(self, amount: float, category: ReaderCategory) -> float:
         return 0.0
+    
+    def calculate_discounts(self, amounts: np.ndarray, categories: np.ndarray) -> np.ndarray:
+        return np.zeros(np.broadcast_shapes(np.shape(amounts), np.shape(categories)))
+    
+    def discount_sql(self, amount, category):
+        return literal(0.0)
 
 
 class CategoryDiscountStrategy(DiscountStrategy):
@@ -30,8 +48,20 @@ class CategoryDiscountStrategy(DiscountStrategy):
     def calculate_discount(self, amount: float, category: ReaderCategory) -> float:
         rate = self.DISCOUNT_RATES.get(category, 0.0)
         return amount * rate
+    
+    def calculate_discounts(self, amounts: np.ndarray, categories: np.ndarray) -> np.ndarray:
+        categories = np.asarray(categories, dtype=object)
+        rates = np.array([self.DISCOUNT_RATES.get(c, 0.0) for c in categories.ravel()], dtype=float)
+        return np.asarray(amounts, dtype=float) * rates.reshape(categories.shape)
+    
+    def discount_sql(self, amount, category):
+        return case(
+            *[(category == c, amount * rate) for c, rate in self.DISCOUNT_RATES.items()],
+            else_=0.0
+        )
 
 
+@traced
 class DiscountContext:
     """Context for discount strategy"""
     
@@ -44,4 +74,15 @@ class DiscountContext:
     def apply_discount(self, amount: float, category: ReaderCategory) -> float:
         discount = self._strategy.calculate_discount(amount, category)
         return max(0.0, amount - discount)
+    
+    def apply_discounts(self, amounts: np.ndarray, categories: np.ndarray) -> np.ndarray:
+        """Discounted amounts for broadcastable arrays of amounts and categories"""
+        amounts = np.asarray(amounts, dtype=float)
+        discounts = self._strategy.calculate_discounts(amounts, categories)
+        return np.maximum(0.0, amounts - discounts)
+    
+    def apply_discount_sql(self, amount, category):
+        """SQL expression for the discounted amount"""
+        discounted = amount - self._strategy.discount_sql(amount, category)
+        return case((discounted < 0.0, 0.0), else_=discounted)
 
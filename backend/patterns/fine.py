@@ -1,5 +1,8 @@
 from abc import ABC, abstractmethod
+import numpy as np
+from sqlalchemy import case, func
 from models.rental import RentalStatus
+from monitoring.tracing import traced
 
 
 class FineCalculator(ABC):
@@ -12,26 +15,65 @@ class FineCalculator(ABC):
     @abstractmethod
     def calculate_damage_fine(self, book_value: float, damage_level: str) -> float:
         pass
+    
+    def calculate_overdue_fines(self, days_overdue: np.ndarray, rental_costs: np.ndarray) -> np.ndarray:
+        """Batch version of calculate_overdue_fine over broadcastable arrays"""
+        return np.vectorize(self.calculate_overdue_fine, otypes=[float])(days_overdue, rental_costs)
+    
+    def calculate_damage_fines(self, book_values: np.ndarray, damage_levels: np.ndarray) -> np.ndarray:
+        """Batch version of calculate_damage_fine over broadcastable arrays"""
+        return np.vectorize(self.calculate_damage_fine, otypes=[float])(book_values, damage_levels)
+    
+    @abstractmethod
+    def overdue_fine_sql(self, days_overdue, rental_cost):
+        """SQL expression equivalent to calculate_overdue_fine for column expressions"""
+        pass
+    
+    @abstractmethod
+    def damage_fine_sql(self, book_value, damage_level):
+        """SQL expression equivalent to calculate_damage_fine for column expressions"""
+        pass
 
 
 class StandardFineCalculator(FineCalculator):
     """Standard fine calculation"""
     
+    DAMAGE_RATES = {
+        "minor": 0.1,   # 10% of book value
+        "moderate": 0.4,  # 40% of book value
+        "severe": 0.7,    # 70% of book value
+        "destroyed": 1.0  # 100% of book value
+    }
+    
     def calculate_overdue_fine(self, days_overdue: int, rental_cost: float) -> float:
         # $2 per day overdue, capped at 50% of book value
         return min(days_overdue * 2.0, rental_cost * 5)
     
     def calculate_damage_fine(self, book_value: float, damage_level: str) -> float:
-        damage_rates = {
-            "minor": 0.1,   # 10% of book value
-            "moderate": 0.4,  # 40% of book value
-            "severe": 0.7,    # 70% of book value
-            "destroyed": 1.0  # 100% of book value
-        }
-        rate = damage_rates.get(damage_level.lower(), 0.0)
+        rate = self.DAMAGE_RATES.get(damage_level.lower(), 0.0)
         return book_value * rate
+    
+    def calculate_overdue_fines(self, days_overdue: np.ndarray, rental_costs: np.ndarray) -> np.ndarray:
+        return np.minimum(np.asarray(days_overdue) * 2.0, np.asarray(rental_costs, dtype=float) * 5)
+    
+    def calculate_damage_fines(self, book_values: np.ndarray, damage_levels: np.ndarray) -> np.ndarray:
+        damage_levels = np.asarray(damage_levels, dtype=object)
+        rates = np.array([self.DAMAGE_RATES.get(level.lower(), 0.0) for level in damage_levels.ravel()], dtype=float)
+        return np.asarray(book_values, dtype=float) * rates.reshape(damage_levels.shape)
+    
+    def overdue_fine_sql(self, days_overdue, rental_cost):
+        by_day, cap = days_overdue * 2.0, rental_cost * 5
+        return case((by_day < cap, by_day), else_=cap)
+    
+    def damage_fine_sql(self, book_value, damage_level):
+        level = func.lower(damage_level)
+        return book_value * case(
+            *[(level == name, rate) for name, rate in self.DAMAGE_RATES.items()],
+            else_=0.0
+        )
 
 
+@traced
 class FineContext:
     """Context for fine calculation"""
     
@@ -46,4 +88,16 @@ class FineContext:
     
     def get_damage_fine(self, book_value: float, damage_level: str) -> float:
         return self._calculator.calculate_damage_fine(book_value, damage_level)
+    
+    def get_overdue_fines(self, days_overdue: np.ndarray, rental_costs: np.ndarray) -> np.ndarray:
+        return self._calculator.calculate_overdue_fines(days_overdue, rental_costs)
+    
+    def get_damage_fines(self, book_values: np.ndarray, damage_levels: np.ndarray) -> np.ndarray:
+        return self._calculator.calculate_damage_fines(book_values, damage_levels)
+    
+    def overdue_fine_sql(self, days_overdue, rental_cost):
+        return self._calculator.overdue_fine_sql(days_overdue, rental_cost)
+    
+    def damage_fine_sql(self, book_value, damage_level):
+        return self._calculator.damage_fine_sql(book_value, damage_level)
 
@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import List
 from models.rental import Rental
+from monitoring.tracing import traced
 
 
 class Observer(ABC):
@@ -19,6 +20,15 @@ class OverdueNotifier(Observer):
             print(f"ALERT: Rental {rental.id} is overdue! Reader {rental.reader_id}")
 
 
+class HoldReadyNotifier(Observer):
+    """Notifies when a returned copy is set aside for the next hold"""
+    
+    def update(self, rental: Rental, event: str) -> None:
+        if event == "hold_ready":
+            print(f"NOTICE: Book {rental.book_id} returned (rental {rental.id}) is set aside for the next hold")
+
+
+@traced
 class Subject:
     """Subject in observer pattern"""
     
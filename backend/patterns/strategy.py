@@ -1,6 +1,9 @@
 from abc import ABC, abstractmethod
 from datetime import date, timedelta
 from typing import Protocol
+import numpy as np
+from sqlalchemy import case
+from monitoring.tracing import traced
 
 
 class RentalPricingStrategy(ABC):
@@ -9,6 +12,15 @@ class RentalPricingStrategy(ABC):
     @abstractmethod
     def calculate_rental_cost(self, base_cost: float, days: int) -> float:
         pass
+    
+    def calculate_rental_costs(self, base_costs: np.ndarray, days: np.ndarray) -> np.ndarray:
+        """Batch version of calculate_rental_cost over broadcastable arrays"""
+        return np.vectorize(self.calculate_rental_cost, otypes=[float])(base_costs, days)
+    
+    @abstractmethod
+    def rental_cost_sql(self, base_cost, days):
+        """SQL expression equivalent to calculate_rental_cost for column expressions"""
+        pass
 
 
 class DailyPricingStrategy(RentalPricingStrategy):
@@ -16,6 +28,12 @@ class DailyPricingStrategy(RentalPricingStrategy):
     
     def calculate_rental_cost(self, base_cost: float, days: int) -> float:
         return base_cost * days
+    
+    def calculate_rental_costs(self, base_costs: np.ndarray, days: np.ndarray) -> np.ndarray:
+        return np.asarray(base_costs, dtype=float) * np.asarray(days)
+    
+    def rental_cost_sql(self, base_cost, days):
+        return base_cost * days
 
 
 class WeeklyPricingStrategy(RentalPricingStrategy):
@@ -24,6 +42,13 @@ class WeeklyPricingStrategy(RentalPricingStrategy):
     def calculate_rental_cost(self, base_cost: float, days: int) -> float:
         weeks = (days + 6) // 7  # Round up to nearest week
         return base_cost * weeks
+    
+    def calculate_rental_costs(self, base_costs: np.ndarray, days: np.ndarray) -> np.ndarray:
+        weeks = (np.asarray(days) + 6) // 7
+        return np.asarray(base_costs, dtype=float) * weeks
+    
+    def rental_cost_sql(self, base_cost, days):
+        return base_cost * ((days + 6) // 7)
 
 
 class TieredPricingStrategy(RentalPricingStrategy):
@@ -36,8 +61,31 @@ class TieredPricingStrategy(RentalPricingStrategy):
             return base_cost * 7 + (base_cost * 0.8) * (days - 7)
         else:
             return base_cost * 7 + (base_cost * 0.8) * 7 + (base_cost * 0.6) * (days - 14)
+    
+    def calculate_rental_costs(self, base_costs: np.ndarray, days: np.ndarray) -> np.ndarray:
+        days = np.asarray(days)
+        # Days falling into each tier: 1-7 at full rate, 8-14 at 80%, 15+ at 60%
+        first = np.minimum(days, 7)
+        second = np.clip(days - 7, 0, 7)
+        third = np.maximum(days - 14, 0)
+        return np.asarray(base_costs, dtype=float) * (first + 0.8 * second + 0.6 * third)
+    
+    def rental_cost_sql(self, base_cost, days):
+        return case(
+            (days <= 7, base_cost * days),
+            (days <= 14, base_cost * 7 + (base_cost * 0.8) * (days - 7)),
+            else_=base_cost * 7 + (base_cost * 0.8) * 7 + (base_cost * 0.6) * (days - 14)
+        )
+
 
+PRICING_STRATEGIES = {
+    'daily': DailyPricingStrategy,
+    'weekly': WeeklyPricingStrategy,
+    'tiered': TieredPricingStrategy
+}
 
+
+@traced
 class PricingContext:
     """Context class for strategy pattern"""
     
@@ -52,4 +100,12 @@ class PricingContext:
         if days <= 0:
             days = 1
         return self._strategy.calculate_rental_cost(base_cost, days)
-
+    
+    def calculate_costs(self, base_costs: np.ndarray, days: np.ndarray) -> np.ndarray:
+        """Costs for every (base cost, rental days) pair, broadcasting the inputs"""
+        days = np.maximum(np.asarray(days, dtype=int), 1)
+        return self._strategy.calculate_rental_costs(base_costs, days)
+    
+    def cost_sql(self, base_cost, days):
+        """SQL expression for the cost of a rental lasting `days` (an integer expression)"""
+        return self._strategy.rental_cost_sql(base_cost, case((days < 1, 1), else_=days))
@@ -1,4 +1,5 @@
-from .repository import Repository, BookRepository, ReaderRepository, RentalRepository
-
-__all__ = ['Repository', 'BookRepository', 'ReaderRepository', 'RentalRepository']
+from .repository import Repository, BookRepository, ReaderRepository, RentalRepository, BranchRepository, HoldRepository, PopularityRepository, RelatedBookRepository, ReaderSummaryRepository, RollupRepository, ChangeLogRepository
+from .memory import MemoryStore, InMemoryBookRepository, InMemoryReaderRepository, InMemoryRentalRepository
+from .unit_of_work import UnitOfWork
 
+__all__ = ['Repository', 'BookRepository', 'ReaderRepository', 'RentalRepository', 'BranchRepository', 'HoldRepository', 'PopularityRepository', 'RelatedBookRepository', 'ReaderSummaryRepository', 'RollupRepository', 'ChangeLogRepository', 'MemoryStore', 'InMemoryBookRepository', 'InMemoryReaderRepository', 'InMemoryRentalRepository', 'UnitOfWork']
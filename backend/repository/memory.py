@@ -0,0 +1,575 @@
+import atexit
+import copy
+import os
+import pickle
+import threading
+import time
+from datetime import date
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from models.book import Book
+from models.reader import Reader, telephone_digits, trigrams
+from models.rental import Rental, RentalStatus
+from database.db import db
+from monitoring.tracing import traced
+from repository.repository import (
+    Repository, _commit, _log_change, _delete_book_dependents, _delete_reader_dependents
+)
+
+
+_DELETED = object()
+
+OPEN_STATUSES = [RentalStatus.ACTIVE, RentalStatus.OVERDUE]
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    """Unpickler that only rebuilds the entity types a snapshot holds
+
+    Any other global in the file (a crafted pickle's way to run code) is refused.
+    """
+
+    ALLOWED = {
+        ('models.book', 'Book'), ('models.book', 'Genre'),
+        ('models.reader', 'Reader'), ('models.reader', 'ReaderCategory'),
+        ('models.rental', 'Rental'), ('models.rental', 'RentalStatus'),
+        ('datetime', 'date')
+    }
+
+    def find_class(self, module: str, name: str):
+        if (module, name) not in self.ALLOWED:
+            raise pickle.UnpicklingError(f'Snapshot may not contain {module}.{name}')
+        return super().find_class(module, name)
+
+
+def _copy(row):
+    """Copy of a stored entity for the caller, with change tracking started"""
+    entity = copy.copy(row)
+    entity.mark_clean()
+    return entity
+
+
+class MemoryTable:
+    """Committed entities of one kind by id, with secondary indexes
+
+    Each index maps the value of its key function to the ids of the entities
+    having it. Stored entities are replaced, never modified in place, so they
+    can be read without holding the store's lock.
+    """
+
+    def __init__(self, indexes: Dict[str, Callable]):
+        self.rows: Dict[int, object] = {}
+        self.last_id = 0
+        self.key_functions = indexes
+        self.indexes: Dict[str, Dict[object, set]] = {name: {} for name in indexes}
+
+    def put(self, id: int, row) -> None:
+        self.remove(id)
+        self.rows[id] = row
+        for name, key in self.key_functions.items():
+            self.indexes[name].setdefault(key(row), set()).add(id)
+
+    def remove(self, id: int) -> None:
+        row = self.rows.pop(id, None)
+        if row is None:
+            return
+        for name, key in self.key_functions.items():
+            ids = self.indexes[name][key(row)]
+            ids.discard(id)
+            if not ids:
+                del self.indexes[name][key(row)]
+
+    def load(self, rows: Dict[int, object], last_id: int) -> None:
+        self.rows, self.last_id = {}, last_id
+        self.indexes = {name: {} for name in self.key_functions}
+        for id, row in rows.items():
+            self.put(id, row)
+
+
+class MemoryTransaction:
+    """Writes of one session's transaction, invisible to others until commit
+
+    Inserts and deletes replace whole rows; updates only overwrite the fields
+    that were changed, like the UPDATE the SQL repositories issue. Row locks
+    taken with lock_row are held until commit or rollback.
+    """
+
+    def __init__(self, store: 'MemoryStore'):
+        self.store = store
+        self.writes: Dict[str, Dict[int, object]] = {}
+        self.changed: Dict[str, Dict[int, Optional[set]]] = {}  # None: the whole row
+        self.locks: List[threading.Lock] = []
+
+    def write(self, table: str, id: int, row, fields: Optional[Iterable[str]] = None) -> None:
+        self.writes.setdefault(table, {})[id] = row
+        changed = self.changed.setdefault(table, {})
+        if fields is None or (id in changed and changed[id] is None):
+            changed[id] = None
+        else:
+            changed[id] = changed.get(id, set()) | set(fields)
+
+    def commit(self) -> None:
+        with self.store.lock:
+            for name, writes in self.writes.items():
+                table = self.store.tables[name]
+                for id, row in writes.items():
+                    fields = self.changed[name][id]
+                    if row is _DELETED:
+                        table.remove(id)
+                    elif fields is None:
+                        table.put(id, row)
+                    elif id in table.rows:
+                        # Fields written by other transactions since this one read the row are kept
+                        current = copy.copy(table.rows[id])
+                        for field in fields:
+                            object.__setattr__(current, field, getattr(row, field))
+                        table.put(id, current)
+            if self.writes:
+                self.store.version += 1
+        self._release()
+
+    def rollback(self) -> None:
+        self._release()
+
+    def mark(self) -> tuple:
+        return (
+            {name: dict(writes) for name, writes in self.writes.items()},
+            {name: {id: None if fields is None else set(fields) for id, fields in changed.items()}
+             for name, changed in self.changed.items()}
+        )
+
+    def restore(self, mark: Optional[tuple]) -> None:
+        """Undo the writes made since mark(); None undoes them all (row locks stay held)"""
+        self.writes, self.changed = mark if mark is not None else ({}, {})
+
+    def _release(self) -> None:
+        for lock in reversed(self.locks):
+            lock.release()
+        self.locks = []
+
+
+class MemoryStore:
+    """Books, readers and rentals held in process memory
+
+    Writes go to a MemoryTransaction kept in the SQLAlchemy session's info,
+    which commits and rolls back with the session (see _commit_now and
+    UnitOfWork), so a write is applied in the same step as its change log
+    entry. The tables can be saved to and reloaded from a snapshot file.
+
+    Snapshots are pickles. Loading one only rebuilds books, readers, rentals
+    and their field types, but the file should still be writable by the
+    service's own user alone: whoever can replace it can rewrite the data.
+    """
+
+    INDEXES = {
+        'books': {'available': lambda book: book.available_copies > 0},
+        'readers': {},
+        'rentals': {
+            'status': lambda rental: rental.status,
+            'reader_id': lambda rental: rental.reader_id,
+            'book_id': lambda rental: rental.book_id
+        }
+    }
+    SNAPSHOT_FORMAT = 1
+
+    def __init__(self, snapshot_path: Optional[str] = None, lock_timeout: float = 10.0):
+        self.tables = {name: MemoryTable(indexes) for name, indexes in self.INDEXES.items()}
+        self.lock = threading.RLock()
+        self.version = 0
+        self._saved_version = 0
+        self._row_locks: Dict[Tuple[str, int], threading.Lock] = {}
+        self._lock_timeout = lock_timeout
+        self.snapshot_path = snapshot_path
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load(snapshot_path)
+
+    def transaction(self, create: bool = True) -> Optional[MemoryTransaction]:
+        transactions = db.session.info.get('memory_transactions')
+        if transactions is None:
+            if not create:
+                return None
+            transactions = db.session.info['memory_transactions'] = {}
+        transaction = transactions.get(self)
+        if transaction is None and create:
+            transaction = transactions[self] = MemoryTransaction(self)
+        return transaction
+
+    def get(self, table: str, id: int):
+        transaction = self.transaction(create=False)
+        row = transaction.writes.get(table, {}).get(id) if transaction else None
+        if row is None:
+            row = self.tables[table].rows.get(id)
+        return None if row is None or row is _DELETED else _copy(row)
+
+    def find(self, table: str, index: Optional[str] = None, keys: Iterable = (),
+             where: Optional[Callable] = None) -> list:
+        """Entities whose index key is one of keys (all of them without an index), in id order"""
+        memory_table = self.tables[table]
+        with self.lock:
+            if index is None:
+                rows = dict(memory_table.rows)
+            else:
+                rows = {id: memory_table.rows[id] for key in keys for id in memory_table.indexes[index].get(key, ())}
+        transaction = self.transaction(create=False)
+        if transaction:
+            key_function = memory_table.key_functions.get(index)
+            for id, row in transaction.writes.get(table, {}).items():
+                rows.pop(id, None)
+                if row is not _DELETED and (index is None or key_function(row) in keys):
+                    rows[id] = row
+        return [_copy(rows[id]) for id in sorted(rows) if where is None or where(rows[id])]
+
+    def insert(self, table: str, entity) -> int:
+        with self.lock:
+            memory_table = self.tables[table]
+            memory_table.last_id += 1
+            id = memory_table.last_id
+        row = copy.copy(entity)
+        object.__setattr__(row, 'id', id)
+        self.transaction().write(table, id, row)
+        return id
+
+    def update(self, table: str, entity, fields: Iterable[str]) -> bool:
+        """Overwrite the given fields of a stored entity; False if it does not exist"""
+        fields = list(fields)
+        current = self.get(table, entity.id)
+        if current is None or not fields:
+            return False
+        for field in fields:
+            object.__setattr__(current, field, getattr(entity, field))
+        self.transaction().write(table, entity.id, current, fields)
+        return True
+
+    def delete(self, table: str, id: int) -> bool:
+        if self.get(table, id) is None:
+            return False
+        self.transaction().write(table, id, _DELETED)
+        return True
+
+    def lock_row(self, table: str, id: int) -> None:
+        """Lock a row until the UnitOfWork ends, like SELECT ... FOR UPDATE (no-op outside one)"""
+        if not db.session.info.get('uow_depth'):
+            return
+        with self.lock:
+            row_lock = self._row_locks.setdefault((table, id), threading.Lock())
+        transaction = self.transaction()
+        if row_lock in transaction.locks:
+            return
+        if not row_lock.acquire(timeout=self._lock_timeout):
+            raise TimeoutError(f'Timed out waiting for the lock on {table} {id}')
+        transaction.locks.append(row_lock)
+
+    def save(self, path: Optional[str] = None) -> bool:
+        """Write the committed tables to a snapshot file, if they changed since the last save"""
+        path = path or self.snapshot_path
+        with self.lock:
+            if self.version == self._saved_version and os.path.exists(path):
+                return False
+            version = self.version
+            data = {
+                'format': self.SNAPSHOT_FORMAT,
+                'tables': {name: (table.last_id, dict(table.rows)) for name, table in self.tables.items()}
+            }
+        temporary = f'{path}.tmp'
+        with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        self._saved_version = version
+        return True
+
+    def load(self, path: str) -> None:
+        with open(path, 'rb') as f:
+            data = _SnapshotUnpickler(f).load()
+        if data.get('format') != self.SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format in {path}: {data.get('format')}")
+        with self.lock:
+            for name, (last_id, rows) in data['tables'].items():
+                self.tables[name].load(rows, last_id)
+
+    def start(self, interval: float) -> None:
+        """Save the snapshot every interval seconds and at exit"""
+        if not self.snapshot_path:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.save()
+                except Exception as e:
+                    print(f"Saving the storage snapshot failed: {e}")
+
+        threading.Thread(target=run, name='memory-snapshot', daemon=True).start()
+        atexit.register(self.save)
+
+
+@traced
+class InMemoryBookRepository(Repository):
+    """Repository for books kept in a MemoryStore"""
+
+    def __init__(self, store: MemoryStore):
+        self._store = store
+
+    def get_all(self) -> List[Book]:
+        return self._store.find('books')
+
+    def get_by_id(self, id: int) -> Optional[Book]:
+        return self._store.get('books', id)
+
+    def get_by_id_for_update(self, id: int) -> Optional[Book]:
+        """Load a book and lock it until the UnitOfWork ends"""
+        self._store.lock_row('books', id)
+        return self._store.get('books', id)
+
+    def get_by_ids(self, ids: Iterable[int]) -> List[Book]:
+        books = (self._store.get('books', id) for id in set(ids))
+        return [book for book in books if book]
+
+    def add(self, book: Book) -> int:
+        book_id = self._store.insert('books', book)
+        _log_change('book', book_id, 'add')
+        _commit()
+        return book_id
+
+    def update(self, book: Book) -> None:
+        updated = self._store.update('books', book, book.changed_fields())
+        book.mark_clean()
+        if updated:
+            _log_change('book', book.id, 'update')
+            _commit()
+
+    def delete(self, id: int) -> None:
+        if self._store.delete('books', id):
+            _delete_book_dependents(id)
+            _log_change('book', id, 'delete')
+            _commit()
+
+    def get_available_books(self) -> List[Book]:
+        return self._store.find('books', 'available', [True])
+
+    def get_columns(self, columns: List[str], ids: Optional[Iterable[int]] = None,
+                    available_only: bool = False) -> list:
+        """Books having the named columns as attributes, of all books or of ids"""
+        books = self.get_available_books() if available_only else self.get_all()
+        if ids is None:
+            return books
+        ids = set(ids)
+        return [book for book in books if book.id in ids]
+
+
+@traced
+class InMemoryReaderRepository(Repository):
+    """Repository for readers kept in a MemoryStore"""
+
+    def __init__(self, store: MemoryStore):
+        self._store = store
+
+    def get_all(self) -> List[Reader]:
+        return self._store.find('readers')
+
+    def get_by_id(self, id: int) -> Optional[Reader]:
+        return self._store.get('readers', id)
+
+    def get_by_ids(self, ids: Iterable[int]) -> List[Reader]:
+        readers = (self._store.get('readers', id) for id in set(ids))
+        return [reader for reader in readers if reader]
+
+    def add(self, reader: Reader) -> int:
+        reader_id = self._store.insert('readers', reader)
+        _log_change('reader', reader_id, 'add')
+        _commit()
+        return reader_id
+
+    def update(self, reader: Reader) -> None:
+        updated = self._store.update('readers', reader, reader.changed_fields())
+        reader.mark_clean()
+        if updated:
+            _log_change('reader', reader.id, 'update')
+            _commit()
+
+    def get_search_fields(self, ids: Optional[Iterable[int]] = None) -> List[Tuple[int, str, str]]:
+        """(id, full_name, telephone) of all readers or of ids"""
+        readers = self.get_all() if ids is None else self.get_by_ids(ids)
+        return [(reader.id, reader.full_name, reader.telephone) for reader in readers]
+
+    def get_columns(self, columns: List[str], ids: Optional[Iterable[int]] = None) -> list:
+        """Readers having the named columns as attributes, of all readers or of ids"""
+        return self.get_all() if ids is None else self.get_by_ids(ids)
+
+    def search(self, query: str, limit: int, similarity: float, timeout_ms: int) -> List[Reader]:
+        """Readers by telephone prefix, or by name prefix, substring and trigram similarity, best first
+
+        Scans every reader, ranking like ReaderRepository.search; LibraryService
+        searches the indexed ReaderSearchIndex instead. timeout_ms is not used.
+        """
+        readers = self.get_all()
+        digits = telephone_digits(query)
+        if digits and not any(char.isalpha() for char in query):
+            matches = [(telephone_digits(reader.telephone), reader.id, reader) for reader in readers]
+            matches = sorted((match for match in matches if match[0].startswith(digits)), key=lambda match: match[:2])
+            return [reader for _, _, reader in matches[:limit]]
+        term = query.strip().lower()
+        term_grams = trigrams(term)
+        ranked = []
+        for reader in readers:
+            name = reader.full_name.lower()
+            grams = trigrams(name)
+            union = len(term_grams | grams)
+            score = len(term_grams & grams) / union if union else 0.0
+            if term in name or score >= similarity:
+                ranked.append((not name.startswith(term), -score, reader.id, reader))
+        ranked.sort(key=lambda match: match[:3])
+        return [reader for _, _, _, reader in ranked[:limit]]
+
+    def delete(self, id: int) -> None:
+        if self._store.delete('readers', id):
+            _delete_reader_dependents(id)
+            _log_change('reader', id, 'delete')
+            _commit()
+
+
+@traced
+class InMemoryRentalRepository(Repository):
+    """Repository for rentals kept in a MemoryStore
+
+    Rentals are indexed by status, reader and book. There is no archive:
+    closed rentals stay in the one table.
+    """
+
+    def __init__(self, store: MemoryStore):
+        self._store = store
+
+    def get_all(self) -> List[Rental]:
+        return self._store.find('rentals')
+
+    def get_by_id(self, id: int) -> Optional[Rental]:
+        return self._store.get('rentals', id)
+
+    def get_by_id_for_update(self, id: int) -> Optional[Rental]:
+        """Load a rental and lock it until the UnitOfWork ends"""
+        self._store.lock_row('rentals', id)
+        return self._store.get('rentals', id)
+
+    def get_by_ids(self, ids: Iterable[int]) -> List[Rental]:
+        rentals = (self._store.get('rentals', id) for id in set(ids))
+        return [rental for rental in rentals if rental]
+
+    def add(self, rental: Rental) -> int:
+        rental_id = self._store.insert('rentals', rental)
+        _log_change('rental', rental_id, 'add')
+        _commit()
+        return rental_id
+
+    def update(self, rental: Rental) -> None:
+        updated = self._store.update('rentals', rental, rental.changed_fields())
+        rental.mark_clean()
+        if updated:
+            _log_change('rental', rental.id, 'update')
+            _commit()
+
+    def delete(self, id: int) -> None:
+        if self._store.delete('rentals', id):
+            _log_change('rental', id, 'delete')
+            _commit()
+
+    def get_active_rentals(self) -> List[Rental]:
+        return self._store.find('rentals', 'status', [RentalStatus.ACTIVE])
+
+    def get_overdue_rentals(self) -> List[Rental]:
+        today = date.today()
+        return self._store.find('rentals', 'status', [RentalStatus.ACTIVE],
+                                where=lambda rental: rental.expected_return_date < today)
+
+    def get_columns(self, columns: List[str], status: str = 'all') -> list:
+        """Rentals having the named columns as attributes, of all, active or overdue rentals
+
+        Active rentals past their expected return date read as OVERDUE, as
+        after Rental.update_status().
+        """
+        if status == 'overdue':
+            return self.get_overdue_rentals()
+        if status != 'active':
+            return self.get_all()
+        rentals = self.get_active_rentals()
+        for rental in rentals:
+            rental.update_status()
+        return rentals
+
+    def get_non_returned_rentals(self) -> List[Rental]:
+        """Get all rentals that are not returned (ACTIVE or OVERDUE)"""
+        return self._store.find('rentals', 'status', OPEN_STATUSES)
+
+    def get_reader_rentals(self, reader_id: int) -> List[Rental]:
+        return self._store.find('rentals', 'reader_id', [reader_id])
+
+    def get_open_reader_rentals(self, reader_id: int) -> List[Rental]:
+        """A reader's ACTIVE and OVERDUE rentals"""
+        return self._store.find('rentals', 'reader_id', [reader_id],
+                                where=lambda rental: rental.status in OPEN_STATUSES)
+
+    def get_nth_expected_return(self, book_id: int, n: int) -> Optional[date]:
+        """Expected return date of the book's (n+1)-th open rental due back"""
+        due = sorted(
+            rental.expected_return_date
+            for rental in self._store.find('rentals', 'book_id', [book_id],
+                                           where=lambda rental: rental.status in OPEN_STATUSES)
+        )
+        return due[n] if n < len(due) else None
+
+    def get_branch_rentals(self, branch_id: int, open_only: bool = False) -> List[Rental]:
+        """Rentals lent from a branch; open_only keeps just the ACTIVE and OVERDUE ones"""
+        if open_only:
+            return self._store.find('rentals', 'status', OPEN_STATUSES,
+                                    where=lambda rental: rental.branch_id == branch_id)
+        return self._store.find('rentals', where=lambda rental: rental.branch_id == branch_id)
+
+    def iter_with_names(self, start: Optional[date] = None, end: Optional[date] = None,
+                        include_returns: bool = False, batch_size: int = 1000) -> Iterator[dict]:
+        """Rentals with book title and reader name, in id order
+
+        Rentals issued within [start, end] are included, and with include_returns
+        also those returned within it.
+        """
+        def within(day: Optional[date]) -> bool:
+            return day is not None and (not start or day >= start) and (not end or day <= end)
+
+        for rental in self.get_all():
+            if (start or end) and not (within(rental.issue_date) or (include_returns and within(rental.actual_return_date))):
+                continue
+            book = self._store.get('books', rental.book_id)
+            reader = self._store.get('readers', rental.reader_id)
+            row = {name: getattr(rental, name) for name in rental.__dataclass_fields__}
+            row['book_title'] = book.title if book else None
+            row['reader_name'] = reader.full_name if reader else None
+            yield row
+
+    def get_projected_overdue_fines(self, fine_context, as_of: date) -> Tuple[int, float]:
+        """Count and total overdue fines if every open rental were returned on as_of"""
+        overdue = self._store.find('rentals', 'status', OPEN_STATUSES,
+                                   where=lambda rental: rental.expected_return_date < as_of)
+        total = sum(
+            fine_context.get_overdue_fine((as_of - rental.expected_return_date).days, rental.rental_cost)
+            for rental in overdue
+        )
+        return len(overdue), float(total)
+
+    def get_projected_rental_costs(self, pricing_context, discount_context) -> Tuple[int, float, float]:
+        """Count, charged total and re-priced total of all rentals under the given contexts"""
+        count, charged, total = 0, 0.0, 0.0
+        books, readers = {}, {}
+        for rental in self.get_all():
+            if rental.book_id not in books:
+                books[rental.book_id] = self._store.get('books', rental.book_id)
+            if rental.reader_id not in readers:
+                readers[rental.reader_id] = self._store.get('readers', rental.reader_id)
+            book, reader = books[rental.book_id], readers[rental.reader_id]
+            if not book or not reader:
+                continue
+            cost = pricing_context.calculate_cost(book.base_rental_cost, rental.issue_date, rental.expected_return_date)
+            count += 1
+            charged += rental.rental_cost
+            total += discount_context.apply_discount(cost, reader.category)
+        return count, charged, total
+
+    def archive_closed(self, returned_before: date, batch_size: int = 1000) -> int:
+        """Nothing to move: in-memory storage has no archive table"""
+        return 0
@@ -1,12 +1,118 @@
+import threading
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import Date, Integer, and_, case, cast, func, insert, literal, or_, select, text
+from sqlalchemy.exc import OperationalError
 from models.book import Book
-from models.reader import Reader
+from models.reader import Reader, telephone_digits
 from models.rental import Rental
+from models.branch import Branch, BranchStock
+from models.hold import Hold, HoldStatus
 from database.db import db
-from database.models import BookModel, ReaderModel, RentalModel
+from database.models import (
+    BookModel, ReaderModel, RentalModel, RentalArchiveModel, BranchModel, BranchStockModel, HoldModel,
+    BookPopularityModel, RelatedBookModel, ReaderSummaryModel,
+    RentalRollupModel, ChangeLogModel, ChangeLogPruneModel
+)
 from models.rental import RentalStatus
-from datetime import date
+from datetime import date, timedelta
+from models.book import Genre
+from models.reader import ReaderCategory
+from monitoring.tracing import tracer, traced
+from cache.invalidation import get_bus
+
+
+# Notified after every commit that wrote change log entries (wakes long-polling clients)
+change_signal = threading.Condition()
+
+
+def _commit() -> None:
+    """Commit, or only flush while a UnitOfWork is open (it commits once at the end)"""
+    if db.session.info.get('uow_depth'):
+        db.session.flush()
+    else:
+        _commit_now()
+
+
+def _commit_now() -> None:
+    with tracer.span('db.session.commit'):
+        try:
+            db.session.commit()
+        except Exception:
+            _end_memory_transactions(commit=False)
+            raise
+    _end_memory_transactions(commit=True)
+    if db.session.info.pop('changes_logged', False):
+        with change_signal:
+            change_signal.notify_all()
+    # Caches in every worker drop the entities only once the write is visible
+    get_bus().publish(db.session.info.pop('invalidations', []))
+
+
+def _end_memory_transactions(commit: bool) -> None:
+    """Apply or discard the writes made to in-memory storage in this session's transaction"""
+    for transaction in db.session.info.pop('memory_transactions', {}).values():
+        if commit:
+            transaction.commit()
+        else:
+            transaction.rollback()
+
+
+def _update_changed(model, entity, entity_name: str) -> None:
+    """Single UPDATE of the fields changed since the entity was loaded, without reading the row"""
+    changes = {field: getattr(entity, field) for field in entity.changed_fields()}
+    if not changes:
+        return
+    updated = model.query.filter(model.id == entity.id).update(changes)
+    entity.mark_clean()
+    if updated:
+        _log_change(entity_name, entity.id, 'update')
+        _commit()
+
+
+def _log_change(entity: str, entity_id: int, operation: str) -> None:
+    """Record a write in the change log as part of the current transaction"""
+    transaction = db.session().get_transaction()
+    if db.session.get_bind().dialect.name == 'postgresql' and db.session.info.get('change_log_lock') is not transaction:
+        # Serialize change log writers until commit so seq values become visible in order
+        db.session.execute(text('SELECT pg_advisory_xact_lock(hashtext(:name))'), {'name': 'change_log'})
+        db.session.info['change_log_lock'] = transaction
+    db.session.add(ChangeLogModel(entity=entity, entity_id=entity_id, operation=operation))
+    db.session.info['changes_logged'] = True
+    db.session.info.setdefault('invalidations', []).append(
+        {'entity': entity, 'id': entity_id, 'operation': operation}
+    )
+
+
+def _rental_history_models(start: Optional[date] = None) -> list:
+    """Rental tables holding history from start on: live, plus the archive unless it is empty or ends earlier"""
+    archived_until = db.session.query(func.max(RentalArchiveModel.actual_return_date)).scalar()
+    if archived_until is None or (start is not None and archived_until < start):
+        return [RentalModel]
+    return [RentalArchiveModel, RentalModel]
+
+
+def _delete_book_dependents(book_id: int) -> None:
+    """Delete the branch stock, holds, popularity counters and related-book rows of a book"""
+    BranchStockModel.query.filter(BranchStockModel.book_id == book_id).delete(synchronize_session=False)
+    HoldModel.query.filter(HoldModel.book_id == book_id).delete(synchronize_session=False)
+    BookPopularityModel.query.filter(BookPopularityModel.book_id == book_id).delete(synchronize_session=False)
+    RelatedBookModel.query.filter(
+        or_(RelatedBookModel.book_id == book_id, RelatedBookModel.related_book_id == book_id)
+    ).delete(synchronize_session=False)
+
+
+def _delete_reader_dependents(reader_id: int) -> None:
+    """Delete the holds and account summary of a reader"""
+    HoldModel.query.filter(HoldModel.reader_id == reader_id).delete(synchronize_session=False)
+    ReaderSummaryModel.query.filter(ReaderSummaryModel.reader_id == reader_id).delete(synchronize_session=False)
+
+
+def _select_columns(model, columns: Iterable[str], **labelled):
+    """Query of only the named columns (and labelled expressions); rows have them as attributes"""
+    return db.session.query(
+        *(labelled[name].label(name) if name in labelled else getattr(model, name) for name in columns)
+    )
 
 
 class Repository(ABC):
@@ -33,6 +139,7 @@ class Repository(ABC):
         pass
 
 
+@traced
 class BookRepository(Repository):
     """Repository for books using PostgreSQL"""
     
@@ -44,36 +151,54 @@ class BookRepository(Repository):
         book_model = BookModel.query.get(id)
         return book_model.to_book() if book_model else None
     
+    def get_by_id_for_update(self, id: int) -> Optional[Book]:
+        """Load a book and lock its row until the transaction ends"""
+        book_model = db.session.get(BookModel, id, with_for_update=True)
+        return book_model.to_book() if book_model else None
+    
+    def get_by_ids(self, ids: Iterable[int]) -> List[Book]:
+        """Fetch several books with a single IN query"""
+        ids = list(set(ids))
+        if not ids:
+            return []
+        book_models = BookModel.query.filter(BookModel.id.in_(ids)).all()
+        return [book_model.to_book() for book_model in book_models]
+    
     def add(self, book: Book) -> int:
         book_model = BookModel.from_book(book)
         db.session.add(book_model)
-        db.session.commit()
+        db.session.flush()
+        _log_change('book', book_model.id, 'add')
+        _commit()
         return book_model.id
     
     def update(self, book: Book) -> None:
-        book_model = BookModel.query.get(book.id)
-        if book_model:
-            book_model.title = book.title
-            book_model.author = book.author
-            book_model.genre = book.genre
-            book_model.deposit_cost = book.deposit_cost
-            book_model.base_rental_cost = book.base_rental_cost
-            book_model.total_copies = book.total_copies
-            book_model.available_copies = book.available_copies
-            book_model.value = book.value
-            db.session.commit()
+        _update_changed(BookModel, book, 'book')
     
     def delete(self, id: int) -> None:
         book_model = BookModel.query.get(id)
         if book_model:
+            _delete_book_dependents(id)
             db.session.delete(book_model)
-            db.session.commit()
+            _log_change('book', id, 'delete')
+            _commit()
     
     def get_available_books(self) -> List[Book]:
         book_models = BookModel.query.filter(BookModel.available_copies > 0).all()
         return [book_model.to_book() for book_model in book_models]
+    
+    def get_columns(self, columns: List[str], ids: Optional[Iterable[int]] = None,
+                    available_only: bool = False) -> list:
+        """Rows of only the named columns, of all books or of ids"""
+        query = _select_columns(BookModel, columns)
+        if ids is not None:
+            query = query.filter(BookModel.id.in_(list(ids)))
+        if available_only:
+            query = query.filter(BookModel.available_copies > 0)
+        return query.all()
 
 
+@traced
 class ReaderRepository(Repository):
     """Repository for readers using PostgreSQL"""
     
@@ -85,65 +210,133 @@ class ReaderRepository(Repository):
         reader_model = ReaderModel.query.get(id)
         return reader_model.to_reader() if reader_model else None
     
+    def get_by_ids(self, ids: Iterable[int]) -> List[Reader]:
+        """Fetch several readers with a single IN query"""
+        ids = list(set(ids))
+        if not ids:
+            return []
+        reader_models = ReaderModel.query.filter(ReaderModel.id.in_(ids)).all()
+        return [reader_model.to_reader() for reader_model in reader_models]
+    
     def add(self, reader: Reader) -> int:
         reader_model = ReaderModel.from_reader(reader)
         db.session.add(reader_model)
-        db.session.commit()
+        db.session.flush()
+        _log_change('reader', reader_model.id, 'add')
+        _commit()
         return reader_model.id
     
     def update(self, reader: Reader) -> None:
-        reader_model = ReaderModel.query.get(reader.id)
-        if reader_model:
-            reader_model.full_name = reader.full_name
-            reader_model.address = reader.address
-            reader_model.telephone = reader.telephone
-            reader_model.category = reader.category
-            db.session.commit()
+        _update_changed(ReaderModel, reader, 'reader')
+    
+    def get_search_fields(self, ids: Optional[Iterable[int]] = None) -> List[Tuple[int, str, str]]:
+        """(id, full_name, telephone) of all readers or of ids, without building Reader objects"""
+        query = db.session.query(ReaderModel.id, ReaderModel.full_name, ReaderModel.telephone)
+        if ids is not None:
+            query = query.filter(ReaderModel.id.in_(list(ids)))
+        return [tuple(row) for row in query]
+    
+    def get_columns(self, columns: List[str], ids: Optional[Iterable[int]] = None) -> list:
+        """Rows of only the named columns, of all readers or of ids"""
+        query = _select_columns(ReaderModel, columns)
+        if ids is not None:
+            query = query.filter(ReaderModel.id.in_(list(ids)))
+        return query.all()
+    
+    def search(self, query: str, limit: int, similarity: float, timeout_ms: int) -> List[Reader]:
+        """Readers by telephone prefix, or by name prefix, substring and trigram similarity, best first
+        
+        Uses the pg_trgm and telephone indexes created at startup (PostgreSQL
+        only). Raises TimeoutError when the search exceeds timeout_ms.
+        """
+        digits = telephone_digits(query)
+        # Settings local to this transaction, which ends with the request
+        db.session.execute(select(
+            func.set_config('statement_timeout', str(timeout_ms), True),
+            func.set_config('pg_trgm.similarity_threshold', str(similarity), True)
+        ))
+        if digits and not any(char.isalpha() for char in query):
+            phone = func.regexp_replace(ReaderModel.telephone, '[^0-9]', '', 'g')
+            statement = ReaderModel.query.filter(phone.like(f'{digits}%')).order_by(phone, ReaderModel.id)
+        else:
+            name = func.lower(ReaderModel.full_name)
+            term = query.strip().lower()
+            escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            is_prefix = name.like(f'{escaped}%', escape='\\')
+            statement = ReaderModel.query.filter(
+                or_(name.like(f'%{escaped}%', escape='\\'), name.op('%')(term))
+            ).order_by(is_prefix.desc(), func.similarity(name, term).desc(), ReaderModel.id)
+        try:
+            reader_models = statement.limit(limit).all()
+        except OperationalError as e:
+            db.session.rollback()
+            if getattr(e.orig, 'pgcode', None) == '57014':  # query_canceled
+                raise TimeoutError(f'Reader search exceeded {timeout_ms} ms') from e
+            raise
+        return [reader_model.to_reader() for reader_model in reader_models]
     
     def delete(self, id: int) -> None:
         reader_model = ReaderModel.query.get(id)
         if reader_model:
+            _delete_reader_dependents(id)
             db.session.delete(reader_model)
-            db.session.commit()
+            _log_change('reader', id, 'delete')
+            _commit()
 
 
+@traced
 class RentalRepository(Repository):
-    """Repository for rentals using PostgreSQL"""
+    """Repository for rentals using PostgreSQL
+    
+    Closed rentals can be moved to the rentals_archive table. Lookups by id
+    and open-rental queries read only the live table; history queries also
+    read the archive when it may hold rows for the requested dates.
+    """
+    
+    ARCHIVABLE_STATUSES = [RentalStatus.RETURNED, RentalStatus.DAMAGED]
     
     def get_all(self) -> List[Rental]:
-        rental_models = RentalModel.query.all()
-        return [rental_model.to_rental() for rental_model in rental_models]
+        """All rentals, live and archived"""
+        return [
+            rental_model.to_rental()
+            for model in _rental_history_models()
+            for rental_model in model.query.all()
+        ]
     
     def get_by_id(self, id: int) -> Optional[Rental]:
         rental_model = RentalModel.query.get(id)
         return rental_model.to_rental() if rental_model else None
     
+    def get_by_id_for_update(self, id: int) -> Optional[Rental]:
+        """Load a rental's current row and lock it until the transaction ends"""
+        rental_model = db.session.get(RentalModel, id, with_for_update=True, populate_existing=True)
+        return rental_model.to_rental() if rental_model else None
+    
+    def get_by_ids(self, ids: Iterable[int]) -> List[Rental]:
+        """Fetch several rentals with a single IN query"""
+        ids = list(set(ids))
+        if not ids:
+            return []
+        rental_models = RentalModel.query.filter(RentalModel.id.in_(ids)).all()
+        return [rental_model.to_rental() for rental_model in rental_models]
+    
     def add(self, rental: Rental) -> int:
         rental_model = RentalModel.from_rental(rental)
         db.session.add(rental_model)
-        db.session.commit()
+        db.session.flush()
+        _log_change('rental', rental_model.id, 'add')
+        _commit()
         return rental_model.id
     
     def update(self, rental: Rental) -> None:
-        rental_model = RentalModel.query.get(rental.id)
-        if rental_model:
-            rental_model.book_id = rental.book_id
-            rental_model.reader_id = rental.reader_id
-            rental_model.issue_date = rental.issue_date
-            rental_model.expected_return_date = rental.expected_return_date
-            rental_model.actual_return_date = rental.actual_return_date
-            rental_model.status = rental.status
-            rental_model.deposit_paid = rental.deposit_paid
-            rental_model.rental_cost = rental.rental_cost
-            rental_model.fine_amount = rental.fine_amount
-            rental_model.damage_fine = rental.damage_fine
-            db.session.commit()
+        _update_changed(RentalModel, rental, 'rental')
     
     def delete(self, id: int) -> None:
         rental_model = RentalModel.query.get(id)
         if rental_model:
             db.session.delete(rental_model)
-            db.session.commit()
+            _log_change('rental', id, 'delete')
+            _commit()
     
     def get_active_rentals(self) -> List[Rental]:
         rental_models = RentalModel.query.filter(RentalModel.status == RentalStatus.ACTIVE).all()
@@ -158,6 +351,27 @@ class RentalRepository(Repository):
         rentals = [rental_model.to_rental() for rental_model in rental_models]
         return [r for r in rentals if r.is_overdue()]
     
+    def get_columns(self, columns: List[str], status: str = 'all') -> list:
+        """Rows of only the named columns of all, active or overdue rentals
+        
+        Active rentals past their expected return date read as OVERDUE, as
+        after Rental.update_status().
+        """
+        if status == 'all':
+            return [row for model in _rental_history_models() for row in _select_columns(model, columns)]
+        today = date.today()
+        if status == 'active':
+            current_status = case(
+                (RentalModel.expected_return_date < today, literal(RentalStatus.OVERDUE, RentalModel.status.type)),
+                else_=RentalModel.status
+            )
+            query = _select_columns(RentalModel, columns, status=current_status)
+            return query.filter(RentalModel.status == RentalStatus.ACTIVE).all()
+        return _select_columns(RentalModel, columns).filter(
+            RentalModel.status == RentalStatus.ACTIVE,
+            RentalModel.expected_return_date < today
+        ).all()
+    
     def get_non_returned_rentals(self) -> List[Rental]:
         """Get all rentals that are not returned (ACTIVE or OVERDUE)"""
         rental_models = RentalModel.query.filter(
@@ -166,6 +380,683 @@ class RentalRepository(Repository):
         return [rental_model.to_rental() for rental_model in rental_models]
     
     def get_reader_rentals(self, reader_id: int) -> List[Rental]:
-        rental_models = RentalModel.query.filter(RentalModel.reader_id == reader_id).all()
+        return [
+            rental_model.to_rental()
+            for model in _rental_history_models()
+            for rental_model in model.query.filter(model.reader_id == reader_id).all()
+        ]
+    
+    def get_open_reader_rentals(self, reader_id: int) -> List[Rental]:
+        """A reader's ACTIVE and OVERDUE rentals (closed ones are the only rentals archived)"""
+        rental_models = RentalModel.query.filter(
+            RentalModel.reader_id == reader_id,
+            RentalModel.status.in_([RentalStatus.ACTIVE, RentalStatus.OVERDUE])
+        ).all()
         return [rental_model.to_rental() for rental_model in rental_models]
+    
+    def get_nth_expected_return(self, book_id: int, n: int) -> Optional[date]:
+        """Expected return date of the book's (n+1)-th open rental due back, via the open-rentals index"""
+        return db.session.query(RentalModel.expected_return_date).filter(
+            RentalModel.book_id == book_id,
+            RentalModel.status.in_([RentalStatus.ACTIVE, RentalStatus.OVERDUE])
+        ).order_by(RentalModel.expected_return_date).offset(n).limit(1).scalar()
+    
+    def get_branch_rentals(self, branch_id: int, open_only: bool = False) -> List[Rental]:
+        """Rentals lent from a branch; open_only reads just the live ACTIVE and OVERDUE ones"""
+        if open_only:
+            rental_models = RentalModel.query.filter(
+                RentalModel.branch_id == branch_id,
+                RentalModel.status.in_([RentalStatus.ACTIVE, RentalStatus.OVERDUE])
+            ).all()
+            return [rental_model.to_rental() for rental_model in rental_models]
+        return [
+            rental_model.to_rental()
+            for model in _rental_history_models()
+            for rental_model in model.query.filter(model.branch_id == branch_id).all()
+        ]
+    
+    def iter_with_names(self, start: Optional[date] = None, end: Optional[date] = None,
+                        include_returns: bool = False, batch_size: int = 1000) -> Iterator[dict]:
+        """Stream rentals with book title and reader name from a server-side cursor
+        
+        Rentals issued within [start, end] are included, and with include_returns
+        also those returned within it. Rows are fetched batch_size at a time,
+        archived rentals first, each table in id order.
+        """
+        for model in _rental_history_models(start):
+            query = db.session.query(
+                *[getattr(model, column.name) for column in RentalModel.__table__.columns],
+                BookModel.title.label('book_title'),
+                ReaderModel.full_name.label('reader_name')
+            ).outerjoin(
+                BookModel, model.book_id == BookModel.id
+            ).outerjoin(
+                ReaderModel, model.reader_id == ReaderModel.id
+            )
+            
+            conditions = []
+            for column in [model.issue_date] + ([model.actual_return_date] if include_returns else []):
+                bounds = []
+                if start:
+                    bounds.append(column >= start)
+                if end:
+                    bounds.append(column <= end)
+                if bounds:
+                    conditions.append(and_(*bounds))
+            if conditions:
+                query = query.filter(or_(*conditions))
+            
+            for row in query.order_by(model.id).yield_per(batch_size):
+                yield row._asdict()
+    
+    def get_projected_overdue_fines(self, fine_context, as_of: date) -> Tuple[int, float]:
+        """Count and total overdue fines if every open rental were returned on as_of"""
+        days_overdue = _days_between(literal(as_of, type_=Date), RentalModel.expected_return_date)
+        fine = fine_context.overdue_fine_sql(days_overdue, RentalModel.rental_cost)
+        count, total = db.session.query(
+            func.count(RentalModel.id),
+            func.coalesce(func.sum(fine), 0.0)
+        ).filter(
+            RentalModel.status.in_([RentalStatus.ACTIVE, RentalStatus.OVERDUE]),
+            RentalModel.expected_return_date < as_of
+        ).one()
+        return count, float(total)
+    
+    def get_projected_rental_costs(self, pricing_context, discount_context) -> Tuple[int, float, float]:
+        """Count, charged total and re-priced total of all rentals under the given contexts"""
+        count, charged, total = 0, 0.0, 0.0
+        for model in _rental_history_models():
+            days = _days_between(model.expected_return_date, model.issue_date)
+            projected = discount_context.apply_discount_sql(
+                pricing_context.cost_sql(BookModel.base_rental_cost, days), ReaderModel.category
+            )
+            model_count, model_charged, model_total = db.session.query(
+                func.count(model.id),
+                func.coalesce(func.sum(model.rental_cost), 0.0),
+                func.coalesce(func.sum(projected), 0.0)
+            ).join(BookModel, model.book_id == BookModel.id).join(
+                ReaderModel, model.reader_id == ReaderModel.id
+            ).one()
+            count, charged, total = count + model_count, charged + float(model_charged), total + float(model_total)
+        return count, charged, total
+    
+    def archive_closed(self, returned_before: date, batch_size: int = 1000) -> int:
+        """Move returned and damaged rentals closed before returned_before to the archive
+        
+        Rows are moved batch_size at a time, one transaction per batch, so the
+        live table stays writable while a large backlog is archived.
+        """
+        columns = [column.name for column in RentalModel.__table__.columns]
+        moved = 0
+        while True:
+            ids = [id for (id,) in db.session.query(RentalModel.id).filter(
+                RentalModel.status.in_(self.ARCHIVABLE_STATUSES),
+                RentalModel.actual_return_date < returned_before
+            ).order_by(RentalModel.id).limit(batch_size).with_for_update(skip_locked=True)]
+            if not ids:
+                return moved
+            
+            db.session.execute(insert(RentalArchiveModel).from_select(
+                columns,
+                select(*[RentalModel.__table__.c[name] for name in columns]).where(RentalModel.id.in_(ids))
+            ))
+            RentalModel.query.filter(RentalModel.id.in_(ids)).delete(synchronize_session=False)
+            for id in ids:
+                _log_change('rental', id, 'archive')
+            _commit()
+            moved += len(ids)
+
 
+@traced
+class BranchRepository(Repository):
+    """Repository for branches and the copies of each book they hold"""
+    
+    def get_all(self) -> List[Branch]:
+        return [branch_model.to_branch() for branch_model in BranchModel.query.order_by(BranchModel.id).all()]
+    
+    def get_by_id(self, id: int) -> Optional[Branch]:
+        branch_model = db.session.get(BranchModel, id)
+        return branch_model.to_branch() if branch_model else None
+    
+    def add(self, branch: Branch) -> int:
+        branch_model = BranchModel(name=branch.name, address=branch.address)
+        db.session.add(branch_model)
+        db.session.flush()
+        _commit()
+        return branch_model.id
+    
+    def update(self, branch: Branch) -> None:
+        BranchModel.query.filter(BranchModel.id == branch.id).update({'name': branch.name, 'address': branch.address})
+        _commit()
+    
+    def delete(self, id: int) -> None:
+        branch_model = db.session.get(BranchModel, id)
+        if branch_model:
+            BranchStockModel.query.filter(BranchStockModel.branch_id == id).delete(synchronize_session=False)
+            db.session.delete(branch_model)
+            _commit()
+    
+    def get_stock_for_update(self, branch_id: int, book_id: int) -> Optional[BranchStock]:
+        """Load one branch's stock of a book and lock the row until the transaction ends"""
+        stock_model = BranchStockModel.query.filter(
+            BranchStockModel.branch_id == branch_id,
+            BranchStockModel.book_id == book_id
+        ).with_for_update().first()
+        return stock_model.to_stock() if stock_model else None
+    
+    def lock_stock(self, book_ids: Iterable[int]) -> None:
+        """Lock every branch's stock rows of the books, in (book_id, branch_id) order"""
+        BranchStockModel.query.filter(BranchStockModel.book_id.in_(list(book_ids))).order_by(
+            BranchStockModel.book_id, BranchStockModel.branch_id
+        ).with_for_update().all()
+    
+    def get_first_stock_with_copy(self, book_id: int) -> Optional[BranchStock]:
+        """Lowest-id branch with a copy of the book on the shelf, locked until the transaction ends"""
+        stock_model = BranchStockModel.query.filter(
+            BranchStockModel.book_id == book_id,
+            BranchStockModel.available_copies > 0
+        ).order_by(BranchStockModel.branch_id).with_for_update().first()
+        return stock_model.to_stock() if stock_model else None
+    
+    def get_shelved_copies(self, book_id: int) -> int:
+        """Copies of the book on the shelf at any branch"""
+        return db.session.query(func.coalesce(func.sum(BranchStockModel.available_copies), 0)).filter(
+            BranchStockModel.book_id == book_id
+        ).scalar()
+    
+    def get_branches_with_copies(self, book_id: int) -> List[Tuple[Branch, int]]:
+        """Branches holding a copy of the book right now, read through the partial in-stock index"""
+        rows = db.session.query(BranchModel, BranchStockModel.available_copies).join(
+            BranchStockModel, BranchStockModel.branch_id == BranchModel.id
+        ).filter(
+            BranchStockModel.book_id == book_id,
+            BranchStockModel.available_copies > 0
+        ).order_by(BranchModel.id).all()
+        return [(branch_model.to_branch(), available) for branch_model, available in rows]
+    
+    def get_branch_books(self, branch_id: int, available_only: bool = False) -> List[Tuple[Book, BranchStock]]:
+        """Books stocked at a branch with the branch's own copy counts"""
+        query = db.session.query(BookModel, BranchStockModel).join(
+            BranchStockModel, BranchStockModel.book_id == BookModel.id
+        ).filter(BranchStockModel.branch_id == branch_id, BranchStockModel.total_copies > 0)
+        if available_only:
+            query = query.filter(BranchStockModel.available_copies > 0)
+        return [(book_model.to_book(), stock_model.to_stock()) for book_model, stock_model in query.order_by(BookModel.id)]
+    
+    def adjust_stock(self, branch_id: int, book_id: int, total: int = 0, available: int = 0) -> None:
+        """Add to a branch's total and available copies of a book, creating the stock row if needed"""
+        _upsert_increment(
+            BranchStockModel,
+            {'book_id': book_id, 'branch_id': branch_id},
+            {'total_copies': total, 'available_copies': available}
+        )
+        _commit()
+
+
+@traced
+class HoldRepository(Repository):
+    """Repository for the per-book holds queues"""
+    
+    def get_all(self) -> List[Hold]:
+        return [hold_model.to_hold() for hold_model in HoldModel.query.order_by(HoldModel.id).all()]
+    
+    def get_by_id(self, id: int) -> Optional[Hold]:
+        hold_model = db.session.get(HoldModel, id)
+        return hold_model.to_hold() if hold_model else None
+    
+    def add(self, hold: Hold) -> int:
+        hold_model = HoldModel(
+            book_id=hold.book_id,
+            reader_id=hold.reader_id,
+            placed_at=hold.placed_at,
+            status=hold.status,
+            branch_id=hold.branch_id,
+            ready_until=hold.ready_until
+        )
+        db.session.add(hold_model)
+        db.session.flush()
+        _commit()
+        return hold_model.id
+    
+    def update(self, hold: Hold) -> None:
+        HoldModel.query.filter(HoldModel.id == hold.id).update({
+            'status': hold.status,
+            'branch_id': hold.branch_id,
+            'ready_until': hold.ready_until
+        })
+        _commit()
+    
+    def delete(self, id: int) -> None:
+        HoldModel.query.filter(HoldModel.id == id).delete()
+        _commit()
+    
+    def get_queue(self, book_id: int) -> List[Hold]:
+        """Open holds on a book: READY ones first, then WAITING ones in the order they were placed"""
+        hold_models = HoldModel.query.filter(
+            HoldModel.book_id == book_id,
+            HoldModel.status.in_([HoldStatus.WAITING, HoldStatus.READY])
+        ).order_by(HoldModel.id).all()
+        holds = [hold_model.to_hold() for hold_model in hold_models]
+        return sorted(holds, key=lambda hold: hold.status != HoldStatus.READY)
+    
+    def get_next_waiting(self, book_id: int) -> Optional[Hold]:
+        """Head of the book's queue; callers hold the book row lock, which serializes queue changes"""
+        hold_model = HoldModel.query.filter(
+            HoldModel.book_id == book_id,
+            HoldModel.status == HoldStatus.WAITING
+        ).order_by(HoldModel.id).first()
+        return hold_model.to_hold() if hold_model else None
+    
+    def count_waiting(self, book_id: int) -> int:
+        return HoldModel.query.filter(HoldModel.book_id == book_id, HoldModel.status == HoldStatus.WAITING).count()
+    
+    def get_open_for_reader(self, book_id: int, reader_id: int) -> Optional[Hold]:
+        hold_model = HoldModel.query.filter(
+            HoldModel.book_id == book_id,
+            HoldModel.reader_id == reader_id,
+            HoldModel.status.in_([HoldStatus.WAITING, HoldStatus.READY])
+        ).first()
+        return hold_model.to_hold() if hold_model else None
+    
+    def get_reader_holds(self, reader_id: int) -> List[Hold]:
+        hold_models = HoldModel.query.filter(HoldModel.reader_id == reader_id).order_by(HoldModel.id).all()
+        return [hold_model.to_hold() for hold_model in hold_models]
+    
+    def get_expired(self, today: date) -> List[Hold]:
+        """READY holds whose pickup deadline has passed"""
+        hold_models = HoldModel.query.filter(
+            HoldModel.status == HoldStatus.READY,
+            HoldModel.ready_until < today
+        ).order_by(HoldModel.id).all()
+        return [hold_model.to_hold() for hold_model in hold_models]
+
+
+def bucket_start(granularity: str, day: date) -> date:
+    """First day of the day/week/month bucket containing day (weeks start on Monday)"""
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def _days_between(later, earlier):
+    """Whole days from earlier to later as an integer SQL expression"""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        # SQLite stores dates as text; subtracting them would compare the leading year
+        return cast(func.julianday(later) - func.julianday(earlier), Integer)
+    return cast(later - earlier, Integer)
+
+
+def _dialect_insert():
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upsert is not supported on {dialect}")
+    return insert
+
+
+def _upsert_increment(model, keys: dict, increments: dict, insert_only: Optional[dict] = None,
+                      assign: Optional[dict] = None) -> None:
+    """INSERT a row or add increments to the existing one, atomically in the database
+    
+    insert_only holds further columns that are written only when the row is
+    created, assign columns that are overwritten either way.
+    """
+    insert = _dialect_insert()
+    table = model.__table__
+    statement = insert(table).values(**keys, **increments, **(insert_only or {}), **(assign or {}))
+    statement = statement.on_conflict_do_update(
+        index_elements=list(keys),
+        set_=dict(
+            {column: table.c[column] + statement.excluded[column] for column in increments},
+            **{column: statement.excluded[column] for column in assign or {}}
+        )
+    )
+    db.session.execute(statement)
+
+
+def _insert_if_missing(model, keys: dict, values: dict) -> None:
+    """INSERT a row unless one with these keys exists, without failing on concurrent inserts"""
+    insert = _dialect_insert()
+    statement = insert(model.__table__).values(**keys, **values).on_conflict_do_nothing(index_elements=list(keys))
+    db.session.execute(statement)
+
+
+@traced
+class RollupRepository:
+    """Time-bucketed circulation and revenue totals kept current by checkouts and returns"""
+    
+    GRANULARITIES = ('day', 'week', 'month')
+    COUNTERS = ('rentals_issued', 'returns', 'deposits', 'rental_income', 'fines')
+    
+    def record(self, day: date, genre: Genre, category: ReaderCategory, **increments) -> None:
+        """Add increments (see COUNTERS) to the day, week and month buckets of day"""
+        increments = {counter: increments.get(counter, 0) for counter in self.COUNTERS}
+        for granularity in self.GRANULARITIES:
+            keys = {
+                'granularity': granularity,
+                'bucket_start': bucket_start(granularity, day),
+                'genre': genre,
+                'category': category
+            }
+            _upsert_increment(RentalRollupModel, keys, increments)
+        _commit()
+    
+    def record_checkout(self, rental: Rental, genre: Genre, category: ReaderCategory) -> None:
+        self.record(rental.issue_date, genre, category, rentals_issued=1, deposits=rental.deposit_paid)
+    
+    def record_return(self, rental: Rental, genre: Genre, category: ReaderCategory) -> None:
+        self.record(rental.actual_return_date, genre, category, returns=1,
+                    rental_income=rental.rental_cost, fines=rental.fine_amount + rental.damage_fine)
+    
+    def rebuild(self, batch_size: int = 1000) -> int:
+        """Recompute all rollups from live and archived rentals; returns the number of rollup rows"""
+        totals = {}
+        
+        def add(day, genre, category, **increments):
+            for granularity in self.GRANULARITIES:
+                key = (granularity, bucket_start(granularity, day), genre, category)
+                row = totals.setdefault(key, dict.fromkeys(self.COUNTERS, 0))
+                for counter, amount in increments.items():
+                    row[counter] += amount
+        
+        for model in _rental_history_models():
+            rows = db.session.query(model, BookModel.genre, ReaderModel.category).join(
+                BookModel, model.book_id == BookModel.id
+            ).join(
+                ReaderModel, model.reader_id == ReaderModel.id
+            ).yield_per(batch_size)
+            
+            for rental_model, genre, category in rows:
+                rental = rental_model.to_rental()
+                add(rental.issue_date, genre, category, rentals_issued=1, deposits=rental.deposit_paid)
+                if rental.status in [RentalStatus.RETURNED, RentalStatus.DAMAGED] and rental.actual_return_date:
+                    add(rental.actual_return_date, genre, category, returns=1,
+                        rental_income=rental.rental_cost, fines=rental.fine_amount + rental.damage_fine)
+        
+        RentalRollupModel.query.delete()
+        db.session.bulk_insert_mappings(RentalRollupModel, [
+            {'granularity': g, 'bucket_start': b, 'genre': genre, 'category': category, **counters}
+            for (g, b, genre, category), counters in totals.items()
+        ])
+        _commit()
+        return len(totals)
+    
+    def get_timeseries(self, granularity: str, start: Optional[date] = None, end: Optional[date] = None,
+                       genre: Optional[Genre] = None, category: Optional[ReaderCategory] = None) -> List[dict]:
+        query = RentalRollupModel.query.filter(RentalRollupModel.granularity == granularity)
+        if start:
+            query = query.filter(RentalRollupModel.bucket_start >= bucket_start(granularity, start))
+        if end:
+            query = query.filter(RentalRollupModel.bucket_start <= end)
+        if genre:
+            query = query.filter(RentalRollupModel.genre == genre)
+        if category:
+            query = query.filter(RentalRollupModel.category == category)
+        query = query.order_by(RentalRollupModel.bucket_start, RentalRollupModel.genre, RentalRollupModel.category)
+        return [rollup.to_dict() for rollup in query.all()]
+
+
+@traced
+class PopularityRepository:
+    """Per-book checkout counters for the weekly, monthly and all-time popularity leaderboards"""
+    
+    GRANULARITIES = ('week', 'month', 'all')
+    
+    @staticmethod
+    def bucket_start(granularity: str, day: date) -> date:
+        return date.min if granularity == 'all' else bucket_start(granularity, day)
+    
+    def record_checkout(self, rental: Rental, genre: Genre) -> None:
+        for granularity in self.GRANULARITIES:
+            keys = {
+                'granularity': granularity,
+                'bucket_start': self.bucket_start(granularity, rental.issue_date),
+                'book_id': rental.book_id
+            }
+            _upsert_increment(BookPopularityModel, keys, {'rentals': 1}, insert_only={'genre': genre})
+        _commit()
+    
+    def get_top(self, granularity: str, day: date, limit: int) -> List[dict]:
+        """The limit most rented books of each genre in the bucket containing day, most rented first
+        
+        The overall top `limit` is always among these rows.
+        """
+        ranked = select(
+            BookPopularityModel.book_id,
+            BookPopularityModel.genre,
+            BookPopularityModel.rentals,
+            func.row_number().over(
+                partition_by=BookPopularityModel.genre,
+                order_by=(BookPopularityModel.rentals.desc(), BookPopularityModel.book_id)
+            ).label('rank')
+        ).where(
+            BookPopularityModel.granularity == granularity,
+            BookPopularityModel.bucket_start == self.bucket_start(granularity, day)
+        ).subquery()
+        rows = db.session.query(ranked, BookModel.title, BookModel.author).join(
+            BookModel, BookModel.id == ranked.c.book_id
+        ).filter(ranked.c.rank <= limit).order_by(ranked.c.rentals.desc(), ranked.c.book_id).all()
+        return [{
+            'book_id': row.book_id,
+            'title': row.title,
+            'author': row.author,
+            'genre': row.genre,
+            'rentals': row.rentals
+        } for row in rows]
+    
+    def expire(self, today: date) -> int:
+        """Delete weekly and monthly counters of buckets before the current ones"""
+        deleted = 0
+        for granularity in ('week', 'month'):
+            deleted += BookPopularityModel.query.filter(
+                BookPopularityModel.granularity == granularity,
+                BookPopularityModel.bucket_start < bucket_start(granularity, today)
+            ).delete(synchronize_session=False)
+        _commit()
+        return deleted
+    
+    def rebuild(self, today: date, batch_size: int = 1000) -> int:
+        """Recompute the current buckets from live and archived rentals; returns the number of counter rows"""
+        totals = {}
+        for model in _rental_history_models():
+            rows = db.session.query(model.book_id, model.issue_date, BookModel.genre).join(
+                BookModel, model.book_id == BookModel.id
+            ).yield_per(batch_size)
+            
+            for book_id, issue_date, genre in rows:
+                for granularity in self.GRANULARITIES:
+                    start = self.bucket_start(granularity, issue_date)
+                    if start == self.bucket_start(granularity, today):
+                        key = (granularity, start, book_id, genre)
+                        totals[key] = totals.get(key, 0) + 1
+        
+        BookPopularityModel.query.delete()
+        db.session.bulk_insert_mappings(BookPopularityModel, [
+            {'granularity': g, 'bucket_start': b, 'book_id': book_id, 'genre': genre, 'rentals': rentals}
+            for (g, b, book_id, genre), rentals in totals.items()
+        ])
+        _commit()
+        return len(totals)
+
+
+@traced
+class RelatedBookRepository:
+    """Stored "readers also rented" neighbours and the rental history they are built from"""
+    
+    def get_reader_book_pairs(self, batch_size: int = 10000) -> Tuple[List[int], List[int]]:
+        """Distinct (reader, book) pairs of live and archived rentals, as parallel lists"""
+        reader_ids, book_ids = [], []
+        for model in _rental_history_models():
+            rows = db.session.query(model.reader_id, model.book_id).distinct().yield_per(batch_size)
+            for reader_id, book_id in rows:
+                reader_ids.append(reader_id)
+                book_ids.append(book_id)
+        return reader_ids, book_ids
+    
+    def get_last_rental_id(self) -> Optional[int]:
+        ids = [db.session.query(func.max(model.id)).scalar() for model in _rental_history_models()]
+        return max((id for id in ids if id is not None), default=None)
+    
+    def get_built_through(self) -> Optional[int]:
+        """Newest rental the stored neighbours account for; None before the first build"""
+        return db.session.query(func.max(RelatedBookModel.through_rental_id)).scalar()
+    
+    def get_readers_since(self, rental_id: int) -> List[int]:
+        """Readers with rentals newer than rental_id"""
+        reader_ids = set()
+        for model in _rental_history_models():
+            rows = db.session.query(model.reader_id).filter(model.id > rental_id).distinct()
+            reader_ids.update(reader_id for reader_id, in rows)
+        return sorted(reader_ids)
+    
+    def get_all(self) -> Dict[int, List[dict]]:
+        return self._load()
+    
+    def get_for_books(self, book_ids: Iterable[int]) -> Dict[int, List[dict]]:
+        return self._load(RelatedBookModel.book_id.in_(list(book_ids)))
+    
+    def replace(self, neighbours: Dict[int, List[Tuple[int, int]]], through_rental_id: int,
+                book_ids: Optional[Iterable[int]] = None) -> int:
+        """Store neighbours (book id -> [(related id, shared readers)]) for book_ids, or for every book
+        
+        Returns the number of rows written. Other workers reload the replaced books.
+        """
+        query = RelatedBookModel.query
+        if book_ids is not None:
+            book_ids = list(book_ids)
+            query = query.filter(RelatedBookModel.book_id.in_(book_ids))
+        query.delete(synchronize_session=False)
+        rows = [
+            {'book_id': book_id, 'related_book_id': related_id, 'rank': rank,
+             'shared_readers': shared, 'through_rental_id': through_rental_id}
+            for book_id, related in neighbours.items()
+            for rank, (related_id, shared) in enumerate(related, 1)
+        ]
+        db.session.bulk_insert_mappings(RelatedBookModel, rows)
+        events = db.session.info.setdefault('invalidations', [])
+        if book_ids is None:
+            events.append({'entity': 'related', 'id': None, 'operation': 'rebuild'})
+        else:
+            events.extend({'entity': 'related', 'id': book_id, 'operation': 'update'} for book_id in book_ids)
+        _commit()
+        return len(rows)
+    
+    @staticmethod
+    def _load(*criteria) -> Dict[int, List[dict]]:
+        """Stored neighbours by book id, best first, with the related books' catalog fields"""
+        rows = db.session.query(
+            RelatedBookModel.book_id, RelatedBookModel.shared_readers,
+            BookModel.id, BookModel.title, BookModel.author, BookModel.genre
+        ).join(
+            BookModel, BookModel.id == RelatedBookModel.related_book_id
+        ).filter(*criteria).order_by(RelatedBookModel.book_id, RelatedBookModel.rank)
+        related = {}
+        for book_id, shared_readers, related_id, title, author, genre in rows:
+            related.setdefault(book_id, []).append({
+                'book_id': related_id,
+                'title': title,
+                'author': author,
+                'genre': genre.value,
+                'shared_readers': shared_readers
+            })
+        return related
+
+
+@traced
+class ReaderSummaryRepository:
+    """Per-reader account totals, one row per reader"""
+    
+    def get(self, reader_id: int) -> Optional[dict]:
+        summary_model = db.session.get(ReaderSummaryModel, reader_id)
+        return summary_model.to_dict() if summary_model else None
+    
+    def exists(self, reader_id: int) -> bool:
+        return db.session.query(ReaderSummaryModel.reader_id).filter(
+            ReaderSummaryModel.reader_id == reader_id
+        ).first() is not None
+    
+    def create(self, reader_id: int, **values) -> None:
+        """Store a reader's first summary; a concurrent first write wins and this one is dropped"""
+        _insert_if_missing(ReaderSummaryModel, {'reader_id': reader_id}, values)
+        _commit()
+    
+    def record(self, reader_id: int, increments: dict, **values) -> None:
+        """Add increments to a reader's counters and overwrite the columns in values"""
+        _upsert_increment(ReaderSummaryModel, {'reader_id': reader_id}, increments, assign=values)
+        _commit()
+    
+    def set_overdue(self, overdue: Dict[int, Tuple[int, float]], as_of: date) -> int:
+        """Set overdue loans and outstanding fines of the readers in overdue (reader id -> (loans, fines))
+        
+        Every other reader is set to none. Returns the number of summaries written.
+        """
+        changed = ReaderSummaryModel.query.filter(
+            ReaderSummaryModel.reader_id.notin_(list(overdue))
+        ).update({'overdue_loans': 0, 'outstanding_fines': 0.0, 'fines_as_of': as_of}, synchronize_session=False)
+        for reader_id, (loans, fines) in overdue.items():
+            changed += ReaderSummaryModel.query.filter(ReaderSummaryModel.reader_id == reader_id).update(
+                {'overdue_loans': loans, 'outstanding_fines': fines, 'fines_as_of': as_of},
+                synchronize_session=False
+            )
+        _commit()
+        return changed
+
+
+@traced
+class ChangeLogRepository:
+    """Read side of the change log written by the entity repositories"""
+    
+    def get_since(self, since: int, limit: int) -> List[dict]:
+        entries = ChangeLogModel.query.filter(ChangeLogModel.seq > since).order_by(ChangeLogModel.seq).limit(limit).all()
+        return [{
+            'seq': entry.seq,
+            'entity': entry.entity,
+            'entity_id': entry.entity_id,
+            'operation': entry.operation
+        } for entry in entries]
+    
+    def get_last_seq(self) -> int:
+        return db.session.query(func.coalesce(func.max(ChangeLogModel.seq), 0)).scalar()
+    
+    def get_pruned_through(self) -> int:
+        """Highest seq that may have been pruned; clients behind it have missed changes"""
+        pruned_through = db.session.query(ChangeLogPruneModel.pruned_through).filter(ChangeLogPruneModel.id == 1).scalar()
+        # Entries pruned before the mark was kept leave a gap below the oldest remaining one
+        first_seq = db.session.query(func.min(ChangeLogModel.seq)).scalar()
+        return max(pruned_through or 0, first_seq - 1 if first_seq is not None else 0)
+    
+    def wait_for_change(self, timeout: float) -> None:
+        """Release the connection and block until a local commit logs a change or timeout passes"""
+        db.session.close()
+        with change_signal:
+            change_signal.wait(timeout)
+    
+    def prune(self, before) -> int:
+        """Delete entries older than the given datetime; returns the number deleted
+        
+        Deletes every entry up to the newest one older than before, and keeps
+        that seq as the high-water mark get_pruned_through reports.
+        """
+        through = db.session.query(func.max(ChangeLogModel.seq)).filter(ChangeLogModel.changed_at < before).scalar()
+        if through is None:
+            return 0
+        deleted = ChangeLogModel.query.filter(ChangeLogModel.seq <= through).delete()
+        insert = _dialect_insert()
+        table = ChangeLogPruneModel.__table__
+        statement = insert(table).values(id=1, pruned_through=through)
+        statement = statement.on_conflict_do_update(index_elements=['id'], set_={
+            'pruned_through': case(
+                (table.c.pruned_through > statement.excluded.pruned_through, table.c.pruned_through),
+                else_=statement.excluded.pruned_through
+            )
+        })
+        db.session.execute(statement)
+        _commit()
+        return deleted
@@ -0,0 +1,53 @@
+from contextlib import contextmanager
+
+from database.db import db
+from repository.repository import _commit_now, _end_memory_transactions
+
+
+class UnitOfWork:
+    """Groups repository writes into one transaction
+    
+    Inside the block repository add/update/delete only flush; the outermost
+    block commits once on success and rolls back if an exception escapes.
+    Nested blocks join the enclosing transaction.
+    """
+    
+    def __enter__(self):
+        db.session.info['uow_depth'] = db.session.info.get('uow_depth', 0) + 1
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        depth = db.session.info['uow_depth'] - 1
+        db.session.info['uow_depth'] = depth
+        if depth:
+            return False
+        
+        if exc_type is None:
+            try:
+                _commit_now()
+                return False
+            except Exception:
+                self._rollback()
+                raise
+        self._rollback()
+        return False
+    
+    @staticmethod
+    @contextmanager
+    def savepoint():
+        """Nested transaction; an exception inside it undoes only its own writes"""
+        marks = {store: transaction.mark() for store, transaction in db.session.info.get('memory_transactions', {}).items()}
+        try:
+            with db.session.begin_nested():
+                yield
+        except Exception:
+            for store, transaction in db.session.info.get('memory_transactions', {}).items():
+                transaction.restore(marks.get(store))
+            raise
+    
+    @staticmethod
+    def _rollback() -> None:
+        db.session.rollback()
+        _end_memory_transactions(commit=False)
+        db.session.info.pop('changes_logged', None)
+        db.session.info.pop('invalidations', None)
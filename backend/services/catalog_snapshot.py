@@ -0,0 +1,127 @@
+import threading
+from types import MappingProxyType
+from typing import Callable, Iterable, List, Optional
+
+from models.book import Book, Genre
+
+
+class CatalogSnapshot:
+    """Immutable view of the available books with their JSON pre-rendered
+
+    Each entry holds a book together with its fragment as rendered by
+    GET /api/books and as rendered by the available-books report, so serving a
+    browse request is a string join.
+    """
+
+    def __init__(self, entries: dict, render_book: Callable[[Book], str],
+                 render_entry: Callable[[Book], str]):
+        self._render_book = render_book
+        self._render_entry = render_entry
+        self._entries = MappingProxyType(dict(sorted(entries.items())))
+        self.books = MappingProxyType({id: entry[0] for id, entry in self._entries.items()})
+        self.ids_by_genre = MappingProxyType({
+            genre: tuple(id for id, book in self.books.items() if book.genre == genre) for genre in Genre
+        })
+        self.books_json = '[' + ','.join(entry[1] for entry in self._entries.values()) + ']'
+        self.report_json = (
+            '{"books":[' + ','.join(entry[2] for entry in self._entries.values()) + '],'
+            f'"total_available":{len(self._entries)}}}'
+        )
+
+    @classmethod
+    def build(cls, books: Iterable[Book], render_book: Callable[[Book], str],
+              render_entry: Callable[[Book], str]) -> 'CatalogSnapshot':
+        entries = {b.id: (b, render_book(b), render_entry(b)) for b in books if b.is_available()}
+        return cls(entries, render_book, render_entry)
+
+    def books_json_for_genre(self, genre: Genre) -> str:
+        return '[' + ','.join(self._entries[id][1] for id in self.ids_by_genre[genre]) + ']'
+
+    def with_books(self, changed: Iterable[Book], removed_ids: Iterable[int] = ()) -> 'CatalogSnapshot':
+        """New snapshot with the given books re-rendered and removed_ids dropped"""
+        entries = dict(self._entries)
+        for book_id in removed_ids:
+            entries.pop(book_id, None)
+        for book in changed:
+            if book.is_available():
+                entries[book.id] = (book, self._render_book(book), self._render_entry(book))
+            else:
+                entries.pop(book.id, None)
+        return CatalogSnapshot(entries, self._render_book, self._render_entry)
+
+
+class CatalogSnapshotHolder:
+    """Keeps the current CatalogSnapshot fresh from a background thread
+
+    Readers take `current()` without locking; a new snapshot replaces the old
+    one with a single reference assignment. invalidate(book_ids) re-reads only
+    those books and patches them in, invalidate() with no ids schedules a full
+    rebuild, and a full rebuild also runs every `refresh_interval` seconds.
+    """
+
+    def __init__(self, app, book_repo, render_book: Callable[[Book], str],
+                 render_entry: Callable[[Book], str], refresh_interval: float = 60.0):
+        self._app = app
+        self._book_repo = book_repo
+        self._render_book = render_book
+        self._render_entry = render_entry
+        self._refresh_interval = refresh_interval
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._changed_ids = set()
+        self._rebuild_requested = False
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='catalog-snapshot', daemon=True)
+        self._thread.start()
+
+    def current(self) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self._rebuild()
+        return snapshot
+
+    def invalidate(self, book_ids: Optional[List[int]] = None) -> None:
+        with self._lock:
+            if book_ids is None:
+                self._rebuild_requested = True
+            else:
+                self._changed_ids.update(book_ids)
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            woken = self._wakeup.wait(self._refresh_interval)
+            self._wakeup.clear()
+            try:
+                with self._app.app_context():
+                    if not woken or self._rebuild_requested:
+                        self._rebuild()
+                    else:
+                        self._patch()
+            except Exception:
+                self._app.logger.exception("Catalog snapshot refresh failed")
+
+    def _rebuild(self) -> CatalogSnapshot:
+        with self._lock:
+            self._rebuild_requested = False
+            self._changed_ids.clear()
+        snapshot = CatalogSnapshot.build(self._book_repo.get_available_books(), self._render_book, self._render_entry)
+        with self._lock:
+            # Books changed while the query ran are patched on the next pass
+            self._snapshot = snapshot
+        if self._changed_ids:
+            self._wakeup.set()
+        return snapshot
+
+    def _patch(self) -> None:
+        with self._lock:
+            book_ids, self._changed_ids = self._changed_ids, set()
+        if not book_ids or self._snapshot is None:
+            return
+        books = self._book_repo.get_by_ids(book_ids)
+        found = {b.id for b in books}
+        with self._lock:
+            self._snapshot = self._snapshot.with_books(books, book_ids - found)
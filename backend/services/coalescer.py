@@ -0,0 +1,86 @@
+import threading
+import time
+from typing import Callable, List
+
+
+class PendingCall:
+    """One caller's arguments and outcome inside a coalesced batch"""
+
+    def __init__(self, args: tuple):
+        self.args = args
+        self.result = None
+        self.error = None
+        self.lead = False
+        self.done = threading.Event()
+
+
+class WriteCoalescer:
+    """Gathers concurrent calls into batches run by one of the callers
+
+    The first caller to arrive becomes the leader: it waits up to `window`
+    seconds (or until `max_batch` calls are queued), then passes the batch to
+    execute_batch, which sets result or error on every PendingCall. The other
+    callers sleep until their own outcome is ready. Calls left over when a
+    batch is full are handed to a new leader.
+    """
+
+    def __init__(self, execute_batch: Callable[[List[PendingCall]], None], window: float, max_batch: int):
+        self._execute_batch = execute_batch
+        self._window = window
+        self._max_batch = max(1, max_batch)
+        self._condition = threading.Condition()
+        self._pending: List[PendingCall] = []
+        self._has_leader = False
+
+    def submit(self, *args):
+        call = PendingCall(args)
+        with self._condition:
+            self._pending.append(call)
+            if self._has_leader:
+                if len(self._pending) >= self._max_batch:
+                    self._condition.notify_all()
+            else:
+                self._has_leader = True
+                call.lead = True
+
+        while True:
+            if call.lead:
+                call.lead = False
+                self._lead()
+            call.done.wait()
+            if not call.lead:
+                break
+            call.done.clear()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _lead(self) -> None:
+        deadline = time.monotonic() + self._window
+        with self._condition:
+            while len(self._pending) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending[:self._max_batch]
+            del self._pending[:self._max_batch]
+            if self._pending:
+                # Wake the oldest leftover call and make it lead the next batch
+                successor = self._pending[0]
+                successor.lead = True
+                successor.done.set()
+            else:
+                self._has_leader = False
+
+        try:
+            self._execute_batch(batch)
+        except Exception as e:
+            for call in batch:
+                if call.error is None:
+                    call.result = None
+                    call.error = e
+        finally:
+            for call in batch:
+                call.done.set()
@@ -0,0 +1,112 @@
+import csv
+import io
+import zlib
+from enum import Enum
+from typing import Iterable, Iterator, List, Tuple
+
+# Column kinds used to build the Parquet schema
+INT, FLOAT, STR, DATE = 'int', 'float', 'str', 'date'
+
+RENTAL_EXPORT_COLUMNS: List[Tuple[str, str]] = [
+    ('id', INT), ('book_id', INT), ('book_title', STR), ('reader_id', INT), ('reader_name', STR),
+    ('issue_date', DATE), ('expected_return_date', DATE), ('actual_return_date', DATE), ('status', STR),
+    ('deposit_paid', FLOAT), ('rental_cost', FLOAT), ('fine_amount', FLOAT), ('damage_fine', FLOAT),
+    ('branch_id', INT)
+]
+
+LEDGER_EXPORT_COLUMNS: List[Tuple[str, str]] = [
+    ('id', INT), ('date', DATE), ('type', STR), ('description', STR),
+    ('amount', FLOAT), ('transaction_type', STR)
+]
+
+CHUNK_SIZE = 64 * 1024
+
+
+def csv_chunks(columns: List[Tuple[str, str]], rows: Iterable[dict], compress: bool = False) -> Iterator[bytes]:
+    """Encode rows as CSV in chunks of about CHUNK_SIZE bytes, optionally gzip-compressed"""
+    names = [name for name, _ in columns]
+    # csv already writes None as an empty field and dates in ISO format; only enums need converting
+    text_columns = [index for index, (_, kind) in enumerate(columns) if kind == STR]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def take() -> bytes:
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    writer.writerow(names)
+    for row in rows:
+        values = [row[name] for name in names]
+        for index in text_columns:
+            if isinstance(values[index], Enum):
+                values[index] = values[index].value
+        writer.writerow(values)
+        if buffer.tell() >= CHUNK_SIZE:
+            chunk = take()
+            if chunk:
+                yield chunk
+    chunk = take()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands out what has been written so far"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def parquet_chunks(columns: List[Tuple[str, str]], rows: Iterable[dict], compression: str = 'snappy',
+                   row_group_size: int = 10000) -> Iterator[bytes]:
+    """Encode rows as Parquet, one row group per row_group_size rows (requires pyarrow)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {INT: pa.int64(), FLOAT: pa.float64(), STR: pa.string(), DATE: pa.date32()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    names = [name for name, _ in columns]
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression=compression)
+
+    def write_group(group: List[dict]) -> None:
+        arrays = {
+            name: [row[name].value if isinstance(row[name], Enum) else row[name] for row in group]
+            for name in names
+        }
+        writer.write_table(pa.Table.from_pydict(arrays, schema=schema))
+
+    group = []
+    for row in rows:
+        group.append(row)
+        if len(group) >= row_group_size:
+            write_group(group)
+            group = []
+            yield sink.drain()
+    if group:
+        write_group(group)
+    writer.close()
+    yield sink.drain()
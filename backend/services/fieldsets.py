@@ -0,0 +1,59 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# A field's renderer and the columns it reads
+Field = Tuple[Callable, Tuple[str, ...]]
+
+
+def attribute(name: str, convert: Optional[Callable] = None) -> Field:
+    """Field copied from the column of the same name, optionally converted (None stays None)"""
+    if convert is None:
+        return (lambda item: getattr(item, name), (name,))
+    return (lambda item: None if getattr(item, name) is None else convert(getattr(item, name)), (name,))
+
+
+def computed(function: Callable, *columns: str) -> Field:
+    """Field computed from several columns, e.g. an unbound domain model method"""
+    return (function, columns)
+
+
+class FieldSet:
+    """Fields of a list response, for `fields=` sparse fieldsets
+
+    Renderers take anything with the columns as attributes: domain objects, or
+    rows selecting only the columns the requested fields read.
+    """
+
+    def __init__(self, fields: Dict[str, Field]):
+        self._fields = fields
+        self.names = tuple(fields)
+
+    @classmethod
+    def keys(cls, names: Iterable[str]) -> 'FieldSet':
+        """Fields of rows that are already dicts, such as report rows"""
+        return cls({name: ((lambda row, name=name: row[name]), ()) for name in names})
+
+    def subset(self, names: Iterable[str]) -> 'FieldSet':
+        return FieldSet({name: self._fields[name] for name in names})
+
+    def parse(self, value: Optional[str]) -> Optional[List[str]]:
+        """Requested field names in order, or None when all fields are wanted"""
+        if value is None:
+            return None
+        names = list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+        unknown = [name for name in names if name not in self._fields]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}; available: {', '.join(self.names)}")
+        if not names:
+            raise ValueError(f"fields must name at least one of: {', '.join(self.names)}")
+        return names
+
+    def columns(self, names: Iterable[str]) -> List[str]:
+        """Columns read by the named fields, without duplicates"""
+        return list(dict.fromkeys(column for name in names for column in self._fields[name][1]))
+
+    def render(self, item, names: Iterable[str]) -> dict:
+        return {name: self._fields[name][0](item) for name in names}
+
+    def render_all(self, items: Iterable, names: List[str]) -> List[dict]:
+        renderers = [(name, self._fields[name][0]) for name in names]
+        return [{name: render(item) for name, render in renderers} for item in items]
@@ -1,15 +1,33 @@
-from datetime import date, timedelta
-from typing import List, Optional
-from models.book import Book
-from models.reader import Reader
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from models.book import Book, Genre
+from models.reader import Reader, ReaderCategory
 from models.rental import Rental, RentalStatus
-from repository.repository import BookRepository, ReaderRepository, RentalRepository
-from patterns.strategy import PricingContext, DailyPricingStrategy
+from models.branch import Branch, BranchStock
+from models.hold import Hold, HoldStatus
+from repository.repository import (
+    BookRepository, ReaderRepository, RentalRepository, BranchRepository, HoldRepository, PopularityRepository,
+    RelatedBookRepository, ReaderSummaryRepository, RollupRepository, ChangeLogRepository
+)
+from repository.unit_of_work import UnitOfWork
+from repository.memory import MemoryStore, InMemoryBookRepository, InMemoryReaderRepository, InMemoryRentalRepository
+from patterns.strategy import PricingContext, DailyPricingStrategy, PRICING_STRATEGIES
 from patterns.discount import DiscountContext, CategoryDiscountStrategy
 from patterns.fine import FineContext, StandardFineCalculator
-from patterns.observer import Subject, OverdueNotifier
+from patterns.observer import Subject, OverdueNotifier, HoldReadyNotifier
+from monitoring.tracing import traced
+from services.coalescer import WriteCoalescer
+from services.loader import Loaders
+from services.single_flight import SingleFlight
+from services.related import co_rented_top_k
+from services.reader_search import ReaderSearchIndex
+from database.db import trigram_search_enabled
 
 
+@traced
 class LibraryService:
     """Main service class using Singleton pattern"""
     
@@ -25,14 +43,57 @@ class LibraryService:
         if self._initialized:
             return
         
-        self.book_repo = BookRepository()
-        self.reader_repo = ReaderRepository()
-        self.rental_repo = RentalRepository()
+        # Books, readers and rentals live in PostgreSQL (sql) or in process memory
+        # (memory, optionally saved to LIBRARY_SNAPSHOT_PATH); everything else
+        # stays in the database
+        self.storage = os.getenv('LIBRARY_STORAGE', 'sql')
+        self.memory_store = None
+        if self.storage == 'memory':
+            self.memory_store = MemoryStore(os.getenv('LIBRARY_SNAPSHOT_PATH') or None)
+            self.book_repo = InMemoryBookRepository(self.memory_store)
+            self.reader_repo = InMemoryReaderRepository(self.memory_store)
+            self.rental_repo = InMemoryRentalRepository(self.memory_store)
+        elif self.storage == 'sql':
+            self.book_repo = BookRepository()
+            self.reader_repo = ReaderRepository()
+            self.rental_repo = RentalRepository()
+        else:
+            raise ValueError(f"LIBRARY_STORAGE must be sql or memory, not {self.storage}")
+        self.branch_repo = BranchRepository()
+        self.hold_repo = HoldRepository()
+        self.rollup_repo = RollupRepository()
+        self.popularity_repo = PopularityRepository()
+        self.related_repo = RelatedBookRepository()
+        self.summary_repo = ReaderSummaryRepository()
+        self.change_log_repo = ChangeLogRepository()
         self.pricing_context = PricingContext(DailyPricingStrategy())
         self.discount_context = DiscountContext(CategoryDiscountStrategy())
         self.fine_context = FineContext(StandardFineCalculator())
         self.observer_subject = Subject()
         self.observer_subject.attach(OverdueNotifier())
+        self.observer_subject.attach(HoldReadyNotifier())
+        
+        # Days a reader has to collect a copy set aside for their hold
+        self.hold_pickup_days = int(os.getenv('HOLD_PICKUP_DAYS', '3'))
+        
+        # Optional group commit for bursts of concurrent checkouts
+        coalesce_window_ms = float(os.getenv('CHECKOUT_COALESCE_WINDOW_MS', '0'))
+        self.checkout_coalescer = None
+        if coalesce_window_ms > 0:
+            self.checkout_coalescer = WriteCoalescer(
+                self._rent_book_batch,
+                coalesce_window_ms / 1000,
+                int(os.getenv('CHECKOUT_COALESCE_MAX_BATCH', '32'))
+            )
+        
+        # Concurrent identical report requests share one computation; results are
+        # memoized for REPORT_CACHE_TTL seconds and dropped on any committed write
+        self.report_flight = SingleFlight(float(os.getenv('REPORT_CACHE_TTL', '2')))
+        
+        # Reader search: pg_trgm in PostgreSQL when available, an in-process index otherwise
+        self.reader_search_similarity = float(os.getenv('READER_SEARCH_SIMILARITY', '0.3'))
+        self.reader_search_timeout_ms = int(os.getenv('READER_SEARCH_TIMEOUT_MS', '200'))
+        self.reader_search = ReaderSearchIndex(self.reader_repo, self.reader_search_similarity)
         
         self._initialized = True
     
@@ -40,6 +101,10 @@ class LibraryService:
         """Add a book to the library"""
         return self.book_repo.add(book)
     
+    def delete_book(self, book_id: int) -> None:
+        """Remove a book from the library"""
+        self.book_repo.delete(book_id)
+    
     def get_all_books(self) -> List[Book]:
         """Get all books"""
         return self.book_repo.get_all()
@@ -48,6 +113,20 @@ class LibraryService:
         """Get available books"""
         return self.book_repo.get_available_books()
     
+    def get_books_by_ids(self, ids: List[int]) -> List[Book]:
+        """Get several books with one query, in the order of ids (missing ids are skipped)"""
+        books = self.loaders().books.get_many(ids)
+        return [books[id] for id in dict.fromkeys(ids) if books[id]]
+    
+    def get_book_columns(self, columns: List[str], ids: Optional[List[int]] = None,
+                         available_only: bool = False) -> list:
+        """Books as rows of only the named columns; with ids, in the order of ids (missing ids are skipped)"""
+        if ids is None:
+            return self.book_repo.get_columns(columns, available_only=available_only)
+        rows = self.book_repo.get_columns(list(dict.fromkeys(['id', *columns])), ids, available_only)
+        by_id = {row.id: row for row in rows}
+        return [by_id[id] for id in dict.fromkeys(ids) if id in by_id]
+    
     def add_reader(self, reader: Reader) -> int:
         """Register a new reader"""
         return self.reader_repo.add(reader)
@@ -56,17 +135,89 @@ class LibraryService:
         """Get all readers"""
         return self.reader_repo.get_all()
     
-    def rent_book(self, book_id: int, reader_id: int, rental_days: int = 14) -> Optional[Rental]:
-        """Rent a book to a reader"""
-        book = self.book_repo.get_by_id(book_id)
+    def get_readers_by_ids(self, ids: List[int]) -> List[Reader]:
+        """Get several readers with one query, in the order of ids (missing ids are skipped)"""
+        readers = self.loaders().readers.get_many(ids)
+        return [readers[id] for id in dict.fromkeys(ids) if readers[id]]
+    
+    def get_reader_columns(self, columns: List[str], ids: Optional[List[int]] = None) -> list:
+        """Readers as rows of only the named columns; with ids, in the order of ids (missing ids are skipped)"""
+        if ids is None:
+            return self.reader_repo.get_columns(columns)
+        by_id = {row.id: row for row in self.reader_repo.get_columns(list(dict.fromkeys(['id', *columns])), ids)}
+        return [by_id[id] for id in dict.fromkeys(ids) if id in by_id]
+    
+    def loaders(self) -> Loaders:
+        """Request-scoped batched loaders for books and readers"""
+        return Loaders.for_current_request(self.book_repo, self.reader_repo)
+    
+    def rent_book(self, book_id: int, reader_id: int, rental_days: int = 14,
+                  branch_id: Optional[int] = None) -> Optional[Rental]:
+        """Rent a book to a reader, from a specific branch if branch_id is given"""
+        if self.checkout_coalescer:
+            rental = self.checkout_coalescer.submit(book_id, reader_id, rental_days, branch_id)
+        else:
+            with UnitOfWork():
+                rental = self._rent_book(book_id, reader_id, rental_days, branch_id)
+        return rental
+    
+    def _rent_book_batch(self, calls) -> None:
+        """Run coalesced checkouts in one transaction, each isolated by a savepoint
+        
+        Checkouts write rows that many books share (rollups, popularity,
+        reader summaries, and on PostgreSQL the change log's advisory lock).
+        So that a batch never waits for a book while holding one of those, all
+        of its books and their branch stock are locked first, in id order, and
+        missing reader summaries are created in reader order; only then do the
+        checkouts run. They run by (book_id, branch_id), ties in arrival order,
+        and outcomes are set on each call.
+        """
+        ordered = sorted(calls, key=lambda call: (call.args[0], call.args[3] is not None, call.args[3] or 0))
+        book_ids = sorted({call.args[0] for call in calls})
+        reader_ids = sorted({call.args[1] for call in calls})
+        with UnitOfWork() as unit_of_work:
+            for book_id in book_ids:
+                self.book_repo.get_by_id_for_update(book_id)
+            self.branch_repo.lock_stock(book_ids)
+            for reader in sorted(self.reader_repo.get_by_ids(reader_ids), key=lambda reader: reader.id):
+                self._ensure_reader_summary(reader.id)
+            for call in ordered:
+                try:
+                    with unit_of_work.savepoint():
+                        call.result = self._rent_book(*call.args)
+                except Exception as e:
+                    call.error = e
+    
+    def _rent_book(self, book_id: int, reader_id: int, rental_days: int,
+                   branch_id: Optional[int] = None) -> Optional[Rental]:
+        # Row lock serializes concurrent checkouts of the same book until commit
+        book = self.book_repo.get_by_id_for_update(book_id)
         reader = self.reader_repo.get_by_id(reader_id)
         
         if not book or not reader:
             return None
         
-        if not book.is_available():
+        # A copy set aside for this reader's hold is lent without touching the shelf
+        hold = self.hold_repo.get_open_for_reader(book_id, reader_id)
+        if hold and hold.status != HoldStatus.READY:
+            hold = None
+        
+        if not hold and not book.is_available():
             return None
         
+        # The copy leaves from the requested branch, or from any branch holding
+        # one once the copies not assigned to a branch are all lent out
+        if hold:
+            stock = None
+        elif branch_id is not None:
+            stock = self.branch_repo.get_stock_for_update(branch_id, book_id)
+            if not stock or stock.available_copies <= 0:
+                return None
+        elif book.available_copies <= self.branch_repo.get_shelved_copies(book_id):
+            stock = self.branch_repo.get_first_stock_with_copy(book_id)
+        else:
+            stock = None
+        
         # Calculate rental cost
         expected_return = date.today() + timedelta(days=rental_days)
         rental_cost = self.pricing_context.calculate_cost(
@@ -86,28 +237,52 @@ class LibraryService:
             actual_return_date=None,
             status=RentalStatus.ACTIVE,
             deposit_paid=book.deposit_cost,
-            rental_cost=rental_cost
+            rental_cost=rental_cost,
+            branch_id=hold.branch_id if hold else stock.branch_id if stock else None
         )
         
         # Rent the book
-        if book.rent_copy():
-            rental_id = self.rental_repo.add(rental)
-            # Update book in database to reflect the change in available copies
-            self.book_repo.update(book)
-            return self.rental_repo.get_by_id(rental_id)
+        if hold:
+            hold.status = HoldStatus.FULFILLED
+            self.hold_repo.update(hold)
+        elif not book.rent_copy():
+            return None
         
-        return None
+        self._ensure_reader_summary(reader_id)
+        rental_id = self.rental_repo.add(rental)
+        # Update book in database to reflect the change in available copies
+        self.book_repo.update(book)
+        if stock:
+            self.branch_repo.adjust_stock(stock.branch_id, book_id, available=-1)
+        self.rollup_repo.record_checkout(rental, book.genre, reader.category)
+        self.popularity_repo.record_checkout(rental, book.genre)
+        self._update_reader_summary(reader_id, {'open_loans': 1})
+        rental.id = rental_id
+        return rental
     
-    def return_book(self, rental_id: int, damage_level: Optional[str] = None) -> Optional[Rental]:
-        """Return a book"""
+    def return_book(self, rental_id: int, damage_level: Optional[str] = None,
+                    branch_id: Optional[int] = None) -> Optional[Rental]:
+        """Return a book, to branch_id if given, otherwise to the branch it was lent from"""
+        with UnitOfWork():
+            rental = self._return_book(rental_id, damage_level, branch_id)
+        return rental
+    
+    def _return_book(self, rental_id: int, damage_level: Optional[str],
+                     branch_id: Optional[int] = None) -> Optional[Rental]:
         rental = self.rental_repo.get_by_id(rental_id)
-        if not rental or rental.status == RentalStatus.RETURNED:
+        if not rental or rental.status in (RentalStatus.RETURNED, RentalStatus.DAMAGED):
             return None
         
-        book = self.book_repo.get_by_id(rental.book_id)
+        # Lock the book like checkouts do, so stock counts change in the same order
+        book = self.book_repo.get_by_id_for_update(rental.book_id)
         if not book:
             return None
         
+        # Another return of this rental may have committed while we waited for the book
+        rental = self.rental_repo.get_by_id_for_update(rental_id)
+        if not rental or rental.status in (RentalStatus.RETURNED, RentalStatus.DAMAGED):
+            return None
+        
         # Calculate fines
         if rental.is_overdue():
             days_overdue = (date.today() - rental.expected_return_date).days
@@ -123,13 +298,315 @@ class LibraryService:
         
         rental.actual_return_date = date.today()
         rental.update_status()
-        book.return_copy()
+        
+        self._ensure_reader_summary(rental.reader_id)
+        
+        # The copy goes to the head of the holds queue, if anyone is waiting
+        return_branch_id = branch_id or rental.branch_id
+        hold = self._set_aside_for_next_hold(rental.book_id, return_branch_id)
+        if not hold:
+            book.return_copy()
         
         self.rental_repo.update(rental)
         self.book_repo.update(book)
+        self._shelve_returned_copy(rental, return_branch_id, on_shelf=hold is None)
+        if hold:
+            self.observer_subject.notify(rental, "hold_ready")
+        
+        reader = self.reader_repo.get_by_id(rental.reader_id)
+        if reader:
+            self.rollup_repo.record_return(rental, book.genre, reader.category)
+        self._update_reader_summary(rental.reader_id, {
+            'open_loans': -1,
+            'lifetime_spend': rental.rental_cost + rental.fine_amount + rental.damage_fine
+        })
         
         return rental
     
+    def _overdue_state(self, open_rentals: List[Rental], today: date) -> Tuple[int, float]:
+        """Overdue loans among open_rentals and the fines they have accrued by today"""
+        overdue = [r for r in open_rentals if r.is_overdue()]
+        fines = sum(
+            self.fine_context.get_overdue_fine((today - r.expected_return_date).days, r.rental_cost)
+            for r in overdue
+        )
+        return len(overdue), round(fines, 2)
+    
+    def _ensure_reader_summary(self, reader_id: int) -> None:
+        """Backfill a reader's summary from their rental history the first time it is needed
+        
+        Runs before the checkout or return is written, which then applies on top.
+        """
+        if self.summary_repo.exists(reader_id):
+            return
+        today = date.today()
+        rentals = self.rental_repo.get_reader_rentals(reader_id)
+        open_rentals = [r for r in rentals if r.status in (RentalStatus.ACTIVE, RentalStatus.OVERDUE)]
+        closed_rentals = [r for r in rentals if r.status not in (RentalStatus.ACTIVE, RentalStatus.OVERDUE)]
+        overdue_loans, outstanding_fines = self._overdue_state(open_rentals, today)
+        activity = [r.issue_date for r in rentals] + [r.actual_return_date for r in closed_rentals if r.actual_return_date]
+        self.summary_repo.create(
+            reader_id,
+            open_loans=len(open_rentals),
+            overdue_loans=overdue_loans,
+            lifetime_spend=sum(r.rental_cost + r.fine_amount + r.damage_fine for r in closed_rentals),
+            outstanding_fines=outstanding_fines,
+            fines_as_of=today,
+            last_activity=max(activity, default=None)
+        )
+    
+    def _update_reader_summary(self, reader_id: int, increments: dict) -> None:
+        """Apply a checkout or return, recomputing overdue state from the reader's open loans"""
+        today = date.today()
+        overdue_loans, outstanding_fines = self._overdue_state(self.rental_repo.get_open_reader_rentals(reader_id), today)
+        self.summary_repo.record(
+            reader_id,
+            dict({'lifetime_spend': 0.0}, **increments),
+            overdue_loans=overdue_loans,
+            outstanding_fines=outstanding_fines,
+            fines_as_of=today,
+            last_activity=today
+        )
+    
+    def get_reader_summary(self, reader_id: int) -> Optional[dict]:
+        """Open loans, overdue loans, lifetime spend, outstanding fines and last activity of a reader"""
+        summary = self.summary_repo.get(reader_id)
+        if summary is None:
+            if not self.reader_repo.get_by_id(reader_id):
+                return None
+            with UnitOfWork():
+                self._ensure_reader_summary(reader_id)
+            summary = self.summary_repo.get(reader_id)
+        return summary
+    
+    def sweep_overdue(self) -> int:
+        """Recompute every reader summary's overdue loans and accrued fines as of today"""
+        today = date.today()
+        overdue_by_reader = {}
+        for rental in self.rental_repo.get_overdue_rentals():
+            overdue_by_reader.setdefault(rental.reader_id, []).append(rental)
+        overdue = {
+            reader_id: self._overdue_state(rentals, today) for reader_id, rentals in overdue_by_reader.items()
+        }
+        return self.summary_repo.set_overdue(overdue, today)
+    
+    def _shelve_returned_copy(self, rental: Rental, branch_id: Optional[int], on_shelf: bool = True) -> None:
+        """Put the returned copy back at a branch, on the shelf unless it is set aside for a hold
+        
+        Returning at another branch than the one it was lent from moves the copy.
+        """
+        if branch_id is None:
+            return
+        available = 1 if on_shelf else 0
+        if branch_id == rental.branch_id:
+            if available:
+                self.branch_repo.adjust_stock(branch_id, rental.book_id, available=available)
+            return
+        if rental.branch_id is not None:
+            self.branch_repo.adjust_stock(rental.branch_id, rental.book_id, total=-1)
+        self.branch_repo.adjust_stock(branch_id, rental.book_id, total=1, available=available)
+    
+    def _set_aside_for_next_hold(self, book_id: int, branch_id: Optional[int]) -> Optional[Hold]:
+        """Mark the head of the book's queue READY for a copy coming back; callers lock the book"""
+        hold = self.hold_repo.get_next_waiting(book_id)
+        if hold:
+            hold.status = HoldStatus.READY
+            hold.branch_id = branch_id
+            hold.ready_until = date.today() + timedelta(days=self.hold_pickup_days)
+            self.hold_repo.update(hold)
+        return hold
+    
+    def _release_held_copy(self, book: Book, hold: Hold) -> None:
+        """Pass a set-aside copy that will not be collected to the next hold, or back to the shelf"""
+        if self._set_aside_for_next_hold(book.id, hold.branch_id):
+            return
+        book.return_copy()
+        self.book_repo.update(book)
+        if hold.branch_id is not None:
+            self.branch_repo.adjust_stock(hold.branch_id, book.id, available=1)
+    
+    def place_hold(self, book_id: int, reader_id: int) -> Optional[Hold]:
+        """Join the holds queue of a book with no copy on the shelf
+        
+        Returns None if the book or reader does not exist and raises ValueError
+        if a copy is available or the reader already holds the book.
+        """
+        with UnitOfWork():
+            book = self.book_repo.get_by_id_for_update(book_id)
+            reader = self.reader_repo.get_by_id(reader_id)
+            if not book or not reader:
+                return None
+            if book.is_available():
+                raise ValueError("A copy is on the shelf, rent it instead")
+            if self.hold_repo.get_open_for_reader(book_id, reader_id):
+                raise ValueError("Reader already has a hold on this book")
+            
+            hold = Hold(id=None, book_id=book_id, reader_id=reader_id, placed_at=datetime.utcnow())
+            hold.id = self.hold_repo.add(hold)
+        return hold
+    
+    def cancel_hold(self, hold_id: int) -> Optional[Hold]:
+        """Cancel a hold; a copy already set aside for it goes to the next reader or the shelf
+        
+        Returns None if the hold does not exist and raises ValueError if it is closed.
+        """
+        hold = self.hold_repo.get_by_id(hold_id)
+        if not hold:
+            return None
+        with UnitOfWork():
+            book = self.book_repo.get_by_id_for_update(hold.book_id)
+            # Re-read under the book lock, a return may have just made it READY
+            hold = self.hold_repo.get_by_id(hold_id)
+            if not hold.is_open():
+                raise ValueError(f"Hold is already {hold.status.value.lower()}")
+            
+            was_ready = hold.status == HoldStatus.READY
+            hold.status = HoldStatus.CANCELLED
+            self.hold_repo.update(hold)
+            if was_ready:
+                self._release_held_copy(book, hold)
+        return hold
+    
+    def expire_holds(self) -> int:
+        """Expire READY holds past their pickup deadline and pass their copies on"""
+        expired = 0
+        for hold in self.hold_repo.get_expired(date.today()):
+            with UnitOfWork():
+                book = self.book_repo.get_by_id_for_update(hold.book_id)
+                hold = self.hold_repo.get_by_id(hold.id)
+                if hold.status != HoldStatus.READY:
+                    continue
+                hold.status = HoldStatus.EXPIRED
+                self.hold_repo.update(hold)
+                self._release_held_copy(book, hold)
+                expired += 1
+        return expired
+    
+    def get_book_holds(self, book_id: int) -> List[dict]:
+        """Open holds on a book with each WAITING hold's queue position and estimated date"""
+        result = []
+        position = 0
+        for hold in self.hold_repo.get_queue(book_id):
+            entry = {'hold': hold, 'position': None, 'estimated_available_date': date.today()}
+            if hold.status == HoldStatus.WAITING:
+                position += 1
+                entry['position'] = position
+                entry['estimated_available_date'] = self._estimate_available_date(book_id, position - 1)
+            result.append(entry)
+        return result
+    
+    def search_readers(self, query: str, limit: int = 10) -> List[Reader]:
+        """Best matching readers by telephone prefix, or by name prefix, substring and similarity
+        
+        Raises TimeoutError when the database search exceeds its time budget.
+        """
+        if self.reader_search_in_database():
+            return self.reader_repo.search(query, limit, self.reader_search_similarity, self.reader_search_timeout_ms)
+        reader_ids = self.reader_search.search(query, limit)
+        readers = {reader.id: reader for reader in self.reader_repo.get_by_ids(reader_ids)}
+        return [readers[reader_id] for reader_id in reader_ids if reader_id in readers]
+    
+    def reader_search_in_database(self) -> bool:
+        """Whether readers are searched with pg_trgm rather than the in-process index"""
+        return self.storage == 'sql' and trigram_search_enabled()
+    
+    def get_reader_holds(self, reader_id: int) -> List[Hold]:
+        """Get all holds placed by a reader"""
+        return self.hold_repo.get_reader_holds(reader_id)
+    
+    def get_next_available(self, book_id: int) -> Optional[dict]:
+        """When a copy is expected to be free for a reader joining the queue now"""
+        book = self.book_repo.get_by_id(book_id)
+        if not book:
+            return None
+        waiting = self.hold_repo.count_waiting(book_id)
+        estimate = date.today() if book.is_available() else self._estimate_available_date(book_id, waiting)
+        return {
+            'book_id': book_id,
+            'available_now': book.is_available(),
+            'holds_waiting': waiting,
+            'estimated_available_date': estimate.isoformat() if estimate else None
+        }
+    
+    def _estimate_available_date(self, book_id: int, position: int) -> Optional[date]:
+        """Due date of the return that serves queue position (0 = head); None if too few copies are out"""
+        due = self.rental_repo.get_nth_expected_return(book_id, position)
+        return max(due, date.today()) if due else None
+    
+    def add_branch(self, branch: Branch) -> int:
+        """Add a library branch"""
+        return self.branch_repo.add(branch)
+    
+    def get_branches(self) -> List[Branch]:
+        """Get all branches"""
+        return self.branch_repo.get_all()
+    
+    def set_branch_stock(self, branch_id: int, book_id: int, total_copies: int) -> Optional[BranchStock]:
+        """Set how many copies of a book a branch holds
+        
+        Copies are moved between the branch and the book's copies not yet
+        assigned to any branch; only copies on the shelf can move. Returns
+        None if the book does not exist and raises ValueError if the copies
+        cannot be moved.
+        """
+        with UnitOfWork():
+            book = self.book_repo.get_by_id_for_update(book_id)
+            if not book:
+                return None
+            
+            stock = self.branch_repo.get_stock_for_update(branch_id, book_id) or BranchStock(branch_id, book_id, 0, 0)
+            delta = total_copies - stock.total_copies
+            unassigned = book.available_copies - self.branch_repo.get_shelved_copies(book_id)
+            if delta > unassigned:
+                raise ValueError(f"Only {unassigned} unassigned copies are on the shelf")
+            if -delta > stock.available_copies:
+                raise ValueError("Copies that are lent out cannot be removed from the branch")
+            
+            self.branch_repo.adjust_stock(branch_id, book_id, total=delta, available=delta)
+        return BranchStock(branch_id, book_id, total_copies, stock.available_copies + delta)
+    
+    def get_book_availability(self, book_id: int) -> Optional[dict]:
+        """Branches with a copy of the book on the shelf right now"""
+        book = self.book_repo.get_by_id(book_id)
+        if not book:
+            return None
+        branches = self.branch_repo.get_branches_with_copies(book_id)
+        return {
+            'book_id': book_id,
+            'available_copies': book.available_copies,
+            'unassigned_copies': book.available_copies - sum(available for _, available in branches),
+            'branches': [
+                {'branch_id': branch.id, 'name': branch.name, 'available_copies': available}
+                for branch, available in branches
+            ]
+        }
+    
+    def get_branch_books(self, branch_id: int, available_only: bool = False) -> List[tuple]:
+        """Books stocked at a branch with the branch's copy counts"""
+        return self.branch_repo.get_branch_books(branch_id, available_only)
+    
+    def get_branch_rentals(self, branch_id: int, open_only: bool = False) -> List[Rental]:
+        """Rentals lent from a branch"""
+        return self.rental_repo.get_branch_rentals(branch_id, open_only)
+    
+    def get_price_quotes(self, durations: Sequence[int], categories: Sequence[ReaderCategory],
+                         available_only: bool = False) -> dict:
+        """Rental price matrix for every book, reader category and rental duration"""
+        books = self.get_available_books() if available_only else self.get_all_books()
+        base_costs = np.array([b.base_rental_cost for b in books], dtype=float)
+        
+        # Shape (books, durations), then (books, categories, durations) after discounting
+        costs = self.pricing_context.calculate_costs(base_costs[:, None], np.asarray(durations)[None, :])
+        category_array = np.array(list(categories), dtype=object)[None, :, None]
+        prices = self.discount_context.apply_discounts(costs[:, None, :], category_array)
+        
+        return {
+            'book_ids': [b.id for b in books],
+            'categories': [c.value for c in categories],
+            'durations': list(durations),
+            'prices': np.round(prices, 2).tolist()
+        }
+    
     def get_active_rentals(self) -> List[Rental]:
         """Get all active rentals"""
         rentals = self.rental_repo.get_active_rentals()
@@ -139,6 +616,54 @@ class LibraryService:
                 self.observer_subject.notify(rental, "overdue")
         return rentals
     
+    def get_rental_columns(self, columns: List[str], status: str = 'all') -> list:
+        """All, active or overdue rentals as rows of only the named columns
+        
+        Like get_active_rentals, listing active rentals alerts the observers
+        about the overdue ones, so the columns they read are always selected.
+        """
+        if status != 'active':
+            return self.rental_repo.get_columns(columns, status)
+        rows = self.rental_repo.get_columns(list(dict.fromkeys([*columns, 'id', 'reader_id', 'status'])), status)
+        for row in rows:
+            if row.status == RentalStatus.OVERDUE:
+                self.observer_subject.notify(row, "overdue")
+        return rows
+    
+    def get_issued_books_report(self) -> dict:
+        """Issued books with reader names and overdue indication"""
+        return self.report_flight.do(('issued-books', date.today()), self._get_issued_books_report)
+    
+    def _get_issued_books_report(self) -> dict:
+        active_rentals = self.get_active_rentals()
+        overdue_rentals = self.get_overdue_rentals()
+        
+        loaders = self.loaders()
+        loaders.books.prime(r.book_id for r in active_rentals)
+        loaders.readers.prime(r.reader_id for r in active_rentals)
+        
+        result = []
+        for rental in active_rentals:
+            book = loaders.books.get(rental.book_id)
+            reader = loaders.readers.get(rental.reader_id)
+            
+            result.append({
+                'rental_id': rental.id,
+                'book_title': book.title if book else 'Unknown',
+                'book_author': book.author if book else 'Unknown',
+                'reader_name': reader.full_name if reader else 'Unknown',
+                'issue_date': rental.issue_date.isoformat(),
+                'expected_return_date': rental.expected_return_date.isoformat(),
+                'is_overdue': rental.is_overdue(),
+                'days_overdue': (date.today() - rental.expected_return_date).days if rental.is_overdue() else 0
+            })
+        
+        return {
+            'total_issued': len(active_rentals),
+            'total_overdue': len(overdue_rentals),
+            'rentals': result
+        }
+    
     def get_overdue_rentals(self) -> List[Rental]:
         """Get all overdue rentals"""
         return self.rental_repo.get_overdue_rentals()
@@ -149,6 +674,9 @@ class LibraryService:
     
     def get_financial_status(self) -> dict:
         """Get financial status report"""
+        return self.report_flight.do(('financial-status',), self._get_financial_status)
+    
+    def _get_financial_status(self) -> dict:
         rentals = self.rental_repo.get_all()
         
         total_deposits = sum(r.deposit_paid for r in rentals)
@@ -165,58 +693,218 @@ class LibraryService:
             "total_rentals": len(rentals)
         }
     
+    def get_projected_fines(self, as_of: Optional[date] = None) -> dict:
+        """Overdue fines that would be charged if all open rentals were returned on as_of"""
+        as_of = as_of or date.today()
+        count, total = self.rental_repo.get_projected_overdue_fines(self.fine_context, as_of)
+        return {
+            "as_of": as_of.isoformat(),
+            "overdue_rentals": count,
+            "projected_fines": total
+        }
+    
+    def get_revenue_projection(self, strategy_name: str) -> dict:
+        """Rental income of all rentals re-priced under another pricing strategy"""
+        strategy = PRICING_STRATEGIES[strategy_name]()
+        count, charged, projected = self.rental_repo.get_projected_rental_costs(
+            PricingContext(strategy), self.discount_context
+        )
+        return {
+            "strategy": strategy_name,
+            "total_rentals": count,
+            "current_rental_income": charged,
+            "projected_rental_income": projected,
+            "difference": projected - charged
+        }
+    
+    def get_timeseries(self, granularity: str, start: Optional[date] = None, end: Optional[date] = None,
+                       genre: Optional[Genre] = None, category: Optional[ReaderCategory] = None) -> List[dict]:
+        """Get rollup totals per bucket, genre and reader category"""
+        return self.rollup_repo.get_timeseries(granularity, start, end, genre, category)
+    
+    def _require_sql_storage(self, job: str) -> None:
+        """Jobs that read the rental tables with SQL have nothing to read under in-memory storage"""
+        if self.storage != 'sql':
+            raise RuntimeError(f'{job} needs LIBRARY_STORAGE=sql')
+    
+    def rebuild_rollups(self) -> int:
+        """Recompute all rollups from rental history"""
+        self._require_sql_storage('Rebuilding rollups')
+        return self.rollup_repo.rebuild()
+    
+    def rebuild_popularity(self) -> int:
+        """Recompute the popularity counters of the current week and month and of all time"""
+        self._require_sql_storage('Rebuilding popularity counters')
+        return self.popularity_repo.rebuild(date.today())
+    
+    def expire_popularity(self) -> int:
+        """Delete popularity counters of weeks and months that have ended"""
+        return self.popularity_repo.expire(date.today())
+    
+    def build_related_books(self, k: int = 10, full: bool = False) -> int:
+        """Recompute the "readers also rented" neighbours; returns the number of books refreshed
+        
+        Without full, only books rented by readers with rentals newer than the
+        last build are recomputed: no other book's shared-reader counts change.
+        """
+        self._require_sql_storage('Building related books')
+        built_through = None if full else self.related_repo.get_built_through()
+        last_rental_id = self.related_repo.get_last_rental_id()
+        if last_rental_id is None or last_rental_id == built_through:
+            return 0
+        
+        reader_ids, book_ids = self.related_repo.get_reader_book_pairs()
+        if built_through is None:
+            affected = None
+        else:
+            readers = set(self.related_repo.get_readers_since(built_through))
+            affected = {book_id for reader_id, book_id in zip(reader_ids, book_ids) if reader_id in readers}
+        
+        neighbours = co_rented_top_k(reader_ids, book_ids, k, for_books=affected)
+        self.related_repo.replace(neighbours, last_rental_id, book_ids=affected)
+        return len(neighbours)
+    
+    def get_changes(self, since: int, limit: int = 1000) -> dict:
+        """Entities changed after the given change log sequence number
+        
+        Several writes to one entity collapse into a single change carrying the
+        entity's current state (None once it has been deleted or archived).
+        """
+        entries = self.change_log_repo.get_since(since, limit)
+        latest = {}
+        for entry in entries:
+            latest[(entry['entity'], entry['entity_id'])] = entry
+        
+        repos = {'book': self.book_repo, 'reader': self.reader_repo, 'rental': self.rental_repo}
+        current = {}
+        for entity, repo in repos.items():
+            ids = [entity_id for (name, entity_id), entry in latest.items()
+                   if name == entity and entry['operation'] not in ('delete', 'archive')]
+            current[entity] = {obj.id: obj for obj in repo.get_by_ids(ids)}
+        
+        changes = []
+        for entry in sorted(latest.values(), key=lambda e: e['seq']):
+            changes.append(dict(entry, data=current[entry['entity']].get(entry['entity_id'])))
+        
+        return {
+            'last_seq': entries[-1]['seq'] if entries else since,
+            'has_more': len(entries) == limit,
+            'changes': changes
+        }
+    
+    def wait_for_changes(self, since: int, timeout: float, limit: int = 1000,
+                         poll_interval: float = 1.0) -> dict:
+        """Long-poll variant of get_changes that returns as soon as something changed
+        
+        Local commits wake the wait immediately; writes from other processes are
+        picked up at least every poll_interval seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            result = self.get_changes(since, limit)
+            remaining = deadline - time.monotonic()
+            if result['changes'] or remaining <= 0:
+                return result
+            self.change_log_repo.wait_for_change(min(poll_interval, remaining))
+    
+    def is_change_log_truncated(self, since: int) -> bool:
+        """Whether entries after since may already have been pruned"""
+        return since < self.change_log_repo.get_pruned_through()
+    
+    def get_last_change_seq(self) -> int:
+        return self.change_log_repo.get_last_seq()
+    
+    def archive_rentals(self, older_than_days: int, batch_size: int = 1000) -> int:
+        """Move rentals closed more than older_than_days ago to the archive table"""
+        return self.rental_repo.archive_closed(date.today() - timedelta(days=older_than_days), batch_size)
+    
+    def prune_change_log(self, keep_days: int) -> int:
+        """Delete change log entries older than keep_days"""
+        return self.change_log_repo.prune(datetime.utcnow() - timedelta(days=keep_days))
+    
     def get_financial_history(self) -> List[dict]:
         """Get history of all financial operations"""
+        return self.report_flight.do(('financial-history',), self._get_financial_history)
+    
+    def _get_financial_history(self) -> List[dict]:
         rentals = self.rental_repo.get_all()
         history = []
         
+        loaders = self.loaders()
+        loaders.books.prime(r.book_id for r in rentals)
+        loaders.readers.prime(r.reader_id for r in rentals)
+        
         for rental in rentals:
-            book = self.book_repo.get_by_id(rental.book_id)
-            reader = self.reader_repo.get_by_id(rental.reader_id)
-            
-            # Rental transaction
-            history.append({
+            book = loaders.books.get(rental.book_id)
+            reader = loaders.readers.get(rental.reader_id)
+            for entry in self._ledger_entries(rental, book.title if book else None, reader.full_name if reader else None):
+                entry['date'] = entry['date'].isoformat()
+                history.append(entry)
+        
+        # Sort by date (newest first)
+        history.sort(key=lambda x: x['date'], reverse=True)
+        return history
+    
+    @staticmethod
+    def _ledger_entries(rental: Rental, book_title: Optional[str], reader_name: Optional[str]) -> List[dict]:
+        """Deposit, return and fine transactions of one rental"""
+        book_title = book_title or 'Unknown'
+        reader_name = reader_name or 'Unknown'
+        
+        # Rental transaction
+        entries = [{
+            'id': rental.id,
+            'date': rental.issue_date,
+            'type': 'Rental',
+            'description': f"Rental: {book_title} to {reader_name}",
+            'amount': rental.deposit_paid,
+            'transaction_type': 'deposit'
+        }]
+        
+        # Return transaction (if returned)
+        if rental.status in [RentalStatus.RETURNED, RentalStatus.DAMAGED]:
+            return_date = rental.actual_return_date or rental.issue_date
+            entries.append({
                 'id': rental.id,
-                'date': rental.issue_date.isoformat(),
-                'type': 'Rental',
-                'description': f"Rental: {book.title if book else 'Unknown'} to {reader.full_name if reader else 'Unknown'}",
-                'amount': rental.deposit_paid,
-                'transaction_type': 'deposit'
+                'date': return_date,
+                'type': 'Return',
+                'description': f"Return: {book_title} from {reader_name}",
+                'amount': rental.rental_cost,
+                'transaction_type': 'income'
             })
             
-            # Return transaction (if returned)
-            if rental.status in [RentalStatus.RETURNED, RentalStatus.DAMAGED]:
-                history.append({
+            # Fine transactions
+            if rental.fine_amount > 0:
+                entries.append({
                     'id': rental.id,
-                    'date': rental.actual_return_date.isoformat() if rental.actual_return_date else rental.issue_date.isoformat(),
-                    'type': 'Return',
-                    'description': f"Return: {book.title if book else 'Unknown'} from {reader.full_name if reader else 'Unknown'}",
-                    'amount': rental.rental_cost,
-                    'transaction_type': 'income'
+                    'date': return_date,
+                    'type': 'Fine',
+                    'description': f"Overdue fine: {book_title}",
+                    'amount': rental.fine_amount,
+                    'transaction_type': 'fine'
+                })
+            
+            if rental.damage_fine > 0:
+                entries.append({
+                    'id': rental.id,
+                    'date': return_date,
+                    'type': 'Damage Fine',
+                    'description': f"Damage fine: {book_title}",
+                    'amount': rental.damage_fine,
+                    'transaction_type': 'fine'
                 })
-                
-                # Fine transactions
-                if rental.fine_amount > 0:
-                    history.append({
-                        'id': rental.id,
-                        'date': rental.actual_return_date.isoformat() if rental.actual_return_date else rental.issue_date.isoformat(),
-                        'type': 'Fine',
-                        'description': f"Overdue fine: {book.title if book else 'Unknown'}",
-                        'amount': rental.fine_amount,
-                        'transaction_type': 'fine'
-                    })
-                
-                if rental.damage_fine > 0:
-                    history.append({
-                        'id': rental.id,
-                        'date': rental.actual_return_date.isoformat() if rental.actual_return_date else rental.issue_date.isoformat(),
-                        'type': 'Damage Fine',
-                        'description': f"Damage fine: {book.title if book else 'Unknown'}",
-                        'amount': rental.damage_fine,
-                        'transaction_type': 'fine'
-                    })
         
-        # Sort by date (newest first)
-        history.sort(key=lambda x: x['date'], reverse=True)
-        return history
-
+        return entries
+    
+    def export_rentals(self, start: Optional[date] = None, end: Optional[date] = None) -> Iterator[dict]:
+        """Stream rentals issued within [start, end] with book title and reader name"""
+        return self.rental_repo.iter_with_names(start, end)
+    
+    def export_financial_history(self, start: Optional[date] = None, end: Optional[date] = None) -> Iterator[dict]:
+        """Stream financial transactions dated within [start, end], in rental order"""
+        rental_fields = Rental.__dataclass_fields__
+        for row in self.rental_repo.iter_with_names(start, end, include_returns=True):
+            rental = Rental(**{name: row[name] for name in rental_fields})
+            for entry in self._ledger_entries(rental, row['book_title'], row['reader_name']):
+                if (start is None or entry['date'] >= start) and (end is None or entry['date'] <= end):
+                    yield entry
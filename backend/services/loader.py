@@ -0,0 +1,56 @@
+from typing import Callable, Dict, Iterable, Optional
+
+from flask import g, has_app_context
+
+
+class BatchLoader:
+    """Resolves entities by id in batches, remembering everything it has loaded
+    
+    Ids passed to prime() are fetched together with a single call to
+    fetch_many (an IN query) the first time any of them is read.
+    """
+    
+    def __init__(self, fetch_many: Callable[[Iterable[int]], list]):
+        self._fetch_many = fetch_many
+        self._loaded: Dict[int, Optional[object]] = {}
+        self._queued = set()
+    
+    def prime(self, ids: Iterable[int]) -> None:
+        self._queued.update(id for id in ids if id not in self._loaded)
+    
+    def get(self, id: int):
+        if id not in self._loaded:
+            self._queued.add(id)
+            self._flush()
+        return self._loaded[id]
+    
+    def get_many(self, ids: Iterable[int]) -> Dict[int, Optional[object]]:
+        ids = list(ids)
+        self.prime(ids)
+        self._flush()
+        return {id: self._loaded[id] for id in ids}
+    
+    def _flush(self) -> None:
+        if not self._queued:
+            return
+        ids, self._queued = self._queued, set()
+        found = {entity.id: entity for entity in self._fetch_many(ids)}
+        for id in ids:
+            self._loaded[id] = found.get(id)
+
+
+class Loaders:
+    """Book and reader loaders shared by everything that runs in one request"""
+    
+    def __init__(self, book_repo, reader_repo):
+        self.books = BatchLoader(book_repo.get_by_ids)
+        self.readers = BatchLoader(reader_repo.get_by_ids)
+    
+    @classmethod
+    def for_current_request(cls, book_repo, reader_repo) -> 'Loaders':
+        """Loaders stored on flask.g, or new ones when called outside an app context"""
+        if not has_app_context():
+            return cls(book_repo, reader_repo)
+        if 'loaders' not in g:
+            g.loaders = cls(book_repo, reader_repo)
+        return g.loaders
@@ -0,0 +1,82 @@
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from models.book import Genre
+
+
+class Leaderboards:
+    """Immutable top-N lists per time window, overall (genre None) and per genre, for one day"""
+
+    def __init__(self, day: date, tops: Dict[Tuple[str, Optional[Genre]], tuple]):
+        self.day = day
+        self._tops = tops
+
+    @classmethod
+    def build(cls, day: date, rows_by_granularity: Dict[str, List[dict]], top_n: int) -> 'Leaderboards':
+        tops = {}
+        for granularity, rows in rows_by_granularity.items():
+            entries = [dict(row, genre=row['genre'].value) for row in rows]
+            tops[(granularity, None)] = tuple(entries[:top_n])
+            for genre in Genre:
+                tops[(granularity, genre)] = tuple(e for e in entries if e['genre'] == genre.value)[:top_n]
+        return cls(day, tops)
+
+    def top(self, granularity: str, genre: Optional[Genre], limit: int) -> tuple:
+        return self._tops[(granularity, genre)][:limit]
+
+
+class PopularityBoard:
+    """Keeps the most rented books per window and genre in memory
+
+    The lists are rebuilt from the popularity counters by a background thread
+    when invalidate() is called (on committed rentals) and every
+    `refresh_interval` seconds, at most once per `min_interval` seconds.
+    Leaderboards built on an earlier day are rebuilt on read, so a week or
+    month that has ended is never served.
+    """
+
+    def __init__(self, app, popularity_repo, top_n: int = 10, refresh_interval: float = 60.0,
+                 min_interval: float = 1.0):
+        self._app = app
+        self._repo = popularity_repo
+        self.top_n = top_n
+        self._refresh_interval = refresh_interval
+        self._min_interval = min_interval
+        self._boards: Optional[Leaderboards] = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name='popularity-board', daemon=True).start()
+
+    def current(self) -> Leaderboards:
+        boards = self._boards
+        if boards is None or boards.day != date.today():
+            with self._lock:
+                boards = self._boards
+                if boards is None or boards.day != date.today():
+                    boards = self._rebuild()
+        return boards
+
+    def invalidate(self) -> None:
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self._refresh_interval)
+            self._wakeup.clear()
+            try:
+                with self._app.app_context(), self._lock:
+                    self._rebuild()
+            except Exception:
+                self._app.logger.exception("Popularity board refresh failed")
+            time.sleep(self._min_interval)
+
+    def _rebuild(self) -> Leaderboards:
+        """Read the current buckets' leaders; callers hold the lock"""
+        today = date.today()
+        rows = {g: self._repo.get_top(g, today, self.top_n) for g in self._repo.GRANULARITIES}
+        self._boards = Leaderboards.build(today, rows, self.top_n)
+        return self._boards
@@ -0,0 +1,114 @@
+import bisect
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from models.reader import telephone_digits, trigrams
+
+
+class ReaderSearchIndex:
+    """In-process reader search for databases without pg_trgm
+
+    Keeps readers' lowercased names and telephone digits in sorted lists for
+    prefix lookups and an inverted trigram index for substring and fuzzy
+    matches, ranked like ReaderRepository.search. invalidate(reader_ids)
+    re-reads those readers before the next search; invalidate() with no ids
+    rebuilds the index from scratch.
+    """
+
+    def __init__(self, reader_repo, similarity: float = 0.3):
+        self._reader_repo = reader_repo
+        self._similarity = similarity
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[int, Tuple[str, str, int]]] = None  # id -> (name, digits, trigram count)
+        self._names: List[Tuple[str, int]] = []
+        self._phones: List[Tuple[str, int]] = []
+        self._grams: Dict[str, Set[int]] = {}
+        self._changed_ids = set()
+
+    def preload(self, app) -> None:
+        """Build the index on a background thread so the first search does not wait for it"""
+        def build():
+            with app.app_context(), self._lock:
+                self._refresh()
+        threading.Thread(target=build, name='reader-search-preload', daemon=True).start()
+
+    def invalidate(self, reader_ids: Optional[Iterable[int]] = None) -> None:
+        with self._lock:
+            if reader_ids is None:
+                self._entries = None
+            else:
+                self._changed_ids.update(reader_ids)
+
+    def search(self, query: str, limit: int) -> List[int]:
+        """Ids of the best matching readers, best first"""
+        with self._lock:
+            self._refresh()
+            digits = telephone_digits(query)
+            if digits and not any(char.isalpha() for char in query):
+                start = bisect.bisect_left(self._phones, (digits,))
+                matches = []
+                for phone, reader_id in self._phones[start:start + limit]:
+                    if not phone.startswith(digits):
+                        break
+                    matches.append(reader_id)
+                return matches
+            return self._match_names(query.strip().lower(), limit)
+
+    def _match_names(self, term: str, limit: int) -> List[int]:
+        term_grams = trigrams(term)
+        shared = {}
+        for gram in term_grams:
+            for reader_id in self._grams.get(gram, ()):
+                shared[reader_id] = shared.get(reader_id, 0) + 1
+        # Prefixes too short to share a trigram are found in the sorted names
+        start = bisect.bisect_left(self._names, (term,))
+        for name, reader_id in self._names[start:start + limit]:
+            if not name.startswith(term):
+                break
+            shared.setdefault(reader_id, 0)
+
+        ranked = []
+        for reader_id, count in shared.items():
+            name, _, gram_count = self._entries[reader_id]
+            score = count / (len(term_grams) + gram_count - count) if count else 0.0
+            if name.startswith(term) or term in name or score >= self._similarity:
+                ranked.append((not name.startswith(term), -score, reader_id))
+        ranked.sort()
+        return [reader_id for _, _, reader_id in ranked[:limit]]
+
+    def _refresh(self) -> None:
+        """Bring the index up to date; callers hold the lock"""
+        if self._entries is None:
+            self._changed_ids.clear()
+            self._entries, self._grams = {}, {}
+            for reader_id, full_name, telephone in self._reader_repo.get_search_fields():
+                self._index(reader_id, full_name, telephone)
+            self._names = sorted((entry[0], reader_id) for reader_id, entry in self._entries.items())
+            self._phones = sorted((entry[1], reader_id) for reader_id, entry in self._entries.items())
+            return
+        if not self._changed_ids:
+            return
+        reader_ids, self._changed_ids = self._changed_ids, set()
+        for reader_id in reader_ids:
+            self._remove(reader_id)
+        for reader_id, full_name, telephone in self._reader_repo.get_search_fields(reader_ids):
+            self._index(reader_id, full_name, telephone)
+            name, digits, _ = self._entries[reader_id]
+            bisect.insort(self._names, (name, reader_id))
+            bisect.insort(self._phones, (digits, reader_id))
+
+    def _index(self, reader_id: int, full_name: str, telephone: str) -> None:
+        grams = trigrams(full_name)
+        self._entries[reader_id] = (full_name.lower(), telephone_digits(telephone), len(grams))
+        for gram in grams:
+            self._grams.setdefault(gram, set()).add(reader_id)
+
+    def _remove(self, reader_id: int) -> None:
+        entry = self._entries.pop(reader_id, None)
+        if entry is None:
+            return
+        name, digits, _ = entry
+        self._names.remove((name, reader_id))
+        self._phones.remove((digits, reader_id))
+        for gram in trigrams(name):
+            self._grams[gram].discard(reader_id)
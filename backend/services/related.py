@@ -0,0 +1,122 @@
+import threading
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+
+def co_rented_top_k(reader_ids: Sequence[int], book_ids: Sequence[int], k: int,
+                    for_books: Optional[Iterable[int]] = None,
+                    batch_size: int = 1024) -> Dict[int, List[Tuple[int, int]]]:
+    """Top k books rented by the same readers, per book, from (reader, book) rental pairs
+
+    Builds the binary reader x book matrix R once; the co-occurrence rows of a
+    batch of books are R[:, batch].T @ R, so only the rows asked for in
+    for_books (default all books) are ever computed. Neighbours are ordered by
+    the number of shared readers, then by book id.
+    """
+    if not len(book_ids):
+        return {}
+    readers, reader_index = np.unique(np.asarray(reader_ids), return_inverse=True)
+    books, book_index = np.unique(np.asarray(book_ids), return_inverse=True)
+    rented = sparse.csr_matrix(
+        (np.ones(len(book_index), dtype=np.int32), (reader_index, book_index)),
+        shape=(len(readers), len(books))
+    )
+    rented.data[:] = 1  # A pair listed twice (live and archived) still counts once
+    rented_by = rented.T.tocsr()
+
+    if for_books is None:
+        rows = np.arange(len(books))
+    else:
+        rows = np.flatnonzero(np.isin(books, list(for_books)))
+
+    neighbours = {}
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        counts = (rented_by[batch] @ rented).tocsr()
+        for offset, row in enumerate(batch):
+            begin, end = counts.indptr[offset], counts.indptr[offset + 1]
+            columns, shared = counts.indices[begin:end], counts.data[begin:end]
+            keep = columns != row
+            columns, shared = columns[keep], shared[keep]
+            if len(columns) > k:
+                best = np.argpartition(-shared, k - 1)[:k]
+                columns, shared = columns[best], shared[best]
+            order = np.lexsort((books[columns], -shared))
+            neighbours[int(books[row])] = [(int(books[columns[i]]), int(shared[i])) for i in order]
+    return neighbours
+
+
+class RelatedIndex:
+    """In-memory "readers also rented" lists, loaded from the stored neighbours
+
+    Lookups are a dict access. invalidate(book_ids) reloads only those books
+    from a background thread, invalidate() with no ids reloads everything, and
+    a full reload also runs every `refresh_interval` seconds, which picks up
+    edited titles of related books.
+    """
+
+    def __init__(self, app, related_repo, refresh_interval: float = 300.0):
+        self._app = app
+        self._repo = related_repo
+        self._refresh_interval = refresh_interval
+        self._related: Optional[MappingProxyType] = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._changed_ids = set()
+        self._reload_requested = False
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name='related-index', daemon=True).start()
+
+    def get(self, book_id: int) -> Optional[tuple]:
+        related = self._related
+        if related is None:
+            related = self._reload()
+        return related.get(book_id)
+
+    def invalidate(self, book_ids: Optional[List[int]] = None) -> None:
+        with self._lock:
+            if book_ids is None:
+                self._reload_requested = True
+            else:
+                self._changed_ids.update(book_ids)
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            woken = self._wakeup.wait(self._refresh_interval)
+            self._wakeup.clear()
+            try:
+                with self._app.app_context():
+                    if not woken or self._reload_requested:
+                        self._reload()
+                    else:
+                        self._patch()
+            except Exception:
+                self._app.logger.exception("Related books index refresh failed")
+
+    def _reload(self) -> MappingProxyType:
+        with self._lock:
+            self._reload_requested = False
+            self._changed_ids.clear()
+        related = MappingProxyType({id: tuple(entries) for id, entries in self._repo.get_all().items()})
+        self._related = related
+        return related
+
+    def _patch(self) -> None:
+        with self._lock:
+            book_ids, self._changed_ids = self._changed_ids, set()
+        if not book_ids or self._related is None:
+            return
+        loaded = self._repo.get_for_books(book_ids)
+        related = dict(self._related)
+        for book_id in book_ids:
+            if book_id in loaded:
+                related[book_id] = tuple(loaded[book_id])
+            else:
+                related.pop(book_id, None)
+        with self._lock:
+            self._related = MappingProxyType(related)
@@ -0,0 +1,191 @@
+import gzip
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, List, Optional
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+@dataclass
+class ReportJob:
+    """A report computed in the background; its result is a gzip-compressed JSON file"""
+    id: str
+    report: str
+    params: dict
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    result_size: Optional[int] = None
+    owner: str = field(default_factory=lambda: f"{socket.gethostname()}:{os.getpid()}")
+
+    def dedup_key(self) -> str:
+        return json.dumps([self.report, self.params], sort_keys=True)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class ReportJobManager:
+    """Runs report jobs on a thread pool and keeps their results on local disk
+
+    Submitting a report with the same parameters as a queued or running job
+    returns that job instead of starting another one; once a job has finished,
+    the same submission computes a fresh result. Job
+    metadata is written next to the result, so any worker sharing `directory`
+    can answer status and download requests. Jobs older than
+    `retention_seconds` are deleted, as are the oldest ones beyond `max_jobs`.
+    """
+
+    def __init__(self, app, reports: Dict[str, Callable[[dict], object]], directory: str,
+                 max_workers: int = 2, retention_seconds: float = 86400, max_jobs: int = 200):
+        self._app = app
+        self._reports = reports
+        self._directory = directory
+        self._retention_seconds = retention_seconds
+        self._max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report-job')
+        self._lock = threading.Lock()
+        self._futures = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def has_report(self, name: str) -> bool:
+        return name in self._reports
+
+    def submit(self, name: str, params: dict) -> ReportJob:
+        job = ReportJob(id=uuid.uuid4().hex, report=name, params=params)
+        with self._lock:
+            self._prune()
+            for existing in self._load_all():
+                if existing.status in (QUEUED, RUNNING) and existing.dedup_key() == job.dedup_key():
+                    return existing
+            self._save(job)
+            self._futures[job.id] = self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[ReportJob]:
+        path = self._meta_path(job_id)
+        if not job_id.isalnum() or not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return ReportJob(**json.load(f))
+
+    def list(self) -> List[ReportJob]:
+        with self._lock:
+            self._prune()
+            return sorted(self._load_all(), key=lambda job: job.created_at, reverse=True)
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self._directory, f"{job_id}.json.gz")
+
+    def cancel(self, job_id: str) -> Optional[ReportJob]:
+        """Cancel a queued or running job; a finished job is deleted instead"""
+        with self._lock:
+            job = self.get(job_id)
+            if job is None:
+                return None
+            if job.status in (QUEUED, RUNNING):
+                future = self._futures.pop(job_id, None)
+                if future is not None:
+                    future.cancel()
+                # A running job finishes its computation but its result is discarded
+                job.status = CANCELLED
+                job.finished_at = time.time()
+                self._save(job)
+            else:
+                self._delete(job_id)
+            return job
+
+    def _run(self, job: ReportJob) -> None:
+        if not self._transition(job, RUNNING, started_at=time.time()):
+            return
+        try:
+            with self._app.app_context():
+                result = self._reports[job.report](job.params)
+                body = self._app.json.dumps(result).encode()
+            tmp_path = self.result_path(job.id) + '.tmp'
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(body)
+            if self._transition(job, DONE, finished_at=time.time(), result_size=len(body)):
+                os.replace(tmp_path, self.result_path(job.id))
+            else:
+                os.remove(tmp_path)
+        except Exception as e:
+            self._transition(job, FAILED, finished_at=time.time(), error=str(e))
+        finally:
+            self._futures.pop(job.id, None)
+
+    def _transition(self, job: ReportJob, status: str, **changes) -> bool:
+        """Move job to status unless it was cancelled meanwhile"""
+        with self._lock:
+            current = self.get(job.id)
+            if current is None or current.status == CANCELLED:
+                return False
+            job.status = status
+            for name, value in changes.items():
+                setattr(job, name, value)
+            self._save(job)
+            return True
+
+    def _meta_path(self, job_id: str) -> str:
+        return os.path.join(self._directory, f"{job_id}.meta.json")
+
+    def _save(self, job: ReportJob) -> None:
+        tmp_path = self._meta_path(job.id) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job.to_dict(), f)
+        os.replace(tmp_path, self._meta_path(job.id))
+
+    def _load_all(self) -> List[ReportJob]:
+        jobs = []
+        for name in os.listdir(self._directory):
+            if name.endswith('.meta.json'):
+                job = self.get(name[:-len('.meta.json')])
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+    def _delete(self, job_id: str) -> None:
+        for path in (self._meta_path(job_id), self.result_path(job_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self._retention_seconds
+        jobs = sorted(self._load_all(), key=lambda job: job.created_at, reverse=True)
+        for index, job in enumerate(jobs):
+            if job.status in (QUEUED, RUNNING):
+                if self._owner_exited(job):
+                    job.status = FAILED
+                    job.finished_at = time.time()
+                    job.error = 'worker exited before the job finished'
+                    self._save(job)
+                continue
+            if index >= self._max_jobs or (job.finished_at or job.created_at) < cutoff:
+                self._delete(job.id)
+
+    @staticmethod
+    def _owner_exited(job: ReportJob) -> bool:
+        """True when the job belongs to a process on this host that is no longer running"""
+        host, _, pid = job.owner.rpartition(':')
+        if host != socket.gethostname() or int(pid) == os.getpid():
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
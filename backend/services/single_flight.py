@@ -0,0 +1,75 @@
+import threading
+import time
+from typing import Callable, Hashable
+
+
+class _Flight:
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class SingleFlight:
+    """Runs one computation per key at a time and memoizes results for `ttl` seconds
+
+    Callers asking for a key that is already being computed wait for that
+    computation instead of starting their own. invalidate() drops memoized
+    results and detaches running computations, so later callers start afresh
+    while earlier waiters still get the result they were waiting for. Results
+    are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._memo = {}
+        self._generation = 0
+        self._counters = {'computed': 0, 'shared': 0, 'memo_hits': 0, 'invalidations': 0}
+
+    def do(self, key: Hashable, compute: Callable[[], object]):
+        leader = False
+        with self._lock:
+            memo = self._memo.get(key)
+            if memo is not None and memo[0] > time.monotonic():
+                self._counters['memo_hits'] += 1
+                return memo[1]
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._counters['shared'] += 1
+            else:
+                flight = self._flights[key] = _Flight()
+                generation = self._generation
+                self._counters['computed'] += 1
+                leader = True
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                if flight.error is None and self._ttl > 0 and generation == self._generation:
+                    self._memo[key] = (time.monotonic() + self._ttl, flight.result)
+            flight.done.set()
+        return flight.result
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._memo.clear()
+            self._flights.clear()
+            self._counters['invalidations'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters, ttl=self._ttl, in_flight=len(self._flights), memoized=len(self._memo))
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+# The app connects when it is imported, so point it at a scratch database first: SQLite,
+# or the PostgreSQL database in TEST_DATABASE_URL (its tables are dropped by every test)
+_directory = tempfile.mkdtemp(prefix='library-tests-')
+os.environ['DATABASE_URL'] = os.getenv('TEST_DATABASE_URL') or 'sqlite:///' + os.path.join(_directory, 'library.db')
+os.environ.setdefault('REPORT_CACHE_TTL', '0')
+os.environ.setdefault('REPORT_JOBS_DIR', os.path.join(_directory, 'report_jobs'))
+os.environ.setdefault('ADMISSION_CLIENT_RATE', '0')
+
+from app import app, library  # noqa: E402
+from database.db import db  # noqa: E402
+
+
+class AppTestCase(unittest.TestCase):
+    """Runs each test against empty tables through the Flask test client"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        self.client = app.test_client()
+
+    def post(self, path: str, body: dict) -> dict:
+        response = self.client.post(path, json=body)
+        self.assertLess(response.status_code, 400, response.get_data(as_text=True))
+        return response.get_json()
+
+    def get(self, path: str):
+        response = self.client.get(path)
+        self.assertLess(response.status_code, 400, response.get_data(as_text=True))
+        return response.get_json()
+
+    def add_book(self, value: float = 20.0, copies: int = 1, genre: str = 'fiction') -> int:
+        return self.post('/api/books', {
+            'title': f'Book {value}', 'author': 'Author', 'genre': genre, 'value': value, 'copies': copies
+        })['id']
+
+    def add_reader(self, category: str = 'regular') -> int:
+        return self.post('/api/readers', {
+            'full_name': f'Reader {category}', 'address': 'Main St 1', 'telephone': '+1 555 0100', 'category': category
+        })['id']
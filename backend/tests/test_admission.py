@@ -0,0 +1,44 @@
+import unittest
+
+from flask import g
+
+from middleware.admission import BULK, CRITICAL, NORMAL, _parse_limits
+from tests.support import app
+from app import admission
+
+
+class AdmissionClassesTest(unittest.TestCase):
+    """Endpoints named by the admission controller exist and are classed as intended"""
+
+    def test_named_endpoints_exist(self):
+        named = (
+            admission.CRITICAL_ENDPOINTS | admission.LONG_POLL_ENDPOINTS
+            | set(_parse_limits(app.config['ADMISSION_ROUTE_LIMITS']))
+            | admission.EXEMPT_ENDPOINTS - {'static'}
+        )
+        for endpoint in sorted(named):
+            with self.subTest(endpoint=endpoint):
+                self.assertIn(endpoint, app.view_functions)
+
+    def test_classify(self):
+        for method, path, priority in [
+            ('POST', '/api/rentals', CRITICAL),
+            ('POST', '/api/rentals/1/return', CRITICAL),
+            ('GET', '/api/rentals', NORMAL),
+            ('GET', '/api/reports/timeseries', BULK),
+        ]:
+            with self.subTest(path=path), app.test_request_context(path, method=method):
+                self.assertEqual(admission.classify(), priority)
+
+    def test_long_poll_takes_no_slot(self):
+        with app.test_request_context('/api/changes?since=0&wait=30'):
+            self.assertIsNone(admission._before_request())
+            self.assertNotIn('admission', g)
+        with app.test_request_context('/api/rentals'):
+            self.assertIsNone(admission._before_request())
+            self.assertEqual(g.admission, (NORMAL, 'get_rentals'))
+            admission._teardown_request(None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from tests.support import AppTestCase, app, library
+
+
+class ChangeFeedTest(AppTestCase):
+    """Delta-sync clients learn when pruning has dropped changes they have not seen"""
+
+    def prune_all(self) -> int:
+        with app.app_context():
+            return library.prune_change_log(-1)
+
+    def test_client_behind_a_full_prune_must_reload(self):
+        self.add_book()
+        last_seq = self.get('/api/changes')['last_seq']
+        self.assertEqual(self.prune_all(), 1)
+        self.assertEqual(self.client.get('/api/changes?since=0').status_code, 410)
+        self.assertEqual(self.get(f'/api/changes?since={last_seq}')['changes'], [])
+
+    def test_client_behind_a_prune_followed_by_new_changes_must_reload(self):
+        self.add_book()
+        self.prune_all()
+        self.add_book()
+        self.assertEqual(self.client.get('/api/changes?since=0').status_code, 410)
+
+    def test_seq_is_not_reused_after_a_full_prune(self):
+        self.add_book()
+        last_seq = self.get('/api/changes')['last_seq']
+        self.prune_all()
+        self.add_book()
+        changes = self.get(f'/api/changes?since={last_seq}')['changes']
+        self.assertEqual(len(changes), 1)
+        self.assertGreater(changes[0]['seq'], last_seq)
+
+    def test_out_of_range_parameters(self):
+        for query in ('limit=0', 'limit=-1', 'limit=5001', 'wait=nan', 'wait=-1', 'wait=31', 'limit=x'):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f'/api/changes?since=0&{query}').status_code, 400)
+        self.assertEqual(self.client.get('/api/changes?since=0&limit=1&wait=0').status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
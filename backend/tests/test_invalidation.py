@@ -0,0 +1,30 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from cache.invalidation import FileInvalidationBus
+
+
+class InvalidationBusTest(unittest.TestCase):
+    """The bus listener survives malformed messages from other workers"""
+
+    def test_malformed_message_is_skipped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'invalidation.log')
+            bus = FileInvalidationBus(path, poll_interval=0.01)
+            received = threading.Event()
+            bus.subscribe(lambda events: received.set())
+            bus.start()
+            time.sleep(0.05)
+            good = {'origin': 'other:1', 'published_at': time.time(), 'events': [{'entity': 'book', 'id': 1}]}
+            with self.assertLogs('cache.invalidation', 'ERROR'):
+                with open(path, 'a') as f:
+                    f.write('not json\n{"origin": "other:1"}\n' + json.dumps(good) + '\n')
+                self.assertTrue(received.wait(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
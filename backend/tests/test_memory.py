@@ -0,0 +1,68 @@
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+from models.reader import Reader, ReaderCategory
+from repository.memory import InMemoryReaderRepository, MemoryStore
+from services.reader_search import ReaderSearchIndex
+from tests.support import AppTestCase, app, library
+
+NAMES = [
+    ('Ann Lee', '+1 (555) 123-4567'),
+    ('Anna Karenina', '+1 555 123 9999'),
+    ('Joanna Smith', '+44 20 7946 0000'),
+    ('Jon Snow', '555-0100'),
+    ('Bob Annan', '+1 555 777 1234'),
+]
+
+
+class InMemoryStorageTest(AppTestCase):
+    """In-memory storage searches readers, round-trips snapshots and refuses SQL-only routes"""
+
+    def setUp(self):
+        super().setUp()
+        self.store = MemoryStore()
+        self.readers = InMemoryReaderRepository(self.store)
+        with app.app_context():
+            for full_name, telephone in NAMES:
+                self.readers.add(Reader(None, full_name, 'Main St 1', telephone, ReaderCategory.REGULAR))
+
+    def test_search_ranks_like_the_search_index(self):
+        index = ReaderSearchIndex(self.readers, 0.3)
+        with app.app_context():
+            for query in ('ann', 'Ann Lee', 'anna', 'jon', 'snwo', '555', '+1 555 1', '4420', 'zzz'):
+                with self.subTest(query=query):
+                    found = [reader.id for reader in self.readers.search(query, 10, 0.3, 200)]
+                    self.assertEqual(found, index.search(query, 10))
+
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'library.snapshot')
+            self.assertTrue(self.store.save(path))
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+            loaded = InMemoryReaderRepository(MemoryStore(path))
+            with app.app_context():
+                self.assertEqual(
+                    [(r.id, r.full_name, r.category) for r in loaded.get_all()],
+                    [(r.id, r.full_name, r.category) for r in self.readers.get_all()]
+                )
+
+    def test_snapshot_refuses_other_objects(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'library.snapshot')
+            with open(path, 'wb') as f:
+                pickle.dump({'format': MemoryStore.SNAPSHOT_FORMAT, 'tables': {}, 'hook': os.getcwd}, f)
+            with self.assertRaises(pickle.UnpicklingError):
+                MemoryStore(path)
+
+    def test_sql_only_routes_answer_501(self):
+        with mock.patch.object(library, 'memory_store', self.store):
+            for path in ('/api/branches/1/books', '/api/books/popular', '/api/books/1/related'):
+                with self.subTest(path=path):
+                    self.assertEqual(self.client.get(path).status_code, 501)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import Float, Integer, create_engine, literal, select
+
+from database.models import ReaderModel
+from models.reader import ReaderCategory
+from patterns.discount import CategoryDiscountStrategy, DiscountContext, NoDiscountStrategy
+from patterns.fine import StandardFineCalculator, FineContext
+from patterns.strategy import PRICING_STRATEGIES, PricingContext
+
+# Zero and negative days are charged as one day; 6-8 and 13-15 straddle week and tier boundaries
+DAYS = [-3, 0, 1, 6, 7, 8, 13, 14, 15, 21, 22, 45]
+BASE_COSTS = [0.0, 1.0, 2.5, 3.3]
+
+
+class SqlParityTest(unittest.TestCase):
+    """The SQL forms of the pricing, discount and fine strategies match their Python forms"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine('sqlite://')
+
+    def evaluate(self, expression):
+        with self.engine.connect() as connection:
+            return connection.execute(select(expression)).scalar()
+
+    def test_pricing_strategies(self):
+        start = date(2024, 1, 1)
+        for name, strategy in PRICING_STRATEGIES.items():
+            context = PricingContext(strategy())
+            for base_cost in BASE_COSTS:
+                for days in DAYS:
+                    with self.subTest(strategy=name, base_cost=base_cost, days=days):
+                        expected = context.calculate_cost(base_cost, start, start + timedelta(days=days))
+                        self.assertAlmostEqual(context.calculate_costs(np.array([base_cost]), np.array([days]))[0], expected)
+                        sql = context.cost_sql(literal(base_cost, Float), literal(days, Integer))
+                        self.assertAlmostEqual(self.evaluate(sql), expected)
+
+    def test_weekly_pricing_rounds_partial_weeks_up(self):
+        context = PricingContext(PRICING_STRATEGIES['weekly']())
+        for days, weeks in [(0, 1), (1, 1), (7, 1), (8, 2), (14, 2), (15, 3)]:
+            with self.subTest(days=days):
+                self.assertEqual(self.evaluate(context.cost_sql(literal(2.0, Float), literal(days, Integer))), 2.0 * weeks)
+
+    def test_discount_strategies(self):
+        category = ReaderModel.category.type
+        for strategy in (NoDiscountStrategy(), CategoryDiscountStrategy()):
+            context = DiscountContext(strategy)
+            for reader_category in ReaderCategory:
+                for amount in (0.0, 10.0, 33.3):
+                    with self.subTest(strategy=type(strategy).__name__, category=reader_category, amount=amount):
+                        expected = context.apply_discount(amount, reader_category)
+                        sql = context.apply_discount_sql(literal(amount, Float), literal(reader_category, category))
+                        self.assertAlmostEqual(self.evaluate(sql), expected)
+
+    def test_overdue_fines_up_to_the_cap(self):
+        context = FineContext(StandardFineCalculator())
+        for rental_cost in (0.0, 1.0, 4.0, 12.5):
+            for days in (0, 1, 2, 3, 10, 31, 100):
+                with self.subTest(rental_cost=rental_cost, days=days):
+                    expected = context.get_overdue_fine(days, rental_cost)
+                    sql = context.overdue_fine_sql(literal(days, Integer), literal(rental_cost, Float))
+                    self.assertAlmostEqual(self.evaluate(sql), expected)
+
+    def test_damage_fines(self):
+        context = FineContext(StandardFineCalculator())
+        for level in ('minor', 'Moderate', 'SEVERE', 'destroyed', 'unknown'):
+            with self.subTest(level=level):
+                expected = context.get_damage_fine(40.0, level)
+                self.assertAlmostEqual(self.evaluate(context.damage_fine_sql(literal(40.0, Float), literal(level))), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,21 @@
+import unittest
+
+from flask import Flask
+
+from monitoring.profiler import RequestProfiler
+
+
+class ProfileTokenTest(unittest.TestCase):
+    """Only the configured X-Profile-Token selects a request for profiling"""
+
+    def test_token_comparison(self):
+        app = Flask(__name__)
+        app.config.update(PROFILE_SAMPLE_RATE=0, PROFILE_TOKEN='sécret')
+        profiler = RequestProfiler(app)
+        for supplied, expected in [('sécret'.encode().decode('latin-1'), True), ('secret', False), ('\xe9', False)]:
+            with self.subTest(supplied=supplied), app.test_request_context(headers={RequestProfiler.HEADER: supplied}):
+                self.assertEqual(profiler._should_profile(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
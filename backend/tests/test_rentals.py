@@ -0,0 +1,153 @@
+import threading
+import unittest
+from unittest import mock
+
+from models.rental import RentalStatus
+from services.coalescer import PendingCall
+from tests.support import AppTestCase, app, library
+
+
+class CheckoutBatchTest(AppTestCase):
+    """Coalesced checkouts lock books in a fixed order and report back to the right caller"""
+
+    def test_batch_locks_books_in_order(self):
+        books = [self.add_book(value, copies=2) for value in (10.0, 20.0, 30.0)]
+        readers = [self.add_reader() for _ in range(4)]
+        calls = [
+            PendingCall((books[2], readers[0], 7, None)),
+            PendingCall((books[0], readers[1], 7, None)),
+            PendingCall((books[1], readers[2], 7, None)),
+            PendingCall((books[0], readers[3], 7, None)),
+        ]
+        locked = []
+        get_for_update = library.book_repo.get_by_id_for_update
+
+        def record(book_id):
+            locked.append(book_id)
+            return get_for_update(book_id)
+
+        with app.app_context(), mock.patch.object(library.book_repo, 'get_by_id_for_update', side_effect=record):
+            library._rent_book_batch(calls)
+
+        # Every book is locked up front, then again by its checkouts, both in id order
+        self.assertEqual(locked[:len(books)], sorted(books))
+        self.assertEqual(locked[len(books):], sorted(locked[len(books):]))
+        for call in calls:
+            self.assertIsNone(call.error)
+            self.assertEqual((call.result.book_id, call.result.reader_id), call.args[:2])
+        # Same book: the earlier caller is served first
+        self.assertLess(calls[1].result.id, calls[3].result.id)
+
+    def test_overlapping_batches_both_finish(self):
+        books = [self.add_book(value, copies=2) for value in (10.0, 20.0, 30.0)]
+        readers = [self.add_reader() for _ in range(4)]
+        batches = [
+            [PendingCall((books[0], readers[0], 7, None)), PendingCall((books[1], readers[1], 7, None))],
+            [PendingCall((books[1], readers[2], 7, None)), PendingCall((books[2], readers[3], 7, None))],
+        ]
+        get_for_update = library.book_repo.get_by_id_for_update
+        first_locks = threading.Barrier(2, timeout=5)
+        started = threading.local()
+
+        def lock(book_id):
+            book = get_for_update(book_id)
+            # Each batch holds its first book before either goes on, the interleaving that deadlocked
+            if not getattr(started, 'value', False):
+                started.value = True
+                try:
+                    first_locks.wait()
+                except threading.BrokenBarrierError:
+                    pass
+            return book
+
+        def run(batch):
+            with app.app_context():
+                library._rent_book_batch(batch)
+
+        with mock.patch.object(library.book_repo, 'get_by_id_for_update', side_effect=lock):
+            threads = [threading.Thread(target=run, args=(batch,)) for batch in batches]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(30)
+
+        for call in batches[0] + batches[1]:
+            self.assertIsNone(call.error)
+            self.assertIsNotNone(call.result)
+        self.assertEqual([self.get(f'/api/books/{id}')['available_copies'] for id in books], [1, 0, 1])
+
+
+class ConcurrentReturnTest(AppTestCase):
+    """A rental returned twice at once is closed, and its copy shelved, only once"""
+
+    def return_in_thread(self, rental_id: int, **kwargs) -> None:
+        def run():
+            with app.app_context():
+                self.results.append(library.return_book(rental_id, **kwargs))
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+    def test_return_committed_while_waiting_for_the_book(self):
+        book_id, reader_id = self.add_book(copies=1), self.add_reader()
+        rental_id = self.post('/api/rentals', {'book_id': book_id, 'reader_id': reader_id, 'rental_days': 7})['id']
+        self.results = []
+        get_for_update = library.book_repo.get_by_id_for_update
+        raced = []
+
+        def race(id):
+            # The first return has read the open rental; another one completes before it locks the book
+            if not raced:
+                raced.append(id)
+                self.return_in_thread(rental_id, damage_level='minor')
+            return get_for_update(id)
+
+        with app.app_context(), mock.patch.object(library.book_repo, 'get_by_id_for_update', side_effect=race):
+            self.assertIsNone(library.return_book(rental_id))
+
+        self.assertEqual(self.results[0].status, RentalStatus.DAMAGED)
+        self.assertEqual(self.get(f'/api/books/{book_id}')['available_copies'], 1)
+        with app.app_context():
+            rental = library.rental_repo.get_by_id(rental_id)
+        self.assertEqual((rental.status, rental.damage_fine), (RentalStatus.DAMAGED, self.results[0].damage_fine))
+
+    def test_damaged_rental_is_not_returned_again(self):
+        book_id, reader_id = self.add_book(copies=1), self.add_reader()
+        rental_id = self.post('/api/rentals', {'book_id': book_id, 'reader_id': reader_id, 'rental_days': 7})['id']
+        self.post(f'/api/rentals/{rental_id}/return', {'damage_level': 'severe'})
+        response = self.client.post(f'/api/rentals/{rental_id}/return', json={})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.get(f'/api/books/{book_id}')['available_copies'], 1)
+
+    def test_return_rejects_a_malformed_branch(self):
+        book_id, reader_id = self.add_book(copies=1), self.add_reader()
+        rental_id = self.post('/api/rentals', {'book_id': book_id, 'reader_id': reader_id, 'rental_days': 7})['id']
+        for branch_id in ('x', [1], {'id': 1}):
+            with self.subTest(branch_id=branch_id):
+                response = self.client.post(f'/api/rentals/{rental_id}/return', json={'branch_id': branch_id})
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.get(f'/api/books/{book_id}')['available_copies'], 0)
+
+
+class ArchiveTest(AppTestCase):
+    """Archiving closed rentals keeps their ids unique and shows up in the change feed"""
+
+    def test_archived_ids_are_not_reused(self):
+        book_id, reader_id = self.add_book(copies=2), self.add_reader()
+        first = self.post('/api/rentals', {'book_id': book_id, 'reader_id': reader_id, 'rental_days': 7})
+        second = self.post('/api/rentals', {'book_id': book_id, 'reader_id': reader_id, 'rental_days': 7})
+        self.post(f"/api/rentals/{second['id']}/return", {})
+        since = self.get('/api/changes')['last_seq']
+
+        with app.app_context():
+            self.assertEqual(library.archive_rentals(-1), 1)
+
+        changes = self.get(f'/api/changes?since={since}')['changes']
+        self.assertEqual([(c['id'], c['operation'], c['data']) for c in changes], [(second['id'], 'archive', None)])
+        third = self.post('/api/rentals', {'book_id': book_id, 'reader_id': reader_id, 'rental_days': 7})
+        self.assertGreater(third['id'], second['id'])
+        self.assertNotEqual(third['id'], first['id'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import gzip
+import json
+import time
+import unittest
+
+from tests.support import AppTestCase
+
+
+class ReportJobsTest(AppTestCase):
+    """Background report jobs are shared only while in progress and honour Accept-Encoding"""
+
+    def finished_job(self) -> dict:
+        job = self.post('/api/reports/issued-books/jobs', {})
+        deadline = time.monotonic() + 10
+        while job['status'] not in ('done', 'failed') and time.monotonic() < deadline:
+            time.sleep(0.01)
+            job = self.get(f"/api/reports/jobs/{job['id']}")
+        self.assertEqual(job['status'], 'done', job['error'])
+        return job
+
+    def test_finished_job_is_not_reused(self):
+        first = self.finished_job()
+        second = self.finished_job()
+        self.assertNotEqual(first['id'], second['id'])
+
+    def test_result_encoding_follows_accept_encoding(self):
+        job = self.finished_job()
+        path = f"/api/reports/jobs/{job['id']}/result"
+        for accept, encoded in [('gzip', True), ('br, gzip;q=0.5', True), ('gzip;q=0', False), ('', False)]:
+            with self.subTest(accept=accept):
+                response = self.client.get(path, headers={'Accept-Encoding': accept})
+                self.assertEqual(response.status_code, 200)
+                body = response.get_data()
+                self.assertEqual(response.headers.get('Content-Encoding') == 'gzip', encoded)
+                self.assertIn('total_issued', json.loads(gzip.decompress(body) if encoded else body))
+                response.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
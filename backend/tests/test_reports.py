@@ -0,0 +1,60 @@
+import unittest
+from datetime import date, timedelta
+
+from models.reader import ReaderCategory
+from patterns.discount import CategoryDiscountStrategy, DiscountContext
+from patterns.fine import StandardFineCalculator, FineContext
+from patterns.strategy import PRICING_STRATEGIES, PricingContext
+from tests.support import AppTestCase
+
+
+class ProjectionReportsTest(AppTestCase):
+    """Projection reports computed in SQL on SQLite agree with the Python strategies"""
+
+    def setUp(self):
+        super().setUp()
+        book_ids = [self.add_book(value, copies=4) for value in (20.0, 35.0)]
+        self.books = {id: self.get(f'/api/books/{id}')['base_rental_cost'] for id in book_ids}
+        self.readers = {self.add_reader(category.value): category for category in ReaderCategory}
+        self.rentals = []
+        for i, days in enumerate([0, 1, 6, 8, 13, 15, 40]):
+            book_id = list(self.books)[i % 2]
+            reader_id = list(self.readers)[i % len(self.readers)]
+            rental = self.post('/api/rentals', {'book_id': book_id, 'reader_id': reader_id, 'rental_days': days})
+            self.rentals.append(rental)
+
+    def test_revenue_projection(self):
+        discount = DiscountContext(CategoryDiscountStrategy())
+        for name, strategy in PRICING_STRATEGIES.items():
+            with self.subTest(strategy=name):
+                pricing = PricingContext(strategy())
+                expected = sum(
+                    discount.apply_discount(
+                        pricing.calculate_cost(
+                            self.books[rental['book_id']],
+                            date.fromisoformat(rental['issue_date']),
+                            date.fromisoformat(rental['expected_return_date'])
+                        ),
+                        self.readers[rental['reader_id']]
+                    )
+                    for rental in self.rentals
+                )
+                report = self.get(f'/api/reports/revenue-projection?strategy={name}')
+                self.assertEqual(report['total_rentals'], len(self.rentals))
+                self.assertAlmostEqual(report['projected_rental_income'], expected)
+
+    def test_projected_fines(self):
+        fines = FineContext(StandardFineCalculator())
+        as_of = date.today() + timedelta(days=20)
+        overdue = [r for r in self.rentals if date.fromisoformat(r['expected_return_date']) < as_of]
+        expected = sum(
+            fines.get_overdue_fine((as_of - date.fromisoformat(r['expected_return_date'])).days, r['rental_cost'])
+            for r in overdue
+        )
+        report = self.get(f'/api/reports/projected-fines?as_of={as_of.isoformat()}')
+        self.assertEqual(report['overdue_rentals'], len(overdue))
+        self.assertAlmostEqual(report['projected_fines'], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+from monitoring.tracing import RequestTracer, tracer, traced
+
+TRACE_ID, PARENT_ID = 'a' * 32, 'b' * 16
+
+
+@traced
+class Rows:
+    def iterate(self, n):
+        for i in range(n):
+            with tracer.span('row'):
+                yield i
+
+
+class TracingTest(unittest.TestCase):
+    """traceparent parsing, inbound sampling and spans of generator methods"""
+
+    def test_sampled_flag_is_the_low_bit(self):
+        for flags, sampled in [('00', False), ('01', True), ('03', True), ('02', False), ('zz', False)]:
+            with self.subTest(flags=flags):
+                self.assertEqual(RequestTracer._parse_traceparent(f'00-{TRACE_ID}-{PARENT_ID}-{flags}')[2], sampled)
+
+    def test_inbound_sampling_only_from_trusted_networks(self):
+        request_tracer = RequestTracer(Flask(__name__))
+        self.assertTrue(request_tracer._is_trusted('127.0.0.1'))
+        self.assertFalse(request_tracer._is_trusted('203.0.113.7'))
+        self.assertFalse(request_tracer._is_trusted(None))
+
+    def test_generator_span_covers_iteration(self):
+        span, token = tracer.start_trace('test')
+        rows = Rows().iterate(3)
+        self.assertEqual(span.trace.spans, [])
+        self.assertEqual(list(rows), [0, 1, 2])
+        spans = span.trace.spans
+        with mock.patch.object(tracer, 'exporter', None):
+            tracer.finish_trace(span, token)
+        iterate = next(s for s in spans if s.name == 'Rows.iterate')
+        self.assertEqual([s.name for s in spans], ['row', 'row', 'row', 'Rows.iterate', 'test'])
+        self.assertTrue(all(s.end_ns <= iterate.end_ns for s in spans if s.name == 'row'))
+
+
+if __name__ == '__main__':
+    unittest.main()
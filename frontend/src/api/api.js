@@ -14,6 +14,8 @@ export const booksAPI = {
   getAll: (availableOnly = false) => 
     api.get('/books', { params: { available_only: availableOnly } }),
   getById: (id) => api.get(`/books/${id}`),
+  getByIds: (ids) => api.get('/books', { params: { ids: ids.join(',') } }),
+  getAvailability: (id) => api.get(`/books/${id}/availability`),
   create: (book) => api.post('/books', book),
   delete: (id) => api.delete(`/books/${id}`)
 }
@@ -22,6 +24,7 @@ export const booksAPI = {
 export const readersAPI = {
   getAll: () => api.get('/readers'),
   getById: (id) => api.get(`/readers/${id}`),
+  getByIds: (ids) => api.get('/readers', { params: { ids: ids.join(',') } }),
   create: (reader) => api.post('/readers', reader),
   getRentals: (id) => api.get(`/readers/${id}/rentals`),
   delete: (id) => api.delete(`/readers/${id}`)
@@ -32,8 +35,29 @@ export const rentalsAPI = {
   getAll: (status = 'all') => 
     api.get('/rentals', { params: { status } }),
   create: (rental) => api.post('/rentals', rental),
-  returnBook: (id, damageLevel = null) => 
-    api.post(`/rentals/${id}/return`, { damage_level: damageLevel })
+  returnBook: (id, damageLevel = null, branchId = null) => 
+    api.post(`/rentals/${id}/return`, { damage_level: damageLevel, branch_id: branchId })
+}
+
+// Branches API
+export const branchesAPI = {
+  getAll: () => api.get('/branches'),
+  create: (branch) => api.post('/branches', branch),
+  getBooks: (id, availableOnly = false) => 
+    api.get(`/branches/${id}/books`, { params: { available_only: availableOnly } }),
+  getRentals: (id, status = 'all') => 
+    api.get(`/branches/${id}/rentals`, { params: { status } }),
+  setStock: (id, bookId, totalCopies) => 
+    api.put(`/branches/${id}/stock/${bookId}`, { total_copies: totalCopies })
+}
+
+// Holds API
+export const holdsAPI = {
+  place: (bookId, readerId) => api.post(`/books/${bookId}/holds`, { reader_id: readerId }),
+  getForBook: (bookId) => api.get(`/books/${bookId}/holds`),
+  getForReader: (readerId) => api.get(`/readers/${readerId}/holds`),
+  getNextAvailable: (bookId) => api.get(`/books/${bookId}/next-available`),
+  cancel: (id) => api.delete(`/holds/${id}`)
 }
 
 // Reports API